@@ -70,7 +70,7 @@ export class PolledTokenPairListDO {
     }
 
     async handleRebuildTokensList(request : ForceRefreshTokensRequest) : Promise<ForceRefreshTokensResponse> {
-        await this.tokenTracker.rebuildTokenList(this.state.storage);
+        await this.tokenTracker.rebuildTokenList(this.state.storage, this.env);
         return {};
     }
 
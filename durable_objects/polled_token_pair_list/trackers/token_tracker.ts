@@ -26,7 +26,7 @@ export class TokenTracker {
     }
     async getTokenInfo(tokenAddress : string, env : Env, storage : DurableObjectStorage) : Promise<TokenInfo|undefined> {
 
-        const migrationResult = await this.maybePerformMigration(storage);
+        const migrationResult = await this.maybePerformMigration(storage, env);
         if (migrationResult === 'early-out') {
             logDebug("Early out - migration hasn't happened yet.")
             return undefined;
@@ -36,7 +36,7 @@ export class TokenTracker {
         let maybeTokenInfo = this.tokenInfos[tokenAddressKey.toString()];
         if (maybeTokenInfo == null && (this.isTimeoutExpired(env))) {
             // deliberate fire and forget - next person will have accurate list.
-            this.rebuildTokenList(storage);
+            this.rebuildTokenList(storage, env);
         }       
         return maybeTokenInfo;
     }
@@ -64,7 +64,7 @@ export class TokenTracker {
             return false;
         }
     }
-    async rebuildTokenList(storage : DurableObjectStorage) : Promise<boolean> {
+    async rebuildTokenList(storage : DurableObjectStorage, env : Env) : Promise<boolean> {
 
         // bounce requests to rebuild if already rebuilding
         if (this.isRebuilding) {
@@ -74,7 +74,7 @@ export class TokenTracker {
         this.isRebuilding = true;
         try {
 
-            const jupTokens = await this.getAllTokensFromJupiter();
+            const jupTokens = await this.getAllTokensFromJupiter(env);
             if (jupTokens == null) {
                 return false;
             }
@@ -102,8 +102,8 @@ export class TokenTracker {
         }
         
     }
-    private async getAllTokensFromJupiter() : Promise<Record<string,TokenInfo>|undefined> {
-        const url = "https://token.jup.ag/all";
+    private async getAllTokensFromJupiter(env : Env) : Promise<Record<string,TokenInfo>|undefined> {
+        const url = env.JUPITER_TOKEN_LIST_API_URL;
         const response = await fetch(url);
         if (!response.ok) {
             return;
@@ -156,11 +156,11 @@ export class TokenTracker {
         a.symbol === b.symbol &&
         a.tokenType === b.tokenType;
     }
-    private async maybePerformMigration(storage : DurableObjectStorage) : Promise<'proceed'|'early-out'> {
+    private async maybePerformMigration(storage : DurableObjectStorage, env : Env) : Promise<'proceed'|'early-out'> {
         // version migration
         if (this.migrationFlag.value === 'no-token-type') {
             logDebug("Performing version migration");
-            await this.rebuildTokenList(storage).then(async (success) => {
+            await this.rebuildTokenList(storage, env).then(async (success) => {
                 if (success) {
                     this.migrationFlag.value = 'has-token-type';
                     await this.flushToStorage(storage);
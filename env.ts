@@ -36,6 +36,7 @@ export interface EnvironmentVariables {
 	JUPITER_PRICE_API_URL : string
 	JUPITER_QUOTE_API_URL : string
 	JUPITER_SWAP_API_URL : string
+	JUPITER_TOKEN_LIST_API_URL : string
 	JUPITER_SWAP_PROGRAM_ID : string
 	JUPITER_SWAP_PROGRAM_SLIPPAGE_ERROR_CODE : string
 	JUPITER_SWAP_PROGRAM_FEE_ACCOUNT_NOT_INITIALIZED_ERROR_CODE : string
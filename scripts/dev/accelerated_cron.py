@@ -0,0 +1,117 @@
+from argparse import ArgumentParser, Namespace
+import csv, time, heapq, datetime
+from typing import Any, Dict, List
+import requests
+from cron_common import CronExpression, get_wrangler_crons, invoke_scheduled, utc_datetime, summarize_durations
+from local_dev_common import write_virtual_clock, remove_virtual_clock
+
+"""
+    Runs the worker's scheduled handlers on a virtual clock, so hours of cron-driven work take minutes.
+
+    The virtual clock starts at --start (default: now) and runs for --duration (e.g. 90m, 6h, 1d).
+    The crons are the [triggers] of --env in wrangler.toml (as for cron_scheduler.py), or --cron to pick others.
+    Each tick of each cron fires in virtual time order, at:
+        --speed max    back to back, as fast as the worker finishes them
+        --speed N      N times real time (--speed 60 is one virtual minute per second)
+    Invocations never overlap: each waits for the previous one to finish, and a slow one delays those after it.
+    Each invocation's event.scheduledTime is its virtual time, and the virtual time is published to the
+    virtual clock file so sim processes can follow it (fake_jupiter.py --virtual_clock moves scenario prices along with it).
+
+    Every run's duration is printed, with a summary per cron at the end (or on Ctrl+C).
+    At a fixed --speed, a run that takes longer than the real time between its cron's ticks is flagged as 'behind',
+    since it couldn't keep up at that speed.  --out writes every run to a CSV.
+
+    Example:
+        python3 scripts/dev/accelerated_cron.py --port 8443 --env sim --speed max --duration 1d
+"""
+
+DURATION_UNITS_SECONDS = { "s": 1, "m": 60, "h": 3600, "d": 86400 }
+
+def parse_duration(value : str) -> float:
+    return float(value[:-1]) * DURATION_UNITS_SECONDS[value[-1]]
+
+def parse_speed(value : str) -> float:
+    # 0 means back to back
+    return 0.0 if value == "max" else float(value)
+
+def parse_start(value : str) -> datetime.datetime:
+    start = datetime.datetime.fromisoformat(value)
+    return start if start.tzinfo is not None else start.replace(tzinfo = datetime.timezone.utc)
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument("--port", type = int, required = True)
+    parser.add_argument("--env", type = str, required = False, default = "dev")
+    parser.add_argument("--cron", type = str, nargs = "+", required = False, default = None)
+    parser.add_argument("--speed", type = parse_speed, required = False, default = 0.0)
+    parser.add_argument("--duration", type = parse_duration, required = False, default = parse_duration("1d"))
+    parser.add_argument("--start", type = parse_start, required = False, default = None)
+    parser.add_argument("--out", type = str, required = False, default = None)
+    args = parser.parse_args()
+    return args
+
+def print_run(run : Dict[str,Any]):
+    flag = " BEHIND" if run["behind"] else ""
+    print(f"{run['virtual_time']}  {run['cron']:<16} status={run['status']} {run['duration_ms']:>9.1f}ms{flag}")
+
+def print_summary(runs : List[Dict[str,Any]], elapsed : float, virtual_seconds : float):
+    print(f"Ran {len(runs)} scheduled invocations covering {virtual_seconds / 3600:.2f} virtual hours in {elapsed:.1f} seconds ({virtual_seconds / max(elapsed, 1e-9):.0f}x)")
+    for cron in sorted({ run["cron"] for run in runs }):
+        cron_runs = [ run for run in runs if run["cron"] == cron ]
+        summary = summarize_durations([ run["duration_ms"] for run in cron_runs ])
+        failed = sum(1 for run in cron_runs if run["status"] != 200)
+        behind = sum(1 for run in cron_runs if run["behind"])
+        print(f"  {cron:<16} runs={len(cron_runs)} failed={failed} behind={behind} p50={summary['p50_ms']:.1f}ms p95={summary['p95_ms']:.1f}ms max={summary['max_ms']:.1f}ms")
+
+def write_runs(runs : List[Dict[str,Any]], out_fp : str):
+    with open(out_fp, "w", newline = "") as f:
+        writer = csv.DictWriter(f, fieldnames = ["virtual_time", "cron", "status", "duration_ms", "lag_ms", "behind"])
+        writer.writeheader()
+        writer.writerows(runs)
+
+def do_it(args : Namespace):
+    crons = [ CronExpression(cron) for cron in (args.cron or get_wrangler_crons(args.env)) ]
+    if not crons:
+        print(f"No crons in the [triggers] of '{args.env}' in wrangler.toml")
+        return
+    virtual_start = args.start or utc_datetime(time.time())
+    virtual_end = virtual_start + datetime.timedelta(seconds = args.duration)
+    # (virtual time, cron index) of each cron's next tick
+    ticks = [ (cron.next_after(virtual_start), index) for (index, cron) in enumerate(crons) ]
+    heapq.heapify(ticks)
+    session = requests.Session()
+    runs = []
+    remove_virtual_clock()
+    real_start = time.monotonic()
+    try:
+        while ticks and ticks[0][0] <= virtual_end:
+            fire_at, index = heapq.heappop(ticks)
+            cron = crons[index]
+            elapsed_virtual = (fire_at - virtual_start).total_seconds()
+            lag = 0.0
+            if args.speed > 0:
+                delay = real_start + elapsed_virtual / args.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                lag = max(0.0, -delay)
+            write_virtual_clock(fire_at.timestamp(), elapsed_virtual, args.speed)
+            status, duration_ms = invoke_scheduled(args.port, cron.expression, fire_at.timestamp(), session)
+            next_fire = cron.next_after(fire_at)
+            # The real time this cron gets between ticks at this speed (unlimited when back to back)
+            budget_ms = (next_fire - fire_at).total_seconds() / args.speed * 1000 if args.speed > 0 else float("inf")
+            run = { "virtual_time": fire_at.isoformat(), "cron": cron.expression, "status": status, "duration_ms": round(duration_ms, 1), "lag_ms": round(lag * 1000, 1), "behind": duration_ms > budget_ms }
+            runs.append(run)
+            print_run(run)
+            heapq.heappush(ticks, (next_fire, index))
+    except KeyboardInterrupt:
+        print("Stopped early.")
+    if runs:
+        last_virtual = datetime.datetime.fromisoformat(runs[-1]["virtual_time"])
+        print_summary(runs, time.monotonic() - real_start, (last_virtual - virtual_start).total_seconds())
+    if args.out is not None and runs:
+        write_runs(runs, args.out)
+        print(f"Wrote {len(runs)} runs to {args.out}")
+
+if __name__ == "__main__":
+    args = parse_args()
+    do_it(args)
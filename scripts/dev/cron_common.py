@@ -0,0 +1,98 @@
+import time, datetime
+from typing import Dict, List, Set, Tuple, Union
+import requests
+from local_dev_common import WRANGLER_TOML_FILEPATH, get_wrangler_toml, percentile
+
+"""
+    Shared by the local cron runners: cron expressions, and invoking the worker's scheduled handler.
+
+    Cron expressions are the 5 field (minute hour day-of-month month day-of-week) kind Cloudflare uses, evaluated in UTC.
+    Fields can be *, a number, a range (a-b), a step (*/n or a-b/n), or a comma separated list of those.
+"""
+
+# (lowest, highest) per field.  7 is also Sunday in the day-of-week field.
+CRON_FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+class CronExpression:
+
+    def __init__(self, expression : str):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Expected 5 fields in cron expression: '{expression}'")
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [ parse_cron_field(field, lowest, highest) for (field, (lowest, highest)) in zip(fields, CRON_FIELD_RANGES) ]
+        self.weekdays = { weekday % 7 for weekday in self.weekdays }
+        # When both day fields are restricted, either one matching is enough (as in standard cron)
+        self.days_restricted = fields[2] != "*"
+        self.weekdays_restricted = fields[4] != "*"
+
+    def matches_day(self, when : datetime.datetime) -> bool:
+        day_matches = when.day in self.days
+        # datetime weekdays are Monday = 0, cron's are Sunday = 0
+        weekday_matches = ((when.weekday() + 1) % 7) in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_matches or weekday_matches
+        return day_matches and weekday_matches
+
+    def next_after(self, when : datetime.datetime) -> datetime.datetime:
+        # The first matching minute strictly after `when`
+        candidate = when.replace(second = 0, microsecond = 0) + datetime.timedelta(minutes = 1)
+        # A little over 4 years covers every day-of-month / weekday combination, including Feb 29ths
+        limit = candidate + datetime.timedelta(days = 1500)
+        while candidate < limit:
+            if candidate.month not in self.months or not self.matches_day(candidate):
+                candidate = (candidate + datetime.timedelta(days = 1)).replace(hour = 0, minute = 0)
+            elif candidate.hour not in self.hours:
+                candidate = (candidate + datetime.timedelta(hours = 1)).replace(minute = 0)
+            elif candidate.minute not in self.minutes:
+                candidate += datetime.timedelta(minutes = 1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression never fires: '{self.expression}'")
+
+def parse_cron_field(field : str, lowest : int, highest : int) -> Set[int]:
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/")
+            step = int(step_text)
+        if part == "*":
+            start, end = lowest, highest
+        elif "-" in part:
+            start, end = [ int(bound) for bound in part.split("-") ]
+        else:
+            start = int(part)
+            end = highest if step > 1 else start
+        values.update(range(start, end + 1, step))
+    if not values or min(values) < lowest or max(values) > highest:
+        raise ValueError(f"Cron field '{field}' is out of range {lowest}-{highest}")
+    return values
+
+def get_wrangler_crons(env : str, filepath : str = WRANGLER_TOML_FILEPATH) -> List[str]:
+    # The env's own [env.<env>.triggers] if it has one, otherwise the top level [triggers] it inherits
+    parsed_toml = get_wrangler_toml(filepath)
+    triggers = parsed_toml.get("env", {}).get(env, {}).get("triggers", parsed_toml.get("triggers", {}))
+    return triggers.get("crons", [])
+
+def utc_datetime(timestamp : float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(timestamp, tz = datetime.timezone.utc)
+
+def invoke_scheduled(port : int, cron : str, scheduled_time : Union[float,None] = None, session = None) -> Tuple[Union[int,None],float]:
+    # Runs the worker's scheduled handler for `cron` and waits for it to answer.  Returns (HTTP status or None if it failed, milliseconds)
+    params = { "cron": cron }
+    if scheduled_time is not None:
+        # event.scheduledTime, in ms
+        params["time"] = str(int(scheduled_time * 1000))
+    start = time.perf_counter()
+    try:
+        response = (session or requests).post(f"http://localhost:{port}/__scheduled", params = params)
+        status = response.status_code
+    except Exception as e:
+        print(f"_scheduled invocation of '{cron}' failed: {str(e)}")
+        status = None
+    return status, (time.perf_counter() - start) * 1000
+
+def summarize_durations(durations_ms : List[float]) -> Dict[str,float]:
+    ordered = sorted(durations_ms)
+    return { "p50_ms": percentile(ordered, 50), "p95_ms": percentile(ordered, 95), "max_ms": ordered[-1] }
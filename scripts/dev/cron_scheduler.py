@@ -0,0 +1,129 @@
+from argparse import ArgumentParser, Namespace
+import csv, time, heapq, threading, datetime
+from typing import Any, Dict, List
+from cron_common import CronExpression, get_wrangler_crons, invoke_scheduled, utc_datetime, summarize_durations
+
+"""
+    Fires the worker's scheduled handlers on their real schedules, as Cloudflare would.
+
+    The crons come from the [triggers] of --env in wrangler.toml, so they always match what's deployed.
+    Each tick fires on time whether or not the cron's previous run has finished, and every run's latency is recorded.
+    Runs are flagged when:
+        overlap    the cron's previous run was still going when this one fired
+        slow       the run took more than --slow_fraction of the time until the cron's next tick
+        skipped    ticks were missed entirely (e.g. the machine was asleep), in which case only the latest fires
+    A summary per cron is printed every --summary_minutes, and on Ctrl+C.  --out also writes every run to a CSV.
+
+    Example:
+        python3 scripts/dev/cron_scheduler.py --port 8443 --env dev
+"""
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument("--port", type = int, required = True)
+    parser.add_argument("--env", type = str, required = False, default = "dev")
+    parser.add_argument("--slow_fraction", type = float, required = False, default = 0.8)
+    parser.add_argument("--summary_minutes", type = float, required = False, default = 30.0)
+    parser.add_argument("--out", type = str, required = False, default = None)
+    args = parser.parse_args()
+    return args
+
+class CronRunLog:
+    # Runs finish on their own threads, so everything here is under a lock
+
+    FIELDNAMES = ["scheduled_time", "cron", "status", "duration_ms", "overlap", "slow", "skipped"]
+
+    def __init__(self, out_fp : str):
+        self.lock = threading.Lock()
+        self.runs = []
+        self.in_flight = {}
+        self.out_fp = out_fp
+        if out_fp is not None:
+            with open(out_fp, "w", newline = "") as f:
+                csv.DictWriter(f, fieldnames = self.FIELDNAMES).writeheader()
+
+    def start(self, cron : str) -> bool:
+        # Returns whether a previous run of this cron is still going
+        with self.lock:
+            overlap = self.in_flight.get(cron, 0) > 0
+            self.in_flight[cron] = self.in_flight.get(cron, 0) + 1
+            return overlap
+
+    def finish(self, run : Dict[str,Any]):
+        with self.lock:
+            self.in_flight[run["cron"]] -= 1
+            self.runs.append(run)
+            print_run(run)
+            if self.out_fp is not None:
+                with open(self.out_fp, "a", newline = "") as f:
+                    csv.DictWriter(f, fieldnames = self.FIELDNAMES).writerow(run)
+
+    def snapshot(self) -> List[Dict[str,Any]]:
+        with self.lock:
+            return list(self.runs)
+
+def print_run(run : Dict[str,Any]):
+    flags = [ flag for flag in ("overlap", "slow") if run[flag] ]
+    if run["skipped"]:
+        flags.append(f"skipped={run['skipped']}")
+    print(f"{run['scheduled_time']}  {run['cron']:<16} status={run['status']} {run['duration_ms']:>9.1f}ms {' '.join(flags).upper()}")
+
+def print_summary(runs : List[Dict[str,Any]]):
+    print(f"=== {len(runs)} scheduled runs ===")
+    for cron in sorted({ run["cron"] for run in runs }):
+        cron_runs = [ run for run in runs if run["cron"] == cron ]
+        summary = summarize_durations([ run["duration_ms"] for run in cron_runs ])
+        failed = sum(1 for run in cron_runs if run["status"] != 200)
+        overlaps = sum(1 for run in cron_runs if run["overlap"])
+        slow = sum(1 for run in cron_runs if run["slow"])
+        skipped = sum(run["skipped"] for run in cron_runs)
+        print(f"  {cron:<16} runs={len(cron_runs)} failed={failed} overlap={overlaps} slow={slow} skipped={skipped} p50={summary['p50_ms']:.1f}ms p95={summary['p95_ms']:.1f}ms max={summary['max_ms']:.1f}ms")
+
+def run_cron(args : Namespace, log : CronRunLog, cron : CronExpression, fire_at : datetime.datetime, skipped : int):
+    overlap = log.start(cron.expression)
+    status, duration_ms = invoke_scheduled(args.port, cron.expression, fire_at.timestamp())
+    interval_ms = (cron.next_after(fire_at) - fire_at).total_seconds() * 1000
+    log.finish({
+        "scheduled_time": fire_at.isoformat(),
+        "cron": cron.expression,
+        "status": status,
+        "duration_ms": round(duration_ms, 1),
+        "overlap": overlap,
+        "slow": duration_ms > args.slow_fraction * interval_ms,
+        "skipped": skipped
+    })
+
+def do_it(args : Namespace):
+    crons = [ CronExpression(cron) for cron in get_wrangler_crons(args.env) ]
+    if not crons:
+        print(f"No crons in the [triggers] of '{args.env}' in wrangler.toml")
+        return
+    print(f"Scheduling {', '.join(cron.expression for cron in crons)} for '{args.env}'")
+    log = CronRunLog(args.out)
+    now = utc_datetime(time.time())
+    # (next tick, cron index)
+    ticks = [ (cron.next_after(now), index) for (index, cron) in enumerate(crons) ]
+    heapq.heapify(ticks)
+    next_summary = time.time() + args.summary_minutes * 60
+    try:
+        while True:
+            fire_at, index = heapq.heappop(ticks)
+            time.sleep(max(0.0, fire_at.timestamp() - time.time()))
+            cron = crons[index]
+            # If we woke up past later ticks too, they were missed: fire only the latest
+            now = utc_datetime(time.time())
+            skipped = 0
+            while cron.next_after(fire_at) <= now:
+                fire_at = cron.next_after(fire_at)
+                skipped += 1
+            threading.Thread(target = run_cron, args = (args, log, cron, fire_at, skipped), daemon = True).start()
+            heapq.heappush(ticks, (cron.next_after(fire_at), index))
+            if time.time() >= next_summary:
+                print_summary(log.snapshot())
+                next_summary = time.time() + args.summary_minutes * 60
+    except KeyboardInterrupt:
+        print_summary(log.snapshot())
+
+if __name__ == "__main__":
+    args = parse_args()
+    do_it(args)
@@ -1,9 +1,10 @@
 import psutil # pip install psutil
-import os, sys, socket, time, subprocess, platform
-from typing import List, Union
+import os, sys, copy, json, math, socket, time, threading, subprocess, platform
+from typing import Any, Dict, List, Union
 from argparse import ArgumentTypeError
 import debugpy
 import tomli
+import requests
 
 # Ports
 # port that the cloudflare worker runs on.
@@ -14,20 +15,24 @@ LOCAL_TELEGRAM_BOT_API_SERVER_PORT = 80
 
 MITM_PROXY_SERVER_PORT = 8080
 FAKE_TELEGRAM_SERVER_PORT = 8081
+FAKE_SOLANA_RPC_PORT = 8083
+FAKE_JUPITER_PORT = 8084
 
 # URLs
 LOCAL_CLOUDFLARE_WORKER_URL = f"http://127.0.0.1:{LOCAL_CLOUDFLARE_WORKER_PORT}"
 LOCAL_TELEGRAM_BOT_API_SERVER_ADDRESS = f"http://127.0.0.1:{LOCAL_TELEGRAM_BOT_API_SERVER_PORT}"
 LOCAL_MITM_PROXY_SERVER_ADDRESS = f"http://127.0.0.1:{MITM_PROXY_SERVER_PORT}"
 LOCAL_FAKE_TELEGRAM_SERVER_ADDRESS = f"http://127.0.0.1:{FAKE_TELEGRAM_SERVER_PORT}"
+LOCAL_FAKE_SOLANA_RPC_ADDRESS = f"http://127.0.0.1:{FAKE_SOLANA_RPC_PORT}"
+LOCAL_FAKE_JUPITER_ADDRESS = f"http://127.0.0.1:{FAKE_JUPITER_PORT}"
 
 # Commands
 # --ip is to keep wrangler happy for windows for versions 3.18ish
 START_CLOUDFLARE_LOCAL_WORKER_COMMAND = f'npx wrangler dev --env=dev --port={LOCAL_CLOUDFLARE_WORKER_PORT} --test-scheduled --ip 127.0.0.1'
 START_TELEGRAM_LOCAL_SERVER_COMMAND   = f'telegram-bot-api --api-id={{api_id}} --api-hash={{api_hash}} --dir={{working_dir}} --local --log=log.log --http-port={LOCAL_TELEGRAM_BOT_API_SERVER_PORT}' # --verbosity=4
 TELEGRAM_LOCAL_SERVER_WORKING_DIR = f"telegram_bot_api_working_dir" + os.sep
-START_CRON_POLLER_COMMAND = f'python3 scripts/dev/cron_poller.py --port={LOCAL_CLOUDFLARE_WORKER_PORT}'
-START_TOKEN_LIST_REBUILD_CRON_POLLER_COMMAND = f'python3 scripts/dev/token_list_rebuild_cron_poller.py --port={LOCAL_CLOUDFLARE_WORKER_PORT} --token_list_rebuild_frequency={{token_list_rebuild_frequency}}'
+START_CRON_SCHEDULER_COMMAND = f'python3 scripts/dev/cron_scheduler.py --port={LOCAL_CLOUDFLARE_WORKER_PORT} --env={{env}}'
+START_ACCELERATED_CRON_COMMAND = f'python3 scripts/dev/accelerated_cron.py --port={LOCAL_CLOUDFLARE_WORKER_PORT} --env={{env}} --speed={{speed}} --duration={{duration}}'
 
 def parse_bool(x : Union[str,bool]):
     x = str(x).lower().strip()
@@ -73,14 +78,34 @@ def poll_until_port_is_unoccupied(port, interval = 0.5):
             print(f"Port {port} is still IN USE. Checking again in {interval} seconds.")
             time.sleep(interval)
 
-def poll_until_port_is_occupied(port, interval=0.5):
-    while True:
-        if is_port_in_use(port):
-            print(f"Port {port} is now in use.")
-            break
-        else:
-            print(f"Port {port} is not in use. Checking again in {interval} seconds.")
-            time.sleep(interval)
+def poll_until_port_is_occupied(port, interval = 0.05, max_interval = 1.0):
+    # Backs off from interval to max_interval between tries, and only says something once the port is taken
+    while not is_port_in_use(port):
+        time.sleep(interval)
+        interval = min(max_interval, interval * 2)
+    print(f"Port {port} is now in use.")
+
+def is_ready(port : int, path : Union[str,None] = None) -> bool:
+    # Without a path, ready means accepting connections.  With one, ready means answering a GET on it without a server error.
+    if path is None:
+        return is_port_in_use(port)
+    try:
+        return requests.get(f"http://127.0.0.1:{port}{path}", timeout = 2.0).status_code < 500
+    except requests.RequestException:
+        return False
+
+def wait_until_ready(port : int, path : Union[str,None] = None, timeout : float = 120.0, proc : Union[subprocess.Popen,None] = None, interval : float = 0.05, max_interval : float = 1.0) -> float:
+    # Polls is_ready with exponential backoff.  Returns the seconds waited.
+    # Raises if the timeout passes, or if proc (the process that should be serving) exits first.
+    start = time.monotonic()
+    while not is_ready(port, path):
+        if proc is not None and proc.poll() is not None:
+            raise Exception(f"Process exited with code {proc.returncode} before port {port} was ready")
+        if time.monotonic() - start > timeout:
+            raise Exception(f"Port {port} wasn't ready after {timeout:.0f} seconds")
+        time.sleep(interval)
+        interval = min(max_interval, interval * 2)
+    return time.monotonic() - start
 
 def kill_procs(child_procs : List[subprocess.Popen]):
     
@@ -135,10 +160,184 @@ def pathed(filename : str):
 def sim_dir():
     return pathed("")
 
-def get_sim_setting(name):
-    with open("./scripts/.sim.settings.toml", "rb") as f:
-        parsed_toml = tomli.load(f)
-        return parsed_toml[name]
+# The virtual clock is how an accelerated cron run (dev/accelerated_cron.py) tells other sim processes what time it is.
+# It is written before each scheduled invocation, and followed by e.g. fake_jupiter.py --virtual_clock.
+VIRTUAL_CLOCK_FILENAME = "virtual_clock.json"
+
+def write_virtual_clock(now : float, elapsed_seconds : float, speed : float):
+    filename = pathed(VIRTUAL_CLOCK_FILENAME)
+    tmp_filename = filename + ".tmp"
+    os.makedirs(sim_dir(), exist_ok = True)
+    with open(tmp_filename, "w") as f:
+        json.dump({ "now": now, "elapsed_seconds": elapsed_seconds, "speed": speed }, f)
+    os.replace(tmp_filename, filename)
+
+def remove_virtual_clock():
+    if os.path.exists(pathed(VIRTUAL_CLOCK_FILENAME)):
+        os.remove(pathed(VIRTUAL_CLOCK_FILENAME))
+
+class VirtualClockReader:
+    # Re-reads the clock file only when it has changed.  Each write replaces the file, so its inode changes
+    # even when two writes land within the filesystem's mtime resolution.
+
+    def __init__(self):
+        self.filename = pathed(VIRTUAL_CLOCK_FILENAME)
+        self.file_version = None
+        self.clock = None
+
+    def read(self):
+        # { now, elapsed_seconds, speed }, or None when no accelerated run has started
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        file_version = (stat.st_ino, stat.st_mtime_ns)
+        if file_version != self.file_version:
+            with open(self.filename, "r") as f:
+                self.clock = json.load(f)
+            self.file_version = file_version
+        return self.clock
+
+# Configuration: wrangler.toml, .dev.vars.<env> and scripts/.sim.settings.toml.
+# Every script reads them through get_config, which parses each file once per process and again only when it changes,
+# so reading a setting (several times per simulated action) costs a stat() rather than a parse.
+# Each file's schema is checked whenever it's (re)parsed.
+
+WRANGLER_TOML_FILEPATH = "./wrangler.toml"
+SIM_SETTINGS_FILEPATH = "./scripts/.sim.settings.toml"
+
+def dev_vars_filepath(env : str) -> str:
+    return f".dev.vars.{env}"
+
+# Types of the settings the scripts read from .sim.settings.toml
+SIM_SETTINGS_SCHEMA = {
+    "num_users": int,
+    "user_spinup_delay_seconds": float,
+    "user_funding_amount": float,
+    "user_response_delay_multiplier": float,
+    "debuggers_to_attach": list,
+    "waiting_debuggers": list,
+    "solana_rpc_url": str,
+    "market_scenario": str,
+    "fake_jupiter_tokens": list,
+    "telegram_global_rate_limit": float,
+    "telegram_chat_rate_limit": float,
+    "telegram_chat_burst": float,
+    "telegram_too_many_requests_rate": float,
+    "telegram_server_error_rate": float,
+    "telegram_latency_ms": float,
+    "telegram_latency_sigma": float
+}
+
+def is_of_type(value, expected_type : type) -> bool:
+    # TOML ints are fine where a float is expected.  Booleans are ints to python, but not here.
+    if isinstance(value, bool):
+        return expected_type is bool
+    if expected_type is float:
+        return isinstance(value, (int, float))
+    return isinstance(value, expected_type)
+
+def validate_sim_settings(filepath : str, parsed : Dict[str,Any]):
+    for name, value in parsed.items():
+        if name not in SIM_SETTINGS_SCHEMA:
+            print(f"{filepath}: '{name}' isn't a setting any script reads")
+        elif not is_of_type(value, SIM_SETTINGS_SCHEMA[name]):
+            raise Exception(f"{filepath}: '{name}' should be of type {SIM_SETTINGS_SCHEMA[name].__name__}, was {value!r}")
+
+def validate_dev_vars(filepath : str, parsed : Dict[str,Any]):
+    # They're pushed to Cloudflare as secrets and vars, which are strings
+    for key, value in parsed.items():
+        if not isinstance(value, str):
+            raise Exception(f"{filepath}: '{key}' should be a string, was {value!r}")
+
+def validate_wrangler_toml(filepath : str, parsed : Dict[str,Any]):
+    # The parts of it the scripts read, at the top level and in each [env.<env>]
+    environments = { "": parsed, **{ f"env.{env}.": table for (env, table) in parsed.get("env", {}).items() } }
+    for prefix, table in environments.items():
+        if not isinstance(table, dict):
+            raise Exception(f"{filepath}: '{prefix[:-1]}' should be a table")
+        if not isinstance(table.get("name", ""), str):
+            raise Exception(f"{filepath}: '{prefix}name' should be a string")
+        if not isinstance(table.get("vars", {}), dict):
+            raise Exception(f"{filepath}: '{prefix}vars' should be a table")
+        crons = table.get("triggers", {}).get("crons", [])
+        if not isinstance(crons, list) or not all(isinstance(cron, str) for cron in crons):
+            raise Exception(f"{filepath}: '{prefix}triggers.crons' should be a list of strings")
+
+class ConfigFile:
+    # A TOML file, re-parsed only when it has changed.  Like VirtualClockReader, a change is a new (inode, mtime, size),
+    # so an editor's save-by-replace or a write within the mtime resolution is still noticed.
+
+    def __init__(self, filepath : str, validate = None, missing_ok : bool = False):
+        self.filepath = filepath
+        self.validate = validate
+        # Whether a missing file reads as empty rather than raising
+        self.missing_ok = missing_ok
+        self.lock = threading.Lock()
+        self.file_version = None
+        self.parsed = None
+
+    def get(self) -> Dict[str,Any]:
+        # The parsed file is shared: don't modify it
+        try:
+            stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            if not self.missing_ok:
+                raise
+            # Read again once it's created
+            self.file_version = None
+            return dict()
+        file_version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if file_version != self.file_version:
+            with self.lock:
+                if file_version != self.file_version:
+                    with open(self.filepath, "rb") as f:
+                        parsed = tomli.load(f)
+                    if self.validate is not None:
+                        self.validate(self.filepath, parsed)
+                    self.parsed = parsed
+                    self.file_version = file_version
+        return self.parsed
+
+_config_files : Dict[str,ConfigFile] = dict()
+_config_files_lock = threading.Lock()
+
+def get_config(filepath : str, validate = None, missing_ok : bool = False) -> Dict[str,Any]:
+    with _config_files_lock:
+        if filepath not in _config_files:
+            _config_files[filepath] = ConfigFile(filepath, validate, missing_ok)
+        config_file = _config_files[filepath]
+    return config_file.get()
+
+def get_wrangler_toml(filepath : str = WRANGLER_TOML_FILEPATH) -> Dict[str,Any]:
+    return get_config(filepath, validate_wrangler_toml)
+
+def get_dev_vars(env : str) -> Dict[str,Any]:
+    return get_config(dev_vars_filepath(env), validate_dev_vars)
+
+def get_sim_settings() -> Dict[str,Any]:
+    # .sim.settings.toml isn't committed, so a fresh checkout has none: every setting then takes its default
+    return get_config(SIM_SETTINGS_FILEPATH, validate_sim_settings, missing_ok = True)
+
+_NO_DEFAULT = object()
+
+def get_sim_setting(name, default = _NO_DEFAULT):
+    sim_settings = get_sim_settings()
+    if default is not _NO_DEFAULT:
+        value = sim_settings.get(name, default)
+    elif name in sim_settings:
+        value = sim_settings[name]
+    else:
+        raise Exception(f"'{name}' isn't set in {SIM_SETTINGS_FILEPATH}, and has no default")
+    # Lists and tables are copied, so callers can't change the cached settings
+    return copy.deepcopy(value) if isinstance(value, (list, dict)) else value
+
+def percentile(sorted_values : List[float], pct : float) -> float:
+    # nearest-rank
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
 
 def maybe_attach_debugger(name, debug_port):
     if name in get_sim_setting("debuggers_to_attach"):
@@ -0,0 +1,178 @@
+from argparse import ArgumentParser, Namespace
+import sys, csv, json, time, datetime
+from typing import Any, Dict, Iterable, List, Tuple, Union
+from pull_logs import create_read_only_connection
+from query_logs import to_epoch_ms, DURATION_UNITS_MS
+from local_dev_common import percentile
+
+"""
+    Turns the logs pulled into .logs.db by pull_logs.py into performance data.
+
+    Every trace event is attributed to a path:
+        <DO class>.<method>   a call to a durable object (UserDO, TokenPairPositionTrackerDO, PolledTokenPairListDO, HeartbeatDO, ...)
+        menu:<MenuCode>       a webhook invocation that handled a menu click
+        <event type>          anything else (fetch, scheduled, ...)
+
+    For each path, the report gives invocation counts, error rate (Outcome other than 'ok', or a 5xx),
+    wall time percentiles and CPU time, overall and (with --by_bucket) per --bucket of time.
+
+    `ms/100 positions` is how much a path's p95 wall time moves per 100 more positions being active in a bucket
+    (a least squares fit over buckets, where active = distinct position IDs mentioned in that bucket's logs).
+    It shows which paths get slower as position counts grow.
+
+    Examples:
+        python3 log_analytics.py --since 7d --bucket 6h
+        python3 log_analytics.py --since 1d --path UserDO --by_bucket --out userdo.csv
+"""
+
+REPORT_COLUMNS = ["path", "count", "errors", "error_rate", "wall_p50_ms", "wall_p95_ms", "wall_p99_ms", "cpu_mean_ms", "cpu_p95_ms", "ms_per_100_positions"]
+BUCKET_REPORT_COLUMNS = ["bucket", "active_positions"] + REPORT_COLUMNS[:-1]
+
+# Fewer buckets than this with positions in them and the fit is noise
+MIN_BUCKETS_FOR_FIT = 3
+
+def to_duration_ms(value : str) -> int:
+    return int(value[:-1]) * DURATION_UNITS_MS[value[-1]]
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument("--since", type = to_epoch_ms, required = False, default = None)
+    parser.add_argument("--until", type = to_epoch_ms, required = False, default = None)
+    parser.add_argument("--bucket", type = to_duration_ms, required = False, default = to_duration_ms("1h"))
+    # Only paths starting with this, e.g. 'menu:' or 'TokenPairPositionTrackerDO'
+    parser.add_argument("--path", type = str, required = False, default = None)
+    parser.add_argument("--by_bucket", action = "store_true")
+    parser.add_argument("--out", type = str, required = False, default = None)
+    args = parser.parse_args()
+    return args
+
+def path_of(do_class : Union[str,None], do_method : Union[str,None], event_type : Union[str,None], menu_code : Union[str,None]) -> str:
+    if do_class is not None:
+        return f"{do_class}.{do_method}"
+    if menu_code is not None:
+        return f"menu:{menu_code}"
+    return event_type or "unknown"
+
+def is_error(outcome : Union[str,None], response_status : Union[int,None]) -> bool:
+    return (outcome is not None and outcome != "ok") or (response_status is not None and response_status >= 500)
+
+def iter_invocations(conn, since : int, until : int) -> Iterable[Tuple[int,str,Union[int,None],Union[int,None],bool]]:
+    # (timestampMS, path, wall time, cpu time, is error) per trace event
+    sql = ''' SELECT l.timestampMS, l.do_class, l.do_method, l.event_type, c.menu_code, l.wall_time_ms, l.cpu_time_ms, l.outcome, l.response_status
+              FROM logs l LEFT JOIN (
+                SELECT event_id, min(menu_code) AS menu_code FROM log_messages
+                WHERE menu_code IS NOT NULL AND timestampMS >= ? AND timestampMS < ?
+                GROUP BY event_id
+              ) c ON c.event_id = l.event_id
+              WHERE l.timestampMS >= ? AND l.timestampMS < ? '''
+    for row in conn.execute(sql, (since, until, since, until)):
+        timestampMS, do_class, do_method, event_type, menu_code, wall_time_ms, cpu_time_ms, outcome, response_status = row
+        yield timestampMS, path_of(do_class, do_method, event_type, menu_code), wall_time_ms, cpu_time_ms, is_error(outcome, response_status)
+
+def active_positions_by_bucket(conn, since : int, until : int, bucket_ms : int) -> Dict[int,int]:
+    sql = ''' SELECT timestampMS - (timestampMS % ?) AS bucket, count(DISTINCT position_id) FROM log_messages
+              WHERE position_id IS NOT NULL AND timestampMS >= ? AND timestampMS < ?
+              GROUP BY bucket '''
+    return { bucket: count for (bucket, count) in conn.execute(sql, (bucket_ms, since, until)) }
+
+def slope(xs : List[float], ys : List[float]) -> Union[float,None]:
+    # least squares fit of y = a + b*x; returns b
+    if len(xs) < MIN_BUCKETS_FOR_FIT:
+        return None
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+
+class PathStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.wall_times : List[int] = []
+        self.cpu_times : List[int] = []
+
+    def add(self, wall_time_ms : Union[int,None], cpu_time_ms : Union[int,None], error : bool):
+        self.count += 1
+        self.errors += 1 if error else 0
+        if wall_time_ms is not None:
+            self.wall_times.append(wall_time_ms)
+        if cpu_time_ms is not None:
+            self.cpu_times.append(cpu_time_ms)
+
+    def summarize(self) -> Dict[str,Any]:
+        wall_times, cpu_times = sorted(self.wall_times), sorted(self.cpu_times)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "error_rate": round(self.errors / self.count, 4),
+            "wall_p50_ms": percentile(wall_times, 50) if wall_times else None,
+            "wall_p95_ms": percentile(wall_times, 95) if wall_times else None,
+            "wall_p99_ms": percentile(wall_times, 99) if wall_times else None,
+            "cpu_mean_ms": round(sum(cpu_times) / len(cpu_times), 2) if cpu_times else None,
+            "cpu_p95_ms": percentile(cpu_times, 95) if cpu_times else None
+        }
+
+def make_report(invocations : Iterable[Tuple[int,str,Union[int,None],Union[int,None],bool]], active_positions : Dict[int,int], bucket_ms : int, path_prefix : Union[str,None]) -> Dict[str,Any]:
+    overall : Dict[str,PathStats] = dict()
+    by_bucket : Dict[Tuple[int,str],PathStats] = dict()
+    for (timestampMS, path, wall_time_ms, cpu_time_ms, error) in invocations:
+        if path_prefix is not None and not path.startswith(path_prefix):
+            continue
+        bucket = timestampMS - (timestampMS % bucket_ms)
+        overall.setdefault(path, PathStats()).add(wall_time_ms, cpu_time_ms, error)
+        by_bucket.setdefault((bucket, path), PathStats()).add(wall_time_ms, cpu_time_ms, error)
+    bucket_rows = []
+    for (bucket, path) in sorted(by_bucket):
+        bucket_rows.append({ "bucket": bucket, "active_positions": active_positions.get(bucket, 0), "path": path, **by_bucket[(bucket, path)].summarize() })
+    rows = []
+    for path in sorted(overall):
+        fit_points = [ (row["active_positions"], row["wall_p95_ms"]) for row in bucket_rows if row["path"] == path and row["wall_p95_ms"] is not None and row["bucket"] in active_positions ]
+        growth = slope([ x for (x, _) in fit_points ], [ y for (_, y) in fit_points ])
+        rows.append({ "path": path, **overall[path].summarize(), "ms_per_100_positions": round(growth * 100, 2) if growth is not None else None })
+    return { "bucket_ms": bucket_ms, "rows": rows, "bucket_rows": bucket_rows }
+
+def format_bucket(bucket : int) -> str:
+    return datetime.datetime.fromtimestamp(bucket / 1000, tz = datetime.timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+def fmt(value : Any) -> str:
+    return "-" if value is None else str(value)
+
+def print_report(report : Dict[str,Any], by_bucket : bool):
+    print(f"{'path':<50} {'count':>8} {'err%':>6} {'p50':>7} {'p95':>7} {'p99':>7} {'cpu':>6} {'cpu95':>6} {'ms/100 positions':>17}")
+    for row in report["rows"]:
+        print(f"{row['path']:<50} {row['count']:>8} {row['error_rate'] * 100:>6.2f} {fmt(row['wall_p50_ms']):>7} {fmt(row['wall_p95_ms']):>7} {fmt(row['wall_p99_ms']):>7} {fmt(row['cpu_mean_ms']):>6} {fmt(row['cpu_p95_ms']):>6} {fmt(row['ms_per_100_positions']):>17}")
+    if not by_bucket:
+        return
+    print()
+    print(f"{'bucket':<17} {'positions':>9} {'path':<50} {'count':>8} {'err%':>6} {'p50':>7} {'p95':>7} {'p99':>7} {'cpu':>6}")
+    for row in report["bucket_rows"]:
+        print(f"{format_bucket(row['bucket']):<17} {row['active_positions']:>9} {row['path']:<50} {row['count']:>8} {row['error_rate'] * 100:>6.2f} {fmt(row['wall_p50_ms']):>7} {fmt(row['wall_p95_ms']):>7} {fmt(row['wall_p99_ms']):>7} {fmt(row['cpu_mean_ms']):>6}")
+
+def write_report(report : Dict[str,Any], out_fp : str, by_bucket : bool):
+    if out_fp.endswith(".csv"):
+        with open(out_fp, "w", newline = "") as f:
+            columns = BUCKET_REPORT_COLUMNS if by_bucket else REPORT_COLUMNS
+            writer = csv.DictWriter(f, fieldnames = columns, extrasaction = "ignore")
+            writer.writeheader()
+            writer.writerows(report["bucket_rows"] if by_bucket else report["rows"])
+    else:
+        with open(out_fp, "w") as f:
+            json.dump(report, f, indent = 1)
+
+def do_it(args : Namespace):
+    conn = create_read_only_connection()
+    if conn is None:
+        sys.exit(1)
+    since = args.since if args.since is not None else 0
+    until = args.until if args.until is not None else int(time.time() * 1000)
+    active_positions = active_positions_by_bucket(conn, since, until, args.bucket)
+    report = make_report(iter_invocations(conn, since, until), active_positions, args.bucket, args.path)
+    print_report(report, args.by_bucket)
+    if args.out is not None:
+        write_report(report, args.out, args.by_bucket)
+        print(f"Wrote report to {args.out}")
+
+if __name__ == "__main__":
+    args = parse_args()
+    do_it(args)
@@ -7,11 +7,13 @@ def parse_args():
     parser = ArgumentParser()
     parser.add_argument("--frequency", type = int, required = True)
     parser.add_argument("--token", type = str, required = True)
+    # e.g. http://127.0.0.1:8084/v6/price for fake_jupiter.py
+    parser.add_argument("--price_api_url", type = str, required = False, default = "https://price.jup.ag/v6/price")
     args = parser.parse_args()
     return args
 
 def do_it(args):
-    url = f'https://price.jup.ag/v6/price?ids={args.token.strip()}&vsToken={SOL_ADDRESS}'
+    url = f'{args.price_api_url}?ids={args.token.strip()}&vsToken={SOL_ADDRESS}'
     initial_price = None
     last_price = None
     max_price = None
@@ -1,28 +1,165 @@
 from argparse import ArgumentParser, ArgumentError
-import sys, hashlib, requests, datetime, time, hashlib, json, dateutil, dateutil.parser, sqlite3
-from typing import Iterable, Tuple, Union
+import sys, hashlib, requests, datetime, time, hashlib, json, dateutil, dateutil.parser, sqlite3, threading, queue, re
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Iterable, List, Tuple, Union
 from wrangler_common import get_secret
 from tqdm import tqdm
 
 MAX_PULL_CHUNK = 1000
 MIN_PROCESS_CHUNK = 50
 
+# Rows inserted (and checkpointed) per transaction
+COMMIT_BATCH_SIZE = 50000
+# Bytes read off the socket at a time while streaming the NDJSON response
+STREAM_CHUNK_BYTES = 1 << 16
+
+# Backfill: [start, end] is split into windows this long, fetched by a pool of this many threads
+DEFAULT_WINDOW_MINUTES = 60
+DEFAULT_FETCH_WORKERS = 8
+# Lines a fetch thread hands to the writer at a time, and how many hand-offs can be waiting
+FETCH_BATCH_SIZE = 5000
+FETCH_QUEUE_DEPTH = 32
+
 DB_FILE = ".logs.db"
 
+# Logpush can deliver a log this long after it happened, so a pull only counts as finished once its end is older than this
+LOGPUSH_DELIVERY_DELAY_MINUTES = 15
+
+# Bumped whenever existing .logs.db files need migrating (see migrate_schema)
+SCHEMA_VERSION = 3
+
+CONNECTION_PRAGMAS = [
+    # Readers (queries, analytics) don't block the loader and vice versa
+    "PRAGMA journal_mode = WAL",
+    # Durable at checkpoint granularity, which is all a re-pullable cache needs
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536"
+]
+
+# One row per trace event. The columns after `content` are pulled out of it at ingest (see extract_log_fields)
 CREATE_LOGS_TABLE_SQL_1 = """ CREATE TABLE IF NOT EXISTS logs (
                                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                                         event_id INTEGER NOT NULL,
                                         timestampMS integer NOT NULL,
-                                        content text NOT NULL
+                                        content text NOT NULL,
+                                        outcome text,
+                                        script_name text,
+                                        event_type text,
+                                        do_class text,
+                                        do_method text,
+                                        request_url text,
+                                        response_status integer,
+                                        cpu_time_ms integer,
+                                        wall_time_ms integer
                                     ); 
 """
 
+# Columns added to `logs` by schema version 2, for migrating older .logs.db files
+LOG_FIELD_COLUMNS = [
+    ("outcome", "text"),
+    ("script_name", "text"),
+    ("event_type", "text"),
+    ("do_class", "text"),
+    ("do_method", "text"),
+    ("request_url", "text"),
+    ("response_status", "integer"),
+    ("cpu_time_ms", "integer"),
+    ("wall_time_ms", "integer")
+]
+
+# One row per console message in a trace event's `Logs`
+CREATE_LOG_MESSAGES_TABLE_SQL = """ CREATE TABLE IF NOT EXISTS log_messages (
+                                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                        event_id INTEGER NOT NULL,
+                                        seq integer NOT NULL,
+                                        timestampMS integer NOT NULL,
+                                        level text,
+                                        user_id integer,
+                                        position_id text,
+                                        token_address text,
+                                        menu_code text,
+                                        message text NOT NULL
+                                    );
+"""
+
+# Full text search over log_messages.message, kept in sync by sync_message_search_index
+CREATE_LOG_MESSAGES_FTS_SQL = """ CREATE VIRTUAL TABLE IF NOT EXISTS log_messages_fts
+                                    USING fts5(message, content = 'log_messages', content_rowid = 'id');
+"""
+
+# How far into log_messages the FTS index has got. (Reading max(rowid) off log_messages_fts
+# itself would read the content table, not the index.)
+CREATE_SEARCH_INDEX_PROGRESS_SQL = """ CREATE TABLE IF NOT EXISTS search_index_progress (
+                                        id integer PRIMARY KEY CHECK (id = 0),
+                                        last_indexed_id integer NOT NULL
+                                    );
+"""
+
+# Secondary indexes, dropped for first loads (see deferred_index_builds).
+# Lookups by an extracted field are nearly always bounded in time, hence (field, timestampMS).
+CREATE_FIELD_INDEXES_SQL = [
+    "CREATE INDEX IF NOT EXISTS idx_outcome ON logs (outcome, timestampMS);",
+    "CREATE INDEX IF NOT EXISTS idx_script_name ON logs (script_name, timestampMS);",
+    "CREATE INDEX IF NOT EXISTS idx_do_class ON logs (do_class, do_method, timestampMS);",
+    "CREATE INDEX IF NOT EXISTS idx_messages_timestampMS ON log_messages (timestampMS);",
+    "CREATE INDEX IF NOT EXISTS idx_messages_user_id ON log_messages (user_id, timestampMS);",
+    "CREATE INDEX IF NOT EXISTS idx_messages_position_id ON log_messages (position_id, timestampMS);",
+    "CREATE INDEX IF NOT EXISTS idx_messages_token_address ON log_messages (token_address, timestampMS);",
+    "CREATE INDEX IF NOT EXISTS idx_messages_level ON log_messages (level, timestampMS);",
+    "CREATE INDEX IF NOT EXISTS idx_messages_menu_code ON log_messages (menu_code, timestampMS);"
+]
+
+FIELD_INDEX_NAMES = [ re.search(r"EXISTS (\w+) ON", sql).group(1) for sql in CREATE_FIELD_INDEXES_SQL ] # type: ignore
+
+CREATE_MESSAGES_UNIQUE_INDEX_SQL = """
+                            CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_event_id ON log_messages (event_id, seq);
+"""
+
+DEDUPLICATE_LOG_MESSAGES_SQL = """
+                            DELETE FROM log_messages WHERE id NOT IN (SELECT min(id) FROM log_messages GROUP BY event_id, seq);
+"""
+
+# Durable object stubs are called as http://<host>/<method> - the host says which class
+DO_CLASS_BY_HOST = {
+    "userdo": "UserDO",
+    "tokenpairpositiontracker": "TokenPairPositionTrackerDO",
+    "tokenpairpositiontrackerdo": "TokenPairPositionTrackerDO",
+    "polledtokenpairlistdo": "PolledTokenPairListDO",
+    "hearbeatdo.blah": "HeartbeatDO",
+    "betainvitecodes.blah": "BetaInviteCodesDO"
+}
+
+# The worker's logger writes `[key]: [value]` pairs joined by ' :: '
+USER_ID_PATTERN = re.compile(r"\[(?:telegramUserID|userID)\]: \[(\d+)\]")
+POSITION_ID_PATTERN = re.compile(r"\[positionID\]: \[([^\]]+)\]")
+TOKEN_ADDRESS_PATTERN = re.compile(r"\[tokenAddress\]: \[([1-9A-HJ-NP-Za-km-z]{32,44})\]")
+# logDebug(":::USER-CLICKED:::", menuCode, menuArg, telegramUserID)
+USER_CLICKED_PATTERN = re.compile(r":::USER-CLICKED::: // ([^\s/]+) // [^/]* // (\d+)")
+
 CREATE_LOGS_TABLE_SQL_2 = """                                     
                             CREATE INDEX IF NOT EXISTS idx_timestampMS ON logs (timestampMS);
 """
 
 CREATE_LOGS_TABLE_SQL_3 = """
-                            CREATE INDEX IF NOT EXISTS idx_event_id ON logs (event_id);
+                            CREATE UNIQUE INDEX IF NOT EXISTS idx_event_id ON logs (event_id);
+"""
+
+# Keeps the first copy of each event
+DEDUPLICATE_LOGS_SQL = """
+                            DELETE FROM logs WHERE id NOT IN (SELECT min(id) FROM logs GROUP BY event_id);
+"""
+
+# Resume cursor for each pull: the newest timestamp among the logs it has committed.
+# A restarted pull asks for logs from there on (see resume_params), and INSERT OR IGNORE drops any it already has.
+# done is only set once the pull's end is older than the Logpush delivery delay, so a recent range is always pulled again.
+CREATE_CHECKPOINTS_TABLE_SQL = """ CREATE TABLE IF NOT EXISTS pull_checkpoints (
+                                        pull_key text PRIMARY KEY,
+                                        committed_through_ms integer,
+                                        done integer NOT NULL
+                                    );
 """
 
 def create_connection():
@@ -30,42 +167,187 @@ def create_connection():
     conn = None
     try:
         conn = sqlite3.connect(DB_FILE)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
         ensure_log_table_exists(conn)
+        migrate_schema(conn)
+        build_indexes(conn)
         return conn
     except Exception as e:
         print(str(e))
         return None
     
+def create_read_only_connection():
+    """Connect to the logs database to query it.  Doesn't create, migrate or index anything, so never waits on a running pull."""
+    try:
+        return sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri = True)
+    except Exception as e:
+        print(f"{str(e)} - run pull_logs.py to create {DB_FILE}")
+        return None
+
 def ensure_log_table_exists(conn : Union[sqlite3.Connection,None]):
     if conn is None:
-        conn = create_connection(DB_FILE)
-    if conn is None:
-        raise Exception()
+        raise Exception("No connection to create the logs table with")
     try:
         c = conn.cursor()
         c.execute(CREATE_LOGS_TABLE_SQL_1)
-        c.execute(CREATE_LOGS_TABLE_SQL_2)
-        c.execute(CREATE_LOGS_TABLE_SQL_3)
+        c.execute(CREATE_LOG_MESSAGES_TABLE_SQL)
+        c.execute(CREATE_LOG_MESSAGES_FTS_SQL)
+        c.execute(CREATE_SEARCH_INDEX_PROGRESS_SQL)
+        c.execute(CREATE_CHECKPOINTS_TABLE_SQL)
+        conn.commit()
     except Exception as e:
         print(str(e))
         print(e)
 
-def insert_log_entry(conn, eventID, timestampMS, log_entry):
-    sql = ''' INSERT INTO logs(timestampMS,content)
-              VALUES(?,?,?)
-              ON CONFLICT(eventID) DO UPDATE SET '''
-    cur = conn.cursor()
-    cur.execute(sql, eventID, timestampMS, log_entry)
+def migrate_schema(conn : sqlite3.Connection):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < 1:
+        # event_id was a 31 bit hash, which collides within a few hundred thousand logs.
+        # Recompute it as a 63 bit hash so a unique index on it is safe to enforce.
+        conn.create_function("event_id_of", 1, hash_to_int, deterministic = True)
+        conn.execute("DROP INDEX IF EXISTS idx_event_id")
+        conn.execute("UPDATE logs SET event_id = event_id_of(content)")
+    if version < 2:
+        # Pull the queryable fields out of logs stored before they were extracted at ingest
+        existing_columns = [ row[1] for row in conn.execute("PRAGMA table_info(logs)") ]
+        for column, column_type in LOG_FIELD_COLUMNS:
+            if column not in existing_columns:
+                conn.execute(f"ALTER TABLE logs ADD COLUMN {column} {column_type}")
+        extract_fields_of_stored_logs(conn)
+    if version < 3:
+        # Checkpoints used to count lines of the response, which assumed it came back in the same order every time
+        conn.execute("DROP TABLE IF EXISTS pull_checkpoints")
+        conn.execute(CREATE_CHECKPOINTS_TABLE_SQL)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+
+def extract_fields_of_stored_logs(conn : sqlite3.Connection):
+    update_sql = ''' UPDATE logs SET outcome = ?, script_name = ?, event_type = ?, do_class = ?, do_method = ?,
+                     request_url = ?, response_status = ?, cpu_time_ms = ?, wall_time_ms = ? WHERE id = ? '''
+    select_sql = ''' SELECT id, event_id, content FROM logs WHERE id > ? ORDER BY id LIMIT ? '''
+    last_id = 0
+    progress = tqdm(unit = " logs", desc = "Extracting log fields")
+    while True:
+        rows = conn.execute(select_sql, (last_id, COMMIT_BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        updates, message_rows = [], []
+        for (id, event_id, content) in rows:
+            log_fields, messages = extract_log_fields(event_id, json.loads(content))
+            updates.append((*log_fields, id))
+            message_rows.extend(messages)
+        conn.executemany(update_sql, updates)
+        insert_log_messages(conn, message_rows)
+        conn.commit()
+        last_id = rows[-1][0]
+        progress.update(len(rows))
+    progress.close()
+
+def has_index(conn : sqlite3.Connection, name : str) -> bool:
+    sql = ''' SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ? '''
+    return conn.execute(sql, (name,)).fetchone() is not None
+
+def build_indexes(conn : sqlite3.Connection):
+    # Duplicates can only exist if the unique index was missing (first load, or a migration)
+    if not has_index(conn, "idx_event_id"):
+        conn.execute(DEDUPLICATE_LOGS_SQL)
+    if not has_index(conn, "idx_messages_event_id"):
+        conn.execute(DEDUPLICATE_LOG_MESSAGES_SQL)
+    conn.execute(CREATE_LOGS_TABLE_SQL_2)
+    conn.execute(CREATE_LOGS_TABLE_SQL_3)
+    conn.execute(CREATE_MESSAGES_UNIQUE_INDEX_SQL)
+    for sql in CREATE_FIELD_INDEXES_SQL:
+        conn.execute(sql)
+    conn.commit()
+    sync_message_search_index(conn)
+
+def drop_indexes(conn : sqlite3.Connection):
+    conn.execute("DROP INDEX IF EXISTS idx_timestampMS")
+    conn.execute("DROP INDEX IF EXISTS idx_event_id")
+    conn.execute("DROP INDEX IF EXISTS idx_messages_event_id")
+    for index_name in FIELD_INDEX_NAMES:
+        conn.execute(f"DROP INDEX IF EXISTS {index_name}")
     conn.commit()
-    return cur.lastrowid
 
-def insert_log_entries(conn : sqlite3.Connection, log_entries : Iterable[Tuple[int,int,str]]):
-    sql = ''' INSERT INTO logs(timestampMS,content)
-              VALUES(?,?,?) '''
-    cur = conn.executemany(sql, log_entries)
+def sync_message_search_index(conn : sqlite3.Connection):
+    # log_messages is append-only (once deduplicated), so the FTS index just needs the rows past the last one it has
+    row = conn.execute("SELECT last_indexed_id FROM search_index_progress WHERE id = 0").fetchone()
+    last_indexed = row[0] if row is not None else 0
+    conn.execute("INSERT INTO log_messages_fts(rowid, message) SELECT id, message FROM log_messages WHERE id > ?", (last_indexed,))
+    conn.execute(''' INSERT INTO search_index_progress(id, last_indexed_id) SELECT 0, coalesce(max(id), 0) FROM log_messages WHERE true
+                     ON CONFLICT(id) DO UPDATE SET last_indexed_id = excluded.last_indexed_id ''')
     conn.commit()
+
+@contextmanager
+def deferred_index_builds(conn : sqlite3.Connection):
+    # Loading into an empty table is much faster without indexes; build them once at the end.
+    # If the load dies part way, the next create_connection builds them (and dedups) instead.
+    first_load = conn.execute("SELECT 1 FROM logs LIMIT 1").fetchone() is None
+    if first_load:
+        drop_indexes(conn)
+    try:
+        yield
+    finally:
+        if first_load:
+            print("Building indexes")
+            build_indexes(conn)
+
+def insert_log_entries(conn : sqlite3.Connection, log_entries : List[Tuple[Tuple,List[Tuple]]]):
+    # Does not commit - the caller commits along with the resume checkpoint.
+    # Re-pulling an overlapping window is idempotent: events already stored are skipped.
+    sql = ''' INSERT OR IGNORE INTO logs(event_id,timestampMS,content,outcome,script_name,event_type,do_class,do_method,request_url,response_status,cpu_time_ms,wall_time_ms)
+              VALUES(?,?,?,?,?,?,?,?,?,?,?,?) '''
+    cur = conn.executemany(sql, [ log_row for (log_row, _) in log_entries ])
+    insert_log_messages(conn, [ message_row for (_, message_rows) in log_entries for message_row in message_rows ])
     return cur.lastrowid
 
+def insert_log_messages(conn : sqlite3.Connection, message_rows : List[Tuple]):
+    sql = ''' INSERT OR IGNORE INTO log_messages(event_id,seq,timestampMS,level,user_id,position_id,token_address,menu_code,message)
+              VALUES(?,?,?,?,?,?,?,?,?) '''
+    conn.executemany(sql, message_rows)
+
+def read_checkpoint(conn : sqlite3.Connection, pull_key : str) -> Tuple[Union[int,None],bool]:
+    # (newest timestamp committed, or None if nothing yet, whether the pull is finished)
+    sql = ''' SELECT committed_through_ms, done FROM pull_checkpoints WHERE pull_key = ? '''
+    row = conn.execute(sql, (pull_key,)).fetchone()
+    if row is None:
+        return None, False
+    return row[0], bool(row[1])
+
+def write_checkpoint(conn : sqlite3.Connection, pull_key : str, committed_through_ms : Union[int,None], done : bool):
+    sql = ''' INSERT INTO pull_checkpoints(pull_key,committed_through_ms,done)
+              VALUES(?,?,?)
+              ON CONFLICT(pull_key) DO UPDATE SET committed_through_ms = coalesce(excluded.committed_through_ms, committed_through_ms), done = excluded.done '''
+    conn.execute(sql, (pull_key, committed_through_ms, int(done)))
+
+def newest_timestamp(batch : List[Tuple[Tuple,List[Tuple]]], committed_through_ms : Union[int,None]) -> Union[int,None]:
+    # The newest timestamp committed once batch is, given the newest before it
+    timestamps = [ log_row[1] for (log_row, _) in batch ]
+    if committed_through_ms is not None:
+        timestamps.append(committed_through_ms)
+    return max(timestamps, default = None)
+
+def is_settled(end : Union[str,None]) -> bool:
+    # Whether Logpush has delivered everything up to end, so pulling up to it again can't find anything new
+    if end is None:
+        return False
+    settled_before = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo = None) - datetime.timedelta(minutes = LOGPUSH_DELIVERY_DELAY_MINUTES)
+    return rfc_to_utc_datetime(end) < settled_before
+
+def resume_params(params, committed_through_ms : Union[int,None]):
+    # Restarts a pull from the newest log it committed, less the delivery delay so that logs delivered late aren't missed
+    if committed_through_ms is None:
+        return params
+    resume_from_ms = committed_through_ms - LOGPUSH_DELIVERY_DELAY_MINUTES * 60 * 1000
+    start_ms = rfc_to_utc_datetime(params["start"]).replace(tzinfo = datetime.timezone.utc).timestamp() * 1000
+    if resume_from_ms <= start_ms:
+        return params
+    return { **params, "start": epoch_ms_to_rfc(resume_from_ms) }
+
+def make_pull_key(params) -> str:
+    return json.dumps({ key: params.get(key) for key in ["start", "end", "limit", "bucket"] }, sort_keys = True)
+
 
 def maybeTimestampRFC3339(dt : Union[str,None]) -> Union[str,None]:
     if dt is None:
@@ -102,29 +384,90 @@ def parse_args():
     parser.add_argument("--start", type = maybeTimestampRFC3339, required = False, default = None)
     parser.add_argument("--end", type = maybeTimestampRFC3339, required = False, default = None)
     parser.add_argument("--limit", type = maybeInt, required = False, default = None)
+    # Fetches [start, end] as concurrent windows. Re-running the same backfill resumes it.
+    parser.add_argument("--backfill", action = "store_true")
+    parser.add_argument("--window_minutes", type = int, required = False, default = DEFAULT_WINDOW_MINUTES)
+    parser.add_argument("--fetch_workers", type = int, required = False, default = DEFAULT_FETCH_WORKERS)
+    # Pull ranges again even if they're marked as finished
+    parser.add_argument("--force", action = "store_true")
     args = parser.parse_args()
+    if args.backfill and args.end is None:
+        parser.error("--backfill requires --end")
     return args
 
-def iter_parse_logs(text : str) -> Iterable[Tuple[int,str]]:
-    lines = text.splitlines(keepends = False)
-    for line in tqdm(lines):
-        parsed_log_entry = json.loads(line)
-        timestampMS = parsed_log_entry["EventTimestampMs"]
-        event_id = hash_to_int(line)
-        yield (event_id, timestampMS, parsed_log_entry)
+def parse_log_line(line : bytes) -> Tuple[Tuple,List[Tuple]]:
+    # (logs row, log_messages rows)
+    content = line.decode('utf-8').strip()
+    parsed_log_entry = json.loads(content)
+    timestampMS = parsed_log_entry["EventTimestampMs"]
+    event_id = hash_to_int(content)
+    log_fields, message_rows = extract_log_fields(event_id, parsed_log_entry)
+    return (event_id, timestampMS, content, *log_fields), message_rows
+
+def extract_log_fields(event_id : int, log_entry : Any) -> Tuple[Tuple,List[Tuple]]:
+    event = log_entry.get("Event") or dict()
+    request = event.get("Request") or dict()
+    response = event.get("Response") or dict()
+    request_url = request.get("URL") or request.get("url")
+    response_status = response.get("status") or response.get("Status")
+    do_class, do_method = describe_durable_object_call(request_url)
+    log_fields = (
+        log_entry.get("Outcome"),
+        log_entry.get("ScriptName"),
+        log_entry.get("EventType"),
+        log_entry.get("Entrypoint") or do_class,
+        do_method,
+        request_url,
+        response_status,
+        log_entry.get("CPUTimeMs"),
+        log_entry.get("WallTimeMs")
+    )
+    message_rows = []
+    for seq, log in enumerate(log_entry.get("Logs") or []):
+        message = " ".join(str(part) for part in (log.get("Message") or []))
+        user_id, position_id, token_address, menu_code = extract_message_fields(message)
+        message_rows.append((event_id, seq, log.get("TimestampMs") or log_entry["EventTimestampMs"], log.get("Level"), user_id, position_id, token_address, menu_code, message))
+    return log_fields, message_rows
+
+def describe_durable_object_call(request_url : Union[str,None]) -> Tuple[Union[str,None],Union[str,None]]:
+    # (durable object class, method) if the request was a call to a durable object stub
+    if not request_url:
+        return None, None
+    parsed_url = urlparse(request_url)
+    do_class = DO_CLASS_BY_HOST.get((parsed_url.hostname or "").lower())
+    if do_class is None:
+        return None, None
+    return do_class, parsed_url.path.strip("/") or None
+
+def extract_message_fields(message : str) -> Tuple[Union[int,None],Union[str,None],Union[str,None],Union[str,None]]:
+    # (user_id, position_id, token_address, menu_code) mentioned in a log message
+    user_id, menu_code = None, None
+    user_clicked = USER_CLICKED_PATTERN.search(message)
+    if user_clicked is not None:
+        menu_code, user_id = user_clicked.group(1), int(user_clicked.group(2))
+    else:
+        user_id_match = USER_ID_PATTERN.search(message)
+        user_id = int(user_id_match.group(1)) if user_id_match else None
+    position_id_match = POSITION_ID_PATTERN.search(message)
+    token_address_match = TOKEN_ADDRESS_PATTERN.search(message)
+    return (user_id,
+        position_id_match.group(1) if position_id_match else None,
+        token_address_match.group(1) if token_address_match else None,
+        menu_code)
 
 def hash_to_int(line : str):
     line = line.strip()
     hash_bytes = hashlib.sha256(line.encode('utf-8')).digest()
     hash_int = int.from_bytes(hash_bytes, byteorder='big')
-    mod_value = 2**31-1
+    # fits in a (signed 64 bit) sqlite INTEGER
+    mod_value = 2**63-1
     return hash_int % mod_value
 
 def find_last_max_timestamp_ms(conn : sqlite3.Connection):
     sql = ''' SELECT max(timestampMS) FROM logs'''
     return conn.execute(sql).fetchone()[0]
 
-def do_it(env : str, start : str, end : str, limit : Union[int,None]):
+def do_it(env : str, start : Union[str,None], end : Union[str,None], limit : Union[int,None], backfill : bool = False, window_minutes : int = DEFAULT_WINDOW_MINUTES, fetch_workers : int = DEFAULT_FETCH_WORKERS, force : bool = False):
 
     account_id = get_secret("SECRET_R2_ACCOUNT_ID", env)
     url = f'https://api.cloudflare.com/client/v4/accounts/{account_id}/logs/retrieve'
@@ -142,30 +485,138 @@ def do_it(env : str, start : str, end : str, limit : Union[int,None]):
 
     bucket = get_secret("SECRET__R2_LOGPUSH1_BUCKET", env)
 
+    if start is None:
+        conn = create_connection()
+        start = get_rfc_max_timestamp_from_db(conn)
+        conn.close()
+
     params = {
         "start": start,
         "end": end,
         "bucket": bucket
     }
 
-    if start is None:
-        start = find_last_max_timestamp_ms() or TimestampRFC3339('1970-01-01')
-
     if end is None:
         limit = MAX_PULL_CHUNK
 
     if limit is not None:
         params["limit"] = limit
 
-    if end is not None:
-        process_all_logs_in_range(url, headers, params)
+    if backfill:
+        backfill_logs_in_range(url, headers, params, window_minutes, fetch_workers, force)
+    elif end is not None:
+        process_all_logs_in_range(url, headers, params, force)
     else:
         process_until_few_logs_left(url, headers, params)
         
-def process_all_logs_in_range(url, headers, params):
-    log_entries = iter_fetch_logs(url,headers,params)
+def process_all_logs_in_range(url, headers, params, force : bool = False):
+    conn = create_connection()
+    with deferred_index_builds(conn):
+        ingest_logs(conn, url, headers, params, force)
+    sync_message_search_index(conn)
+    print("Done!")
+
+def rfc_to_utc_datetime(rfc : str) -> datetime.datetime:
+    parsed = dateutil.parser.parse(rfc)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo = None)
+    return parsed
+
+def split_into_windows(params, window_minutes : int) -> List[dict]:
+    # One set of request params per window. Windows share their boundaries,
+    # and anything pulled twice is deduplicated on insert.
+    start = rfc_to_utc_datetime(params["start"])
+    end = rfc_to_utc_datetime(params["end"])
+    step = datetime.timedelta(minutes = window_minutes)
+    windows = []
+    while start < end:
+        window_end = min(start + step, end)
+        windows.append({ **params, "start": start.isoformat() + 'Z', "end": window_end.isoformat() + 'Z' })
+        start = window_end
+    return windows
+
+def put_unless_stopped(fetched : queue.Queue, item, stop : threading.Event):
+    # Blocks while the writer is behind, but gives up if the backfill is abandoned
+    while not stop.is_set():
+        try:
+            fetched.put(item, timeout = 1.0)
+            return
+        except queue.Full:
+            continue
+
+def fetch_window(url, headers, params, committed_through_ms : Union[int,None], fetched : queue.Queue, stop : threading.Event):
+    # Runs on a fetch thread. Never touches sqlite - everything goes through the queue to the writer,
+    # along with the newest timestamp committed once it is (the window's resume cursor).
+    pull_key = make_pull_key(params)
+    batch = []
+    try:
+        for line in iter_fetch_log_lines(url, headers, resume_params(params, committed_through_ms)):
+            if stop.is_set():
+                return
+            batch.append(parse_log_line(line))
+            if len(batch) >= FETCH_BATCH_SIZE:
+                committed_through_ms = newest_timestamp(batch, committed_through_ms)
+                put_unless_stopped(fetched, ("batch", pull_key, committed_through_ms, batch), stop)
+                batch = []
+        committed_through_ms = newest_timestamp(batch, committed_through_ms)
+        put_unless_stopped(fetched, ("done", pull_key, committed_through_ms, batch), stop)
+    except Exception as e:
+        put_unless_stopped(fetched, ("failed", pull_key, committed_through_ms, e), stop)
+
+def backfill_logs_in_range(url, headers, params, window_minutes : int, fetch_workers : int, force : bool = False):
     conn = create_connection()
-    insert_in_batches(conn, log_entries)
+    windows = split_into_windows(params, window_minutes)
+    # Per-window progress is the window's pull checkpoint: done windows are skipped (unless --force), partial ones resume.
+    # Windows ending within the Logpush delivery delay are never done, so running the backfill again picks up their late logs.
+    pending = []
+    settled = dict()
+    for window in windows:
+        pull_key = make_pull_key(window)
+        committed_through_ms, done = read_checkpoint(conn, pull_key)
+        settled[pull_key] = is_settled(window["end"])
+        if force:
+            pending.append((window, None))
+        elif not done:
+            pending.append((window, committed_through_ms))
+    print(f"{len(windows)} windows, {len(windows) - len(pending)} already pulled")
+    if not pending:
+        return
+    fetched = queue.Queue(maxsize = FETCH_QUEUE_DEPTH)
+    stop = threading.Event()
+    failed = []
+    uncommitted = 0
+    with deferred_index_builds(conn), ThreadPoolExecutor(max_workers = fetch_workers, thread_name_prefix = "fetch-logs") as pool:
+        try:
+            for window, committed_through_ms in pending:
+                pool.submit(fetch_window, url, headers, window, committed_through_ms, fetched, stop)
+            remaining = len(pending)
+            progress = tqdm(total = remaining, unit = " windows")
+            while remaining > 0:
+                kind, pull_key, committed_through_ms, payload = fetched.get()
+                if kind == "failed":
+                    print(f"Failed to pull {pull_key}: {str(payload)}")
+                    failed.append(pull_key)
+                    remaining -= 1
+                    progress.update(1)
+                    continue
+                # The single writer: rows and the window's checkpoint go in the same transaction
+                insert_log_entries(conn, payload)
+                write_checkpoint(conn, pull_key, committed_through_ms, done = (kind == "done" and settled[pull_key]))
+                uncommitted += len(payload)
+                if kind == "done":
+                    remaining -= 1
+                    progress.update(1)
+                if uncommitted >= COMMIT_BATCH_SIZE or kind == "done":
+                    conn.commit()
+                    uncommitted = 0
+            progress.close()
+        finally:
+            conn.commit()
+            stop.set()
+    sync_message_search_index(conn)
+    if failed:
+        print(f"{len(failed)} windows failed - run the same backfill again to retry them")
+    print("Done!")
 
 def process_until_few_logs_left(url, headers, params):
     if params["end"] is None:
@@ -174,10 +625,11 @@ def process_until_few_logs_left(url, headers, params):
     conn = create_connection()
     while has_a_lot:
         params["start"] = get_rfc_max_timestamp_from_db(conn)
-        log_entries = iter_fetch_logs(url,headers,params)
-        total = insert_in_batches(conn, log_entries)
-        if total == 0:
+        total = ingest_logs(conn, url, headers, params)
+        # Each pull starts at the newest log we have, so it always re-reads at least that one
+        if total < MIN_PROCESS_CHUNK:
             has_a_lot = False
+    sync_message_search_index(conn)
     print("Done!")
 
 def get_rfc_max_timestamp_from_db(conn : sqlite3.Connection):
@@ -188,32 +640,49 @@ def get_rfc_max_timestamp_from_db(conn : sqlite3.Connection):
         return epoch_ms_to_rfc(timestamp)
 
 def epoch_ms_to_rfc(timestamp : int):
-    return datetime.datetime.fromtimestamp(timestamp / 1000).isoformat() + 'Z'
+    return datetime.datetime.fromtimestamp(timestamp / 1000, tz = datetime.timezone.utc).replace(tzinfo = None).isoformat() + 'Z'
 
-def iter_fetch_logs(url,headers,params) -> Iterable[Tuple[int,str]]:
-    response = requests.get(url, headers=headers, params = params)
+def iter_fetch_log_lines(url,headers,params) -> Iterable[bytes]:
+    # Streams the NDJSON response body, so memory use doesn't depend on how many logs come back
+    response = requests.get(url, headers=headers, params = params, stream = True)
     if not response.ok:
         raise Exception(response.status_code)
-    try:
-        logs = (response.text)
-    except:
-        raise Exception("No JSON in response")
-    return iter_parse_logs(list(logs))
-
-def insert_in_batches(conn : sqlite3.Connection, log_entries : Iterable[Tuple[int,int,str]]) -> int:
+    with response:
+        for line in response.iter_lines(chunk_size = STREAM_CHUNK_BYTES):
+            if line:
+                yield line
+
+def ingest_logs(conn : sqlite3.Connection, url, headers, params, force : bool = False) -> int:
+    # Returns the number of lines ingested by this call
+    pull_key = make_pull_key(params)
+    committed_through_ms, done = read_checkpoint(conn, pull_key)
+    if done and not force:
+        print(f"Already pulled (--force to pull again): {pull_key}")
+        return 0
+    if force:
+        committed_through_ms = None
+    request_params = resume_params(params, committed_through_ms)
+    if request_params is not params:
+        print(f"Resuming from {request_params['start']}: {pull_key}")
+    ingested = 0
     batch = []
-    count = 0
-    for log_entry in log_entries:
-        count += 1
-        maxTimestampMS = max(log_entry[0],maxTimestampMS)
-        batch.append(log_entry)
-        if len(batch) >= 100:
-            print(f"Inserting batch of {len(batch)}")
-            insert_log_entries(conn, batch)
-            print("   Done.")
+    for line in tqdm(iter_fetch_log_lines(url, headers, request_params), unit = " lines"):
+        batch.append(parse_log_line(line))
+        if len(batch) >= COMMIT_BATCH_SIZE:
+            committed_through_ms = commit_batch(conn, batch, pull_key, committed_through_ms, done = False)
+            ingested += len(batch)
             batch = []
-    return count
-    
+    commit_batch(conn, batch, pull_key, committed_through_ms, done = is_settled(params["end"]))
+    ingested += len(batch)
+    return ingested
+
+def commit_batch(conn : sqlite3.Connection, batch : List[Tuple[Tuple,List[Tuple]]], pull_key : str, committed_through_ms : Union[int,None], done : bool) -> Union[int,None]:
+    # The rows and the resume cursor that covers them land in the same transaction.  Returns the new cursor.
+    committed_through_ms = newest_timestamp(batch, committed_through_ms)
+    insert_log_entries(conn, batch)
+    write_checkpoint(conn, pull_key, committed_through_ms, done)
+    conn.commit()
+    return committed_through_ms
 
 
 
@@ -224,4 +693,4 @@ if __name__ == "__main__":
     start = args.start
     end = args.end
     limit = args.limit
-    do_it(env, start, end, limit)
\ No newline at end of file
+    do_it(env, start, end, limit, args.backfill, args.window_minutes, args.fetch_workers, args.force)
\ No newline at end of file
@@ -0,0 +1,119 @@
+from argparse import ArgumentParser, Namespace
+import sys, re, json, time, datetime
+from typing import Any, List, Tuple
+from pull_logs import create_read_only_connection, rfc_to_utc_datetime
+
+"""
+    Queries the logs pulled into .logs.db by pull_logs.py, using the fields it extracts at ingest.
+
+    Filters on a message (--user_id, --position_id, --token_address, --menu_code, --level, --search)
+    return matching console messages. Otherwise the query returns trace events (--outcome, --script_name, --do_class, --do_method).
+    Every filter is backed by an index that leads with the field and then the timestamp, so a time-bounded lookup
+    like "all logs for position X in the last hour" does not scan the table.
+
+    --search is an FTS5 query over message text, e.g. `--search '"insufficient funds" OR slippage'`.
+    --since and --until take a timestamp, or a duration back from now like 90s, 30m, 1h or 7d.
+
+    Examples:
+        python3 query_logs.py --position_id 1a2b3c --since 1h
+        python3 query_logs.py --do_class TokenPairPositionTrackerDO --outcome exception --since 1d --format json
+"""
+
+DURATION_UNITS_MS = { "s": 1000, "m": 60 * 1000, "h": 60 * 60 * 1000, "d": 24 * 60 * 60 * 1000 }
+
+MESSAGE_FILTERS = ["user_id", "position_id", "token_address", "menu_code", "level"]
+EVENT_FILTERS = ["outcome", "script_name", "do_class", "do_method"]
+
+def to_epoch_ms(value : str) -> int:
+    duration = re.fullmatch(r"(\d+)([smhd])", value.strip())
+    if duration is not None:
+        return int(time.time() * 1000) - int(duration.group(1)) * DURATION_UNITS_MS[duration.group(2)]
+    parsed = rfc_to_utc_datetime(value)
+    return int(parsed.replace(tzinfo = datetime.timezone.utc).timestamp() * 1000)
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument("--since", type = to_epoch_ms, required = False, default = None)
+    parser.add_argument("--until", type = to_epoch_ms, required = False, default = None)
+    parser.add_argument("--user_id", type = int, required = False, default = None)
+    parser.add_argument("--position_id", type = str, required = False, default = None)
+    parser.add_argument("--token_address", type = str, required = False, default = None)
+    parser.add_argument("--menu_code", type = str, required = False, default = None)
+    parser.add_argument("--level", type = str, required = False, default = None)
+    parser.add_argument("--search", type = str, required = False, default = None)
+    parser.add_argument("--outcome", type = str, required = False, default = None)
+    parser.add_argument("--script_name", type = str, required = False, default = None)
+    parser.add_argument("--do_class", type = str, required = False, default = None)
+    parser.add_argument("--do_method", type = str, required = False, default = None)
+    parser.add_argument("--limit", type = int, required = False, default = 100)
+    parser.add_argument("--format", choices = ["text", "json"], required = False, default = "text")
+    args = parser.parse_args()
+    return args
+
+def is_message_query(args : Namespace) -> bool:
+    return args.search is not None or any(getattr(args, field) is not None for field in MESSAGE_FILTERS)
+
+def build_query(args : Namespace) -> Tuple[str,List[Any]]:
+    # Newest matches first, so --limit keeps the most recent ones
+    message_query = is_message_query(args)
+    timestamp_column = "m.timestampMS" if message_query else "l.timestampMS"
+    where, params = [], []
+    for field in MESSAGE_FILTERS:
+        if getattr(args, field) is not None:
+            where.append(f"m.{field} = ?")
+            params.append(getattr(args, field))
+    for field in EVENT_FILTERS:
+        if getattr(args, field) is not None:
+            where.append(f"l.{field} = ?")
+            params.append(getattr(args, field))
+    if args.search is not None:
+        where.append("m.id IN (SELECT rowid FROM log_messages_fts WHERE log_messages_fts MATCH ?)")
+        params.append(args.search)
+    if args.since is not None:
+        where.append(f"{timestamp_column} >= ?")
+        params.append(args.since)
+    if args.until is not None:
+        where.append(f"{timestamp_column} < ?")
+        params.append(args.until)
+    if message_query:
+        sql = ''' SELECT m.timestampMS, m.level, l.do_class, l.do_method, l.outcome, m.message, l.event_id, l.content
+                  FROM log_messages m JOIN logs l ON l.event_id = m.event_id '''
+    else:
+        sql = ''' SELECT l.timestampMS, NULL, l.do_class, l.do_method, l.outcome, l.request_url, l.event_id, l.content
+                  FROM logs l '''
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {timestamp_column} DESC LIMIT ?"
+    params.append(args.limit)
+    return sql, params
+
+def format_row(row : Tuple) -> str:
+    timestampMS, level, do_class, do_method, outcome, text, _, _ = row
+    when = datetime.datetime.fromtimestamp(timestampMS / 1000, tz = datetime.timezone.utc).isoformat(timespec = "milliseconds")
+    where = f"{do_class}/{do_method}" if do_class is not None else "worker"
+    return f"{when} [{level or '-'}] {where} ({outcome}) :: {text}"
+
+def do_it(args : Namespace):
+    conn = create_read_only_connection()
+    if conn is None:
+        sys.exit(1)
+    sql, params = build_query(args)
+    start = time.perf_counter()
+    rows = conn.execute(sql, params).fetchall()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    rows.reverse()
+    if args.format == "json":
+        # One trace event per line, even if several of its messages matched
+        printed = set()
+        for row in rows:
+            if row[6] not in printed:
+                printed.add(row[6])
+                print(row[7])
+    else:
+        for row in rows:
+            print(format_row(row))
+    print(f"{len(rows)} rows in {elapsed_ms:.1f}ms", file = sys.stderr)
+
+if __name__ == "__main__":
+    args = parse_args()
+    do_it(args)
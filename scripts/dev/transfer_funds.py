@@ -4,12 +4,22 @@ from solders.system_program import TransferParams, transfer
 from solana.rpc.api import Client
 from solana.transaction import Transaction
 
-def transfer_sol(sender_keypair_str : str, receiver_pubkey_str: str, amount_sol: float):
+MAINNET_RPC_URL = "https://api.mainnet-beta.solana.com"
+
+# One client (and connection pool) per RPC URL, rather than one per transfer
+_clients = dict()
+
+def get_client(rpc_url : str) -> Client:
+    if rpc_url not in _clients:
+        _clients[rpc_url] = Client(rpc_url)
+    return _clients[rpc_url]
+
+def transfer_sol(sender_keypair_str : str, receiver_pubkey_str: str, amount_sol: float, rpc_url : str = MAINNET_RPC_URL):
 
     print("Attempting to fund Wallet")
     
-    # Connect to Solana mainnet
-    client = Client("https://api.mainnet-beta.solana.com")
+    # Mainnet, unless pointed at the fake RPC (see fake_solana_rpc.py)
+    client = get_client(rpc_url)
 
     # Receiver's public key
     receiver_pubkey = Pubkey.from_string(receiver_pubkey_str)
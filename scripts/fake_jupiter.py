@@ -0,0 +1,329 @@
+from flask import Flask, request, jsonify
+import time, base64, random, signal, sys
+import requests
+from argparse import ArgumentParser
+from typing import Any, Dict, List, Tuple, Union
+from solders.pubkey import Pubkey
+from solders.hash import Hash
+from solders.instruction import Instruction, AccountMeta
+from solders.message import MessageV0
+from solders.signature import Signature
+from solders.transaction import VersionedTransaction
+from solders.compute_budget import set_compute_unit_limit, set_compute_unit_price
+from dev.local_dev_common import *
+from market_scenarios import read_scenario, ScenarioPriceModel
+from fake_solana_rpc import (encode_sim_swap, derive_token_account, SIM_SWAP_PROGRAM_ID, SIM_SWAP_BUY, SIM_SWAP_SELL,
+    TOKEN_PROGRAM_ID, ASSOCIATED_TOKEN_PROGRAM_ID, SYSTEM_PROGRAM_ID, WRAPPED_SOL_MINT)
+
+"""
+    A local stand-in for Jupiter's v6 price, quote and swap APIs, so the buy / sell and price polling paths
+    run offline, at rates the real API would throttle.
+
+        GET  /all   (the token list)
+        GET  /v6/price?ids=<mint>,<mint>&vsToken=<mint>
+        GET  /v6/quote?inputMint=&outputMint=&amount=&slippageBps=&platformFeeBps=&swapMode=ExactIn
+        POST /v6/swap   { quoteResponse, userPublicKey, ... }
+
+    Prices come from a price model (the mid price of each token in SOL, over time), and quotes from
+    a constant product pool around that mid price with --pool_fee_bps and the token's liquidity_sol of depth.
+    The same price at the same time gives the same quote.  Tokens that aren't SOL route through SOL.
+
+    With --scenario (or market_scenario in .sim.settings.toml), the scenario's tokens are added and their prices
+    follow the scenario from when this server starts (see market_scenarios.py).  Otherwise prices are static.
+    With --virtual_clock, the scenario instead follows the virtual clock of dev/accelerated_cron.py.
+
+    The tokens are the fake_jupiter_tokens list in .sim.settings.toml (or DEFAULT_TOKENS):
+        [[fake_jupiter_tokens]]
+        address = "WENWENvqqNya429ubCdR81ZmD69brwQaaBYY6p3LCpk"
+        symbol = "WEN"
+        decimals = 5
+        price = 0.00000067     # in SOL
+        liquidity_sol = 2000
+
+    Swap transactions are built for fake_solana_rpc.py, which applies the quoted amounts when they land.
+    Their blockhash comes from --solana_rpc_url.  Only swaps to or from SOL are supported.
+
+    --price_latency_ms, --quote_latency_ms and --swap_latency_ms (+/- --latency_jitter_ms) delay each endpoint's responses.
+"""
+
+app = Flask(__name__)
+
+price_model = None
+settings = None
+# Set with --virtual_clock: scenario time follows dev/accelerated_cron.py rather than the wall clock
+clock_reader = None
+
+SOL_DECIMALS = 9
+MAX_BASIS_POINTS = 10_000
+COMPUTE_UNIT_LIMIT = 1_400_000
+
+DEFAULT_TOKENS = [
+    { "address": WRAPPED_SOL_MINT, "symbol": "SOL", "decimals": SOL_DECIMALS, "price": 1.0 },
+    { "address": "WENWENvqqNya429ubCdR81ZmD69brwQaaBYY6p3LCpk", "symbol": "WEN", "decimals": 5, "price": 0.00000067, "liquidity_sol": 2000.0 }
+]
+DEFAULT_LIQUIDITY_SOL = 1000.0
+
+class StaticPriceModel:
+    # Each token's configured price, forever
+
+    def __init__(self, tokens : List[Dict[str,Any]]):
+        self.prices = { token["address"]: float(token["price"]) for token in tokens }
+
+    def price(self, address : str, now : float) -> Union[float,None]:
+        return self.prices.get(address)
+
+class FakeJupiterSettings:
+    def __init__(self, tokens : List[Dict[str,Any]], pool_fee_bps : int, latency_ms : Dict[str,float], latency_jitter_ms : float, solana_rpc_url : str):
+        self.tokens = { token["address"]: token for token in tokens }
+        self.tokens.setdefault(WRAPPED_SOL_MINT, DEFAULT_TOKENS[0])
+        self.pool_fee_bps = pool_fee_bps
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.solana_rpc_url = solana_rpc_url
+        self.session = requests.Session()
+
+class QuoteFailure(Exception):
+    pass
+
+def current_time() -> float:
+    if clock_reader is None:
+        return time.time()
+    # Seconds into the accelerated run, which is also seconds into the scenario
+    clock = clock_reader.read()
+    return clock["elapsed_seconds"] if clock is not None else 0.0
+
+def simulate_latency(endpoint : str):
+    delay_ms = settings.latency_ms.get(endpoint, 0.0) + random.uniform(-settings.latency_jitter_ms, settings.latency_jitter_ms)
+    if delay_ms > 0:
+        time.sleep(delay_ms / 1000)
+
+def price_in_sol(address : str, now : float) -> float:
+    if address == WRAPPED_SOL_MINT:
+        return 1.0
+    price = price_model.price(address, now) if address in settings.tokens else None
+    if price is None or price <= 0:
+        raise QuoteFailure(f"Could not find any route: no price for {address}")
+    return price
+
+def pool_reserves(address : str, now : float) -> Tuple[int,int]:
+    # (lamports, token base units) of a constant product pool whose spot price is the token's mid price
+    token = settings.tokens[address]
+    lamports = int(float(token.get("liquidity_sol", DEFAULT_LIQUIDITY_SOL)) * 10**SOL_DECIMALS)
+    lamports_per_base_unit = price_in_sol(address, now) * 10**(SOL_DECIMALS - token["decimals"])
+    return lamports, int(lamports / lamports_per_base_unit)
+
+def swap_through_pool(in_reserve : int, out_reserve : int, in_amount : int) -> Tuple[int,int]:
+    # (out amount, pool fee in input units)
+    fee = in_amount * settings.pool_fee_bps // MAX_BASIS_POINTS
+    in_after_fee = in_amount - fee
+    return out_reserve * in_after_fee // (in_reserve + in_after_fee), fee
+
+def route_hop(input_mint : str, output_mint : str, in_amount : int, now : float) -> Dict[str,Any]:
+    if input_mint == WRAPPED_SOL_MINT:
+        sol_reserve, token_reserve = pool_reserves(output_mint, now)
+        out_amount, fee = swap_through_pool(sol_reserve, token_reserve, in_amount)
+        spot_out = in_amount * token_reserve / sol_reserve
+        pool_token = output_mint
+    else:
+        sol_reserve, token_reserve = pool_reserves(input_mint, now)
+        out_amount, fee = swap_through_pool(token_reserve, sol_reserve, in_amount)
+        spot_out = in_amount * sol_reserve / token_reserve
+        pool_token = input_mint
+    return {
+        "swapInfo": {
+            "ammKey": derive_token_account(pool_token, SIM_SWAP_PROGRAM_ID),
+            "label": "Fake Jupiter",
+            "inputMint": input_mint,
+            "outputMint": output_mint,
+            "inAmount": str(in_amount),
+            "outAmount": str(out_amount),
+            "feeAmount": str(fee),
+            "feeMint": input_mint
+        },
+        "percent": 100,
+        "spotOutAmount": spot_out
+    }
+
+def make_quote(input_mint : str, output_mint : str, amount : int, slippage_bps : int, platform_fee_bps : int, swap_mode : str, now : float) -> Dict[str,Any]:
+    if swap_mode != "ExactIn":
+        raise QuoteFailure(f"Unsupported swapMode: {swap_mode}")
+    if input_mint == output_mint:
+        raise QuoteFailure("inputMint and outputMint must differ")
+    if amount <= 0:
+        raise QuoteFailure("amount must be positive")
+    if WRAPPED_SOL_MINT in (input_mint, output_mint):
+        hops = [ route_hop(input_mint, output_mint, amount, now) ]
+    else:
+        first_hop = route_hop(input_mint, WRAPPED_SOL_MINT, amount, now)
+        hops = [ first_hop, route_hop(WRAPPED_SOL_MINT, output_mint, int(first_hop["swapInfo"]["outAmount"]), now) ]
+    routed_amount = int(hops[-1]["swapInfo"]["outAmount"])
+    spot_amount = amount * price_in_sol(input_mint, now) / price_in_sol(output_mint, now) * 10**(settings.tokens[output_mint]["decimals"] - settings.tokens[input_mint]["decimals"])
+    platform_fee = routed_amount * platform_fee_bps // MAX_BASIS_POINTS
+    out_amount = routed_amount - platform_fee
+    for hop in hops:
+        del hop["spotOutAmount"]
+    return {
+        "inputMint": input_mint,
+        "inAmount": str(amount),
+        "outputMint": output_mint,
+        "outAmount": str(out_amount),
+        "otherAmountThreshold": str(out_amount * (MAX_BASIS_POINTS - slippage_bps) // MAX_BASIS_POINTS),
+        "swapMode": swap_mode,
+        "slippageBps": slippage_bps,
+        "platformFee": { "amount": str(platform_fee), "feeBps": platform_fee_bps } if platform_fee_bps > 0 else None,
+        "priceImpactPct": str(max(0.0, 1 - routed_amount / spot_amount)) if spot_amount > 0 else "0",
+        "routePlan": hops,
+        "contextSlot": 0,
+        "timeTaken": 0.0
+    }
+
+"""
+    Swap transactions
+"""
+
+def create_token_account_idempotent(payer : Pubkey, owner : Pubkey, mint : str, token_program_id : str) -> Instruction:
+    token_account = Pubkey.from_string(derive_token_account(mint, str(owner), token_program_id))
+    accounts = [
+        AccountMeta(payer, is_signer = True, is_writable = True),
+        AccountMeta(token_account, is_signer = False, is_writable = True),
+        AccountMeta(owner, is_signer = False, is_writable = False),
+        AccountMeta(Pubkey.from_string(mint), is_signer = False, is_writable = False),
+        AccountMeta(Pubkey.from_string(SYSTEM_PROGRAM_ID), is_signer = False, is_writable = False),
+        AccountMeta(Pubkey.from_string(token_program_id), is_signer = False, is_writable = False)
+    ]
+    return Instruction(Pubkey.from_string(ASSOCIATED_TOKEN_PROGRAM_ID), bytes([1]), accounts)
+
+def sim_swap(user : Pubkey, token : Dict[str,Any], direction : int, in_amount : int, out_amount : int) -> Instruction:
+    token_program_id = token.get("token_program", TOKEN_PROGRAM_ID)
+    accounts = [
+        AccountMeta(user, is_signer = True, is_writable = True),
+        AccountMeta(Pubkey.from_string(derive_token_account(token["address"], str(user), token_program_id)), is_signer = False, is_writable = True),
+        AccountMeta(Pubkey.from_string(token["address"]), is_signer = False, is_writable = False)
+    ]
+    return Instruction(Pubkey.from_string(SIM_SWAP_PROGRAM_ID), encode_sim_swap(direction, in_amount, out_amount, token["decimals"]), accounts)
+
+def get_latest_blockhash() -> Tuple[str,int]:
+    body = { "jsonrpc": "2.0", "id": 1, "method": "getLatestBlockhash", "params": [{ "commitment": "confirmed" }] }
+    value = settings.session.post(settings.solana_rpc_url, json = body).json()["result"]["value"]
+    return value["blockhash"], value["lastValidBlockHeight"]
+
+def make_swap_transaction(quote : Dict[str,Any], user_public_key : str, compute_unit_price : int) -> Tuple[bytes,int]:
+    # Laid out like Jupiter's: compute budget, create token accounts, swap.
+    # A sell's swap is instruction 3 and a buy's is 4, which the worker relies on to tell insufficient tokens from insufficient SOL.
+    input_mint, output_mint = quote["inputMint"], quote["outputMint"]
+    if WRAPPED_SOL_MINT not in (input_mint, output_mint):
+        raise QuoteFailure("Only swaps to or from SOL are supported")
+    direction = SIM_SWAP_BUY if input_mint == WRAPPED_SOL_MINT else SIM_SWAP_SELL
+    token = settings.tokens[output_mint if direction == SIM_SWAP_BUY else input_mint]
+    user = Pubkey.from_string(user_public_key)
+    instructions = [
+        set_compute_unit_limit(COMPUTE_UNIT_LIMIT),
+        set_compute_unit_price(compute_unit_price),
+        create_token_account_idempotent(user, user, WRAPPED_SOL_MINT, TOKEN_PROGRAM_ID)
+    ]
+    if direction == SIM_SWAP_BUY:
+        instructions.append(create_token_account_idempotent(user, user, token["address"], token.get("token_program", TOKEN_PROGRAM_ID)))
+    instructions.append(sim_swap(user, token, direction, int(quote["inAmount"]), int(quote["outAmount"])))
+    blockhash, last_valid_block_height = get_latest_blockhash()
+    message = MessageV0.try_compile(user, instructions, [], Hash.from_string(blockhash))
+    # Unsigned: the worker signs it
+    tx = VersionedTransaction.populate(message, [ Signature.default() ])
+    return bytes(tx), last_valid_block_height
+
+def compute_unit_price_of(body : Dict[str,Any]) -> int:
+    price = body.get("computeUnitPriceMicroLamports")
+    return price if isinstance(price, int) else 0
+
+"""
+    Endpoints
+"""
+
+@app.route('/all', methods=['GET'])
+def handleTokenList():
+    token_list = []
+    for token in settings.tokens.values():
+        tags = ["token-2022"] if token.get("token_program", TOKEN_PROGRAM_ID) != TOKEN_PROGRAM_ID else []
+        token_list.append({ "address": token["address"], "chainId": 101, "decimals": token["decimals"], "name": token.get("name", token.get("symbol", "")), "symbol": token.get("symbol", ""), "logoURI": "", "tags": tags })
+    return jsonify(token_list)
+
+@app.route('/v6/price', methods=['GET'])
+def handlePrice():
+    simulate_latency("price")
+    start = time.perf_counter()
+    now = current_time()
+    ids = [ id.strip() for id in request.args.get("ids", "").split(",") if id.strip() ]
+    vs_token = request.args.get("vsToken", WRAPPED_SOL_MINT)
+    data = dict()
+    for id in ids:
+        try:
+            price = price_in_sol(id, now) / price_in_sol(vs_token, now)
+        except QuoteFailure:
+            # Like the real API, unknown tokens are left out
+            continue
+        data[id] = { "id": id, "mintSymbol": settings.tokens[id].get("symbol", id), "vsToken": vs_token, "vsTokenSymbol": settings.tokens.get(vs_token, dict()).get("symbol", vs_token), "price": price }
+    return jsonify({ "data": data, "timeTaken": time.perf_counter() - start })
+
+@app.route('/v6/quote', methods=['GET'])
+def handleQuote():
+    simulate_latency("quote")
+    start = time.perf_counter()
+    try:
+        quote = make_quote(request.args["inputMint"],
+            request.args["outputMint"],
+            int(request.args["amount"]),
+            int(float(request.args.get("slippageBps", 50))),
+            int(float(request.args.get("platformFeeBps", 0))),
+            request.args.get("swapMode", "ExactIn"),
+            current_time())
+    except (QuoteFailure, KeyError, ValueError) as e:
+        return jsonify({ "error": str(e) }), 400
+    quote["timeTaken"] = time.perf_counter() - start
+    return jsonify(quote)
+
+@app.route('/v6/swap', methods=['POST'])
+def handleSwap():
+    simulate_latency("swap")
+    body = request.get_json(force = True)
+    try:
+        swap_transaction, last_valid_block_height = make_swap_transaction(body["quoteResponse"], body["userPublicKey"], compute_unit_price_of(body))
+    except (QuoteFailure, KeyError, ValueError) as e:
+        return jsonify({ "error": str(e) }), 400
+    return jsonify({
+        "swapTransaction": base64.b64encode(swap_transaction).decode("ascii"),
+        "lastValidBlockHeight": last_valid_block_height,
+        "prioritizationFeeLamports": 0
+    })
+
+def exit_on_sigterm(signum, frame):
+    sys.exit(0)
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument("--price_latency_ms", type = float, required = False, default = 0.0)
+    parser.add_argument("--quote_latency_ms", type = float, required = False, default = 0.0)
+    parser.add_argument("--swap_latency_ms", type = float, required = False, default = 0.0)
+    parser.add_argument("--latency_jitter_ms", type = float, required = False, default = 0.0)
+    parser.add_argument("--pool_fee_bps", type = int, required = False, default = 25)
+    parser.add_argument("--solana_rpc_url", type = str, required = False, default = LOCAL_FAKE_SOLANA_RPC_ADDRESS)
+    parser.add_argument("--scenario", type = str, required = False, default = get_sim_setting("market_scenario", None))
+    # Start the scenario over when it ends, rather than holding its last prices
+    parser.add_argument("--loop_scenario", action = "store_true")
+    parser.add_argument("--virtual_clock", action = "store_true")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    tokens = get_sim_setting("fake_jupiter_tokens", DEFAULT_TOKENS)
+    price_model = StaticPriceModel(tokens)
+    if args.scenario is not None:
+        scenario = read_scenario(args.scenario)
+        tokens = tokens + [ { key: value for (key, value) in token.items() if key != "prices" } for token in scenario["tokens"] ]
+        scenario_start = 0.0 if args.virtual_clock else time.time()
+        price_model = ScenarioPriceModel(scenario, scenario_start, fallback = price_model, loop = args.loop_scenario)
+        print(f"Serving the {scenario['scenario']} scenario ({len(scenario['tokens'])} tokens) from {args.scenario}")
+    latency_ms = { "price": args.price_latency_ms, "quote": args.quote_latency_ms, "swap": args.swap_latency_ms }
+    settings = FakeJupiterSettings(tokens, args.pool_fee_bps, latency_ms, args.latency_jitter_ms, args.solana_rpc_url)
+    if args.virtual_clock:
+        clock_reader = VirtualClockReader()
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+    app.run(debug=False, host = "localhost", port = FAKE_JUPITER_PORT)
@@ -0,0 +1,555 @@
+from flask import Flask, request, jsonify
+import sys, time, json, base64, random, heapq, hashlib, threading, signal
+from argparse import ArgumentParser
+from typing import Any, Callable, Dict, List, Tuple, Union
+from solders.keypair import Keypair
+from solders.pubkey import Pubkey
+from solders.hash import Hash
+from solders.transaction import VersionedTransaction
+from dev.local_dev_common import *
+from wrangler_common import get_secret
+
+"""
+    A local stand-in for a Solana RPC node, so simulations run offline and at scale.
+
+    Implements the JSON-RPC methods the worker (web3.js Connection) and transfer_funds.py use:
+        sendTransaction, simulateTransaction, getSignatureStatuses, getTransaction (json and jsonParsed),
+        getBalance, getTokenAccountsByOwner, getLatestBlockhash, getBlockHeight, getSlot, requestAirdrop
+
+    Every path is served, so the worker's `${QUICKNODE_RPC_URL}/<api key>/` URL works as is.
+
+    State is an in-memory ledger of lamport balances and SPL token accounts.  Interpreted instructions:
+        system program transfers                    move lamports
+        associated token account creation           creates the token account, paying its rent
+        swaps built by fake_jupiter.py              move lamports and tokens at the quoted amounts (see encode_sim_swap)
+    Instructions for any other program succeed without effects.  A failing instruction undoes the
+    transaction's earlier instructions, and the fee is still paid.  Signatures are not verified.
+
+    Each send of a transaction is dropped with probability --drop_rate.  Otherwise it lands
+    --confirm_delay_ms (+/- --confirm_jitter_ms) later, failing with probability --fail_rate.
+    Rebroadcasts of the same transaction are sends too, so retrying helps like it does on a real cluster.
+    A landed transaction is 'confirmed', and 'finalized' --finalize_delay_ms after that.
+
+    Slots advance every --slot_ms; blockhashes are valid for 150 blocks, as on mainnet.
+
+    The sim funding wallet (SECRET__SIMTEST_FUNDING_WALLET_PRIVATE_KEY in .dev.vars.sim) starts with --funding_wallet_sol.
+
+    GET /sim/stats reports transaction counts by outcome.
+"""
+
+app = Flask(__name__)
+
+ledger = None
+
+LAMPORTS_PER_SOL = 1_000_000_000
+FEE_LAMPORTS_PER_SIGNATURE = 5000
+GENESIS_SLOT = 250_000_000
+# Block height trails slot by the number of skipped slots
+SKIPPED_SLOTS = 20_000_000
+BLOCKHASH_VALID_BLOCKS = 150
+
+SYSTEM_PROGRAM_ID = "11111111111111111111111111111111"
+SYSTEM_TRANSFER_INSTRUCTION = 2
+# System program error for a transfer from an account without enough lamports
+INSUFFICIENT_FUNDS_ERROR = 1
+# What --fail_rate failures look like: Jupiter's slippage tolerance exceeded
+INJECTED_FAILURE_ERROR = 6001
+
+TOKEN_PROGRAM_ID = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+ASSOCIATED_TOKEN_PROGRAM_ID = "ATokenGPvbdGVxr1b2hvZbsiqW5xWH25efTNsLJA8knL"
+WRAPPED_SOL_MINT = "So11111111111111111111111111111111111111112"
+TOKEN_ACCOUNT_RENT_LAMPORTS = 2039280
+TOKEN_ACCOUNT_SIZE = 165
+
+# Swaps from fake_jupiter.py are instructions to the Jupiter program (so errors and logs look like Jupiter's),
+# with our own data layout: direction, in amount, out amount, token decimals
+SIM_SWAP_PROGRAM_ID = "JUP6LkbZbjS1jKKwapdHNy74zcZ3tLUZoi5QNyVTaV4"
+SIM_SWAP_BUY = 0
+SIM_SWAP_SELL = 1
+SIM_SWAP_DATA_LENGTH = 18
+# The worker reads Custom 1 at instruction index 3 as 'insufficient token balance', and elsewhere as 'insufficient SOL'
+JUPITER_INSUFFICIENT_BALANCE_ERROR = 1
+# Anchor's AccountNotInitialized, which Jupiter raises for a missing token account
+ACCOUNT_NOT_INITIALIZED_ERROR = 3012
+
+JSON_RPC_METHOD_NOT_FOUND = -32601
+JSON_RPC_INVALID_PARAMS = -32602
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+def b58encode(data : bytes) -> str:
+    number = int.from_bytes(data, "big")
+    encoded = ""
+    while number > 0:
+        number, remainder = divmod(number, 58)
+        encoded = BASE58_ALPHABET[remainder] + encoded
+    leading_zeros = len(data) - len(data.lstrip(b"\0"))
+    return "1" * leading_zeros + encoded
+
+def encode_sim_swap(direction : int, in_amount : int, out_amount : int, decimals : int) -> bytes:
+    # buy: in_amount lamports for out_amount tokens.  sell: in_amount tokens for out_amount lamports.
+    return bytes([direction]) + in_amount.to_bytes(8, "little") + out_amount.to_bytes(8, "little") + bytes([decimals])
+
+def decode_sim_swap(data : bytes) -> Tuple[int,int,int,int]:
+    return data[0], int.from_bytes(data[1:9], "little"), int.from_bytes(data[9:17], "little"), data[17]
+
+def derive_token_account(mint : str, owner : str, token_program_id : str = TOKEN_PROGRAM_ID) -> str:
+    seeds = [bytes(Pubkey.from_string(owner)), bytes(Pubkey.from_string(token_program_id)), bytes(Pubkey.from_string(mint))]
+    address, _ = Pubkey.find_program_address(seeds, Pubkey.from_string(ASSOCIATED_TOKEN_PROGRAM_ID))
+    return str(address)
+
+class SimTransaction:
+    def __init__(self, signature : str, tx : VersionedTransaction, raw : bytes):
+        self.signature = signature
+        self.tx = tx
+        self.raw = raw
+        self.account_keys = [ str(key) for key in tx.message.account_keys ]
+        self.land_at : Union[float,None] = None
+        self.slot : Union[int,None] = None
+        self.block_time : Union[int,None] = None
+        self.landed_monotonic : Union[float,None] = None
+        self.err : Any = None
+        self.fee = FEE_LAMPORTS_PER_SIGNATURE * len(tx.signatures)
+        self.pre_balances : List[int] = []
+        self.post_balances : List[int] = []
+        self.pre_token_balances : List[Any] = []
+        self.post_token_balances : List[Any] = []
+        self.log_messages : List[str] = []
+
+    @property
+    def landed(self) -> bool:
+        return self.slot is not None
+
+class Ledger:
+
+    def __init__(self, confirm_delay_ms : float, confirm_jitter_ms : float, finalize_delay_ms : float, drop_rate : float, fail_rate : float, slot_ms : float, seed : Union[int,None] = None):
+        self.confirm_delay_ms = confirm_delay_ms
+        self.confirm_jitter_ms = confirm_jitter_ms
+        self.finalize_delay_ms = finalize_delay_ms
+        self.drop_rate = drop_rate
+        self.fail_rate = fail_rate
+        self.slot_ms = slot_ms
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.genesis = time.monotonic()
+        self.lamports : Dict[str,int] = dict()
+        # token account address -> { mint, owner, amount, program_id }.  Replaced, never mutated, on change.
+        self.token_accounts : Dict[str,Dict[str,Any]] = dict()
+        self.mint_decimals : Dict[str,int] = dict()
+        # (table, key, previous value) for every write by the transaction landing, so a failure can be undone
+        self.undo_log : List[Tuple[Dict,str,Any]] = []
+        self.transactions : Dict[str,SimTransaction] = dict()
+        self.pending : List[Tuple[float,str]] = [] # heap of (land at, signature)
+        self.stats = { "sent": 0, "dropped_sends": 0, "landed": 0, "failed": 0 }
+        # program id -> fn(ledger, tx, instruction index, instruction) returning an error or None
+        self.instruction_handlers : Dict[str,Callable] = {
+            SYSTEM_PROGRAM_ID: apply_system_instruction,
+            ASSOCIATED_TOKEN_PROGRAM_ID: apply_associated_token_account_instruction,
+            SIM_SWAP_PROGRAM_ID: apply_sim_swap_instruction
+        }
+
+    def slot(self) -> int:
+        return GENESIS_SLOT + int((time.monotonic() - self.genesis) * 1000 / self.slot_ms)
+
+    def block_height(self) -> int:
+        return self.slot() - SKIPPED_SLOTS
+
+    def blockhash(self) -> str:
+        return str(Hash(hashlib.sha256(self.slot().to_bytes(8, "little")).digest()))
+
+    def credit(self, pubkey : str, lamports : int):
+        with self.lock:
+            self.lamports[pubkey] = self.lamports.get(pubkey, 0) + lamports
+
+    def get_balance(self, pubkey : str) -> int:
+        with self.lock:
+            self.settle()
+            return self.lamports.get(pubkey, 0)
+
+    def get_token_accounts_by_owner(self, owner : str, mint : Union[str,None], program_id : Union[str,None]) -> List[Tuple[str,Dict[str,Any]]]:
+        with self.lock:
+            self.settle()
+            return [ (address, account) for (address, account) in self.token_accounts.items()
+                if account["owner"] == owner and mint in (None, account["mint"]) and program_id in (None, account["program_id"]) ]
+
+    def set_lamports(self, pubkey : str, lamports : int):
+        # caller holds self.lock
+        self.undo_log.append((self.lamports, pubkey, self.lamports.get(pubkey)))
+        self.lamports[pubkey] = lamports
+
+    def set_token_account(self, address : str, account : Dict[str,Any]):
+        # caller holds self.lock
+        self.undo_log.append((self.token_accounts, address, self.token_accounts.get(address)))
+        self.token_accounts[address] = account
+
+    def token_balances(self, sim_tx : SimTransaction) -> List[Any]:
+        # caller holds self.lock.  In the shape of meta.preTokenBalances / meta.postTokenBalances
+        balances = []
+        for index, key in enumerate(sim_tx.account_keys):
+            account = self.token_accounts.get(key)
+            if account is not None:
+                balances.append({ "accountIndex": index, "mint": account["mint"], "owner": account["owner"], "programId": account["program_id"], "uiTokenAmount": self.ui_token_amount(account) })
+        return balances
+
+    def ui_token_amount(self, account : Dict[str,Any]) -> Dict[str,Any]:
+        decimals = self.mint_decimals.get(account["mint"], 0)
+        ui_amount = account["amount"] / 10**decimals
+        return { "amount": str(account["amount"]), "decimals": decimals, "uiAmount": ui_amount, "uiAmountString": f"{ui_amount:.{decimals}f}".rstrip("0").rstrip(".") or "0" }
+
+    def send(self, raw : bytes) -> str:
+        tx = VersionedTransaction.from_bytes(raw)
+        signature = str(tx.signatures[0])
+        with self.lock:
+            self.settle()
+            self.stats["sent"] += 1
+            sim_tx = self.transactions.get(signature)
+            if sim_tx is None:
+                sim_tx = SimTransaction(signature, tx, raw)
+                self.transactions[signature] = sim_tx
+            if sim_tx.landed:
+                return signature
+            if self.rng.random() < self.drop_rate:
+                self.stats["dropped_sends"] += 1
+                return signature
+            delay_ms = max(0.0, self.confirm_delay_ms + self.rng.uniform(-self.confirm_jitter_ms, self.confirm_jitter_ms))
+            land_at = time.monotonic() + delay_ms / 1000
+            # A rebroadcast can only make a transaction land sooner
+            if sim_tx.land_at is None or land_at < sim_tx.land_at:
+                sim_tx.land_at = land_at
+                heapq.heappush(self.pending, (land_at, signature))
+            return signature
+
+    def get_transaction(self, signature : str) -> Union[SimTransaction,None]:
+        with self.lock:
+            self.settle()
+            sim_tx = self.transactions.get(signature)
+            return sim_tx if (sim_tx is not None and sim_tx.landed) else None
+
+    def is_finalized(self, sim_tx : SimTransaction) -> bool:
+        return sim_tx.landed_monotonic is not None and (time.monotonic() - sim_tx.landed_monotonic) * 1000 >= self.finalize_delay_ms
+
+    def settle(self):
+        # caller holds self.lock.  Lands everything due by now, in order.
+        now = time.monotonic()
+        while self.pending and self.pending[0][0] <= now:
+            land_at, signature = heapq.heappop(self.pending)
+            sim_tx = self.transactions[signature]
+            if sim_tx.landed or sim_tx.land_at != land_at:
+                continue
+            self.land(sim_tx)
+
+    def land(self, sim_tx : SimTransaction):
+        # caller holds self.lock
+        sim_tx.slot = self.slot()
+        sim_tx.block_time = int(time.time())
+        sim_tx.landed_monotonic = time.monotonic()
+        sim_tx.pre_balances = [ self.lamports.get(key, 0) for key in sim_tx.account_keys ]
+        sim_tx.pre_token_balances = self.token_balances(sim_tx)
+        fee_payer = sim_tx.account_keys[0]
+        self.lamports[fee_payer] = max(0, self.lamports.get(fee_payer, 0) - sim_tx.fee)
+        if self.rng.random() < self.fail_rate:
+            sim_tx.err = { "InstructionError": [0, { "Custom": INJECTED_FAILURE_ERROR }] }
+        else:
+            sim_tx.err = self.apply_instructions(sim_tx)
+        sim_tx.post_balances = [ self.lamports.get(key, 0) for key in sim_tx.account_keys ]
+        sim_tx.post_token_balances = self.token_balances(sim_tx)
+        self.stats["landed"] += 1
+        self.stats["failed"] += 1 if sim_tx.err is not None else 0
+
+    def apply_instructions(self, sim_tx : SimTransaction) -> Any:
+        # All or nothing, like a real transaction
+        self.undo_log = []
+        for index, instruction in enumerate(sim_tx.tx.message.instructions):
+            program_id = sim_tx.account_keys[instruction.program_id_index]
+            handler = self.instruction_handlers.get(program_id)
+            if handler is None:
+                sim_tx.log_messages.append(f"Program {program_id} success")
+                continue
+            err = handler(self, sim_tx, index, instruction)
+            if err is not None:
+                for (table, key, previous) in reversed(self.undo_log):
+                    if previous is None:
+                        table.pop(key, None)
+                    else:
+                        table[key] = previous
+                return err
+        return None
+
+def apply_system_instruction(ledger : Ledger, sim_tx : SimTransaction, index : int, instruction) -> Any:
+    data = bytes(instruction.data)
+    if len(data) < 12 or int.from_bytes(data[0:4], "little") != SYSTEM_TRANSFER_INSTRUCTION:
+        return None
+    lamports = int.from_bytes(data[4:12], "little")
+    source = sim_tx.account_keys[instruction.accounts[0]]
+    destination = sim_tx.account_keys[instruction.accounts[1]]
+    if ledger.lamports.get(source, 0) < lamports:
+        sim_tx.log_messages.append(f"Transfer: insufficient lamports {ledger.lamports.get(source, 0)}, need {lamports}")
+        return { "InstructionError": [index, { "Custom": INSUFFICIENT_FUNDS_ERROR }] }
+    ledger.set_lamports(source, ledger.lamports[source] - lamports)
+    ledger.set_lamports(destination, ledger.lamports.get(destination, 0) + lamports)
+    sim_tx.log_messages.append(f"Program {SYSTEM_PROGRAM_ID} success")
+    return None
+
+def apply_associated_token_account_instruction(ledger : Ledger, sim_tx : SimTransaction, index : int, instruction) -> Any:
+    # Create (or CreateIdempotent): payer, token account, owner, mint, system program, token program
+    payer, address, owner, mint, _, token_program_id = [ sim_tx.account_keys[i] for i in instruction.accounts[:6] ]
+    sim_tx.log_messages.append(f"Program {ASSOCIATED_TOKEN_PROGRAM_ID} invoke [1]")
+    # Wrapped SOL is handled natively by the swap, so there is nothing to track
+    if address in ledger.token_accounts or mint == WRAPPED_SOL_MINT:
+        sim_tx.log_messages.append(f"Program {ASSOCIATED_TOKEN_PROGRAM_ID} success")
+        return None
+    if ledger.lamports.get(payer, 0) < TOKEN_ACCOUNT_RENT_LAMPORTS:
+        sim_tx.log_messages.append("Program log: Error: insufficient funds")
+        return { "InstructionError": [index, { "Custom": INSUFFICIENT_FUNDS_ERROR }] }
+    ledger.set_lamports(payer, ledger.lamports[payer] - TOKEN_ACCOUNT_RENT_LAMPORTS)
+    ledger.set_lamports(address, ledger.lamports.get(address, 0) + TOKEN_ACCOUNT_RENT_LAMPORTS)
+    ledger.set_token_account(address, { "mint": mint, "owner": owner, "amount": 0, "program_id": token_program_id })
+    sim_tx.log_messages.append(f"Program {ASSOCIATED_TOKEN_PROGRAM_ID} success")
+    return None
+
+def apply_sim_swap_instruction(ledger : Ledger, sim_tx : SimTransaction, index : int, instruction) -> Any:
+    # user, user's token account, token mint
+    data = bytes(instruction.data)
+    if len(data) != SIM_SWAP_DATA_LENGTH:
+        return None
+    direction, in_amount, out_amount, decimals = decode_sim_swap(data)
+    user, address, mint = [ sim_tx.account_keys[i] for i in instruction.accounts[:3] ]
+    ledger.mint_decimals[mint] = decimals
+    sim_tx.log_messages.append(f"Program {SIM_SWAP_PROGRAM_ID} invoke [1]")
+    account = ledger.token_accounts.get(address)
+    if account is None:
+        sim_tx.log_messages.append("Program log: AnchorError: AccountNotInitialized")
+        return { "InstructionError": [index, { "Custom": ACCOUNT_NOT_INITIALIZED_ERROR }] }
+    if direction == SIM_SWAP_BUY:
+        if ledger.lamports.get(user, 0) < in_amount:
+            sim_tx.log_messages.append("Program log: Error: insufficient funds")
+            return { "InstructionError": [index, { "Custom": JUPITER_INSUFFICIENT_BALANCE_ERROR }] }
+        ledger.set_lamports(user, ledger.lamports[user] - in_amount)
+        ledger.set_token_account(address, { **account, "amount": account["amount"] + out_amount })
+    else:
+        if account["amount"] < in_amount:
+            sim_tx.log_messages.append("Program log: Error: insufficient funds")
+            return { "InstructionError": [index, { "Custom": JUPITER_INSUFFICIENT_BALANCE_ERROR }] }
+        ledger.set_token_account(address, { **account, "amount": account["amount"] - in_amount })
+        ledger.set_lamports(user, ledger.lamports.get(user, 0) + out_amount)
+    sim_tx.log_messages.append(f"Program {SIM_SWAP_PROGRAM_ID} success")
+    return None
+
+"""
+    Response shapes
+"""
+
+def with_context(value : Any) -> Any:
+    return { "context": { "slot": ledger.slot(), "apiVersion": "1.18.0" }, "value": value }
+
+def is_writable(header, num_keys : int, index : int) -> bool:
+    if index < header.num_required_signatures:
+        return index < header.num_required_signatures - header.num_readonly_signed_accounts
+    return index < num_keys - header.num_readonly_unsigned_accounts
+
+def describe_instruction(sim_tx : SimTransaction, instruction, parsed : bool) -> Any:
+    program_id = sim_tx.account_keys[instruction.program_id_index]
+    data = bytes(instruction.data)
+    if not parsed:
+        return { "programIdIndex": instruction.program_id_index, "accounts": list(instruction.accounts), "data": b58encode(data), "stackHeight": None }
+    accounts = [ sim_tx.account_keys[i] for i in instruction.accounts ]
+    if program_id == SYSTEM_PROGRAM_ID and len(data) >= 12 and int.from_bytes(data[0:4], "little") == SYSTEM_TRANSFER_INSTRUCTION:
+        info = { "source": accounts[0], "destination": accounts[1], "lamports": int.from_bytes(data[4:12], "little") }
+        return { "program": "system", "programId": program_id, "parsed": { "type": "transfer", "info": info }, "stackHeight": None }
+    return { "programId": program_id, "accounts": accounts, "data": b58encode(data), "stackHeight": None }
+
+def describe_transaction(sim_tx : SimTransaction, parsed : bool) -> Any:
+    message = sim_tx.tx.message
+    header = message.header
+    num_keys = len(sim_tx.account_keys)
+    if parsed:
+        account_keys = [ { "pubkey": key, "signer": i < header.num_required_signatures, "writable": is_writable(header, num_keys, i), "source": "transaction" } for i, key in enumerate(sim_tx.account_keys) ]
+    else:
+        account_keys = sim_tx.account_keys
+    is_legacy = type(message).__name__ == "Message"
+    described_message = {
+        "accountKeys": account_keys,
+        "header": { "numRequiredSignatures": header.num_required_signatures, "numReadonlySignedAccounts": header.num_readonly_signed_accounts, "numReadonlyUnsignedAccounts": header.num_readonly_unsigned_accounts },
+        "instructions": [ describe_instruction(sim_tx, instruction, parsed) for instruction in message.instructions ],
+        "recentBlockhash": str(message.recent_blockhash)
+    }
+    if not is_legacy:
+        described_message["addressTableLookups"] = []
+    return {
+        "slot": sim_tx.slot,
+        "blockTime": sim_tx.block_time,
+        "version": "legacy" if is_legacy else 0,
+        "meta": {
+            "err": sim_tx.err,
+            "status": { "Ok": None } if sim_tx.err is None else { "Err": sim_tx.err },
+            "fee": sim_tx.fee,
+            "preBalances": sim_tx.pre_balances,
+            "postBalances": sim_tx.post_balances,
+            "preTokenBalances": sim_tx.pre_token_balances,
+            "postTokenBalances": sim_tx.post_token_balances,
+            "innerInstructions": [],
+            "logMessages": sim_tx.log_messages,
+            "loadedAddresses": { "writable": [], "readonly": [] },
+            "rewards": [],
+            "computeUnitsConsumed": 0
+        },
+        "transaction": {
+            "signatures": [ str(signature) for signature in sim_tx.tx.signatures ],
+            "message": described_message
+        }
+    }
+
+def describe_token_account(address : str, account : Dict[str,Any]) -> Any:
+    info = { "isNative": False, "mint": account["mint"], "owner": account["owner"], "state": "initialized", "tokenAmount": ledger.ui_token_amount(account) }
+    return {
+        "pubkey": address,
+        "account": {
+            "data": { "parsed": { "info": info, "type": "account" }, "program": "spl-token", "space": TOKEN_ACCOUNT_SIZE },
+            "executable": False,
+            "lamports": ledger.lamports.get(address, 0),
+            "owner": account["program_id"],
+            "rentEpoch": 0,
+            "space": TOKEN_ACCOUNT_SIZE
+        }
+    }
+
+def describe_signature_status(sim_tx : Union[SimTransaction,None]) -> Any:
+    if sim_tx is None:
+        return None
+    finalized = ledger.is_finalized(sim_tx)
+    return {
+        "slot": sim_tx.slot,
+        "confirmations": None if finalized else max(0, ledger.slot() - sim_tx.slot),
+        "err": sim_tx.err,
+        "status": { "Ok": None } if sim_tx.err is None else { "Err": sim_tx.err },
+        "confirmationStatus": "finalized" if finalized else "confirmed"
+    }
+
+"""
+    JSON-RPC methods
+"""
+
+def decode_transaction(encoded : str, config : Any) -> bytes:
+    # base58 is the (deprecated) default encoding
+    if (config or dict()).get("encoding", "base58") == "base64":
+        return base64.b64decode(encoded)
+    number = 0
+    for char in encoded:
+        number = number * 58 + BASE58_ALPHABET.index(char)
+    leading_zeros = len(encoded) - len(encoded.lstrip("1"))
+    return b"\0" * leading_zeros + number.to_bytes((number.bit_length() + 7) // 8, "big")
+
+def rpc_send_transaction(encoded : str, config : Any = None):
+    return ledger.send(decode_transaction(encoded, config))
+
+def rpc_simulate_transaction(encoded : str, config : Any = None):
+    return with_context({ "err": None, "logs": [], "accounts": None, "unitsConsumed": 0, "returnData": None })
+
+def rpc_get_signature_statuses(signatures : List[str], config : Any = None):
+    return with_context([ describe_signature_status(ledger.get_transaction(signature)) for signature in signatures ])
+
+def rpc_get_transaction(signature : str, config : Any = None):
+    sim_tx = ledger.get_transaction(signature)
+    if sim_tx is None:
+        return None
+    encoding = (config if isinstance(config, dict) else { "encoding": config }).get("encoding") or "json"
+    return describe_transaction(sim_tx, parsed = (encoding == "jsonParsed"))
+
+def rpc_get_balance(pubkey : str, config : Any = None):
+    return with_context(ledger.get_balance(pubkey))
+
+def rpc_get_token_accounts_by_owner(owner : str, filter : Any = None, config : Any = None):
+    filter = filter or dict()
+    accounts = ledger.get_token_accounts_by_owner(owner, filter.get("mint"), filter.get("programId"))
+    return with_context([ describe_token_account(address, account) for (address, account) in accounts ])
+
+def rpc_get_latest_blockhash(config : Any = None):
+    return with_context({ "blockhash": ledger.blockhash(), "lastValidBlockHeight": ledger.block_height() + BLOCKHASH_VALID_BLOCKS })
+
+def rpc_get_block_height(config : Any = None):
+    return ledger.block_height()
+
+def rpc_get_slot(config : Any = None):
+    return ledger.slot()
+
+def rpc_request_airdrop(pubkey : str, lamports : int, config : Any = None):
+    ledger.credit(pubkey, lamports)
+    return b58encode(hashlib.sha512(f"airdrop:{pubkey}:{lamports}:{time.time()}".encode()).digest())
+
+def rpc_get_health():
+    return "ok"
+
+def rpc_get_version():
+    return { "solana-core": "1.18.0", "feature-set": 0 }
+
+RPC_METHODS = {
+    "sendTransaction": rpc_send_transaction,
+    "simulateTransaction": rpc_simulate_transaction,
+    "getSignatureStatuses": rpc_get_signature_statuses,
+    "getTransaction": rpc_get_transaction,
+    "getBalance": rpc_get_balance,
+    "getTokenAccountsByOwner": rpc_get_token_accounts_by_owner,
+    "getLatestBlockhash": rpc_get_latest_blockhash,
+    "getBlockHeight": rpc_get_block_height,
+    "getSlot": rpc_get_slot,
+    "requestAirdrop": rpc_request_airdrop,
+    "getHealth": rpc_get_health,
+    "getVersion": rpc_get_version
+}
+
+def handle_rpc_call(call : Any) -> Any:
+    call_id = call.get("id")
+    method = RPC_METHODS.get(call.get("method"))
+    if method is None:
+        return { "jsonrpc": "2.0", "id": call_id, "error": { "code": JSON_RPC_METHOD_NOT_FOUND, "message": f"Method not found: {call.get('method')}" } }
+    try:
+        result = method(*(call.get("params") or []))
+    except Exception as e:
+        return { "jsonrpc": "2.0", "id": call_id, "error": { "code": JSON_RPC_INVALID_PARAMS, "message": str(e) } }
+    return { "jsonrpc": "2.0", "id": call_id, "result": result }
+
+@app.route('/sim/stats', methods=['GET'])
+def handleStats():
+    with ledger.lock:
+        ledger.settle()
+        return jsonify({ **ledger.stats, "pending": len(ledger.pending), "slot": ledger.slot() })
+
+@app.route('/', defaults = { 'path': '' }, methods=['POST'])
+@app.route('/<path:path>', methods=['POST'])
+def handleRPC(path):
+    body = request.get_json(force = True)
+    # JSON-RPC batches are a list of calls
+    if isinstance(body, list):
+        return jsonify([ handle_rpc_call(call) for call in body ])
+    return jsonify(handle_rpc_call(body))
+
+def fund_sim_funding_wallet(sol : float):
+    try:
+        funding_wallet = Keypair.from_base58_string(get_secret("SECRET__SIMTEST_FUNDING_WALLET_PRIVATE_KEY", "sim"))
+    except Exception as e:
+        print(f"Could not fund the sim funding wallet: {str(e)}")
+        return
+    ledger.credit(str(funding_wallet.pubkey()), int(sol * LAMPORTS_PER_SOL))
+    print(f"Funded {funding_wallet.pubkey()} with {sol} SOL")
+
+def exit_on_sigterm(signum, frame):
+    sys.exit(0)
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument("--confirm_delay_ms", type = float, required = False, default = 800.0)
+    parser.add_argument("--confirm_jitter_ms", type = float, required = False, default = 400.0)
+    parser.add_argument("--finalize_delay_ms", type = float, required = False, default = 12800.0)
+    parser.add_argument("--drop_rate", type = float, required = False, default = 0.0)
+    parser.add_argument("--fail_rate", type = float, required = False, default = 0.0)
+    parser.add_argument("--slot_ms", type = float, required = False, default = 400.0)
+    parser.add_argument("--funding_wallet_sol", type = float, required = False, default = 1000.0)
+    parser.add_argument("--seed", type = int, required = False, default = None)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    ledger = Ledger(args.confirm_delay_ms, args.confirm_jitter_ms, args.finalize_delay_ms, args.drop_rate, args.fail_rate, args.slot_ms, args.seed)
+    fund_sim_funding_wallet(args.funding_wallet_sol)
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+    app.run(debug=False, host = "localhost", port = FAKE_SOLANA_RPC_PORT)
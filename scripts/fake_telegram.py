@@ -1,8 +1,13 @@
-from flask import Flask, request, jsonify
-import os, json, time
+from flask import Flask, request, jsonify, g
+import os, sys, json, time, signal, logging
+from werkzeug.serving import make_server, WSGIRequestHandler
 from argparse import ArgumentParser
 from dev.local_dev_common import *
 from wrangler_common import get_environment_variable
+from user_message_store import UserMessageStore, DEFAULT_FLUSH_INTERVAL_SECONDS
+from simulated_user_engine import SimulatedUserEngine, DEFAULT_MAX_WORKERS
+from sim_benchmark import BenchmarkRecorder
+from telegram_emulation import TelegramEmulation
 
 """
 
@@ -15,10 +20,73 @@ from wrangler_common import get_environment_variable
         editMessageText
         deleteMessage
 
+    Messages are held in a resident per-user store and appended behind to
+    the `<user_id>.messages` logs (see message_log.py), so each call costs the same no matter how long the chat is.
+
+    With --simulated_users, the simulated users are hosted in this process too,
+    and each user's next action is dispatched as soon as a message is recorded for them.
+
+    Rate limits (429s with retry_after), injected 429s / 5xxs and response latency can be turned on
+    to see how the worker copes when Telegram pushes back (see telegram_emulation.py).
+
+    --server picks how requests are served, so this server is never the bottleneck in a benchmark:
+        threaded    (default) a thread per connection, with HTTP/1.1 keep-alive and no per-request logging
+        waitress    a fixed pool of --threads on waitress (pip install waitress)
+        flask       Flask's development server, logging every request, as before
+    Calls for the same user are applied to the store one at a time, in the order they are handled,
+    and calls made one after another on a keep-alive connection are handled in order.
+
 """
 
 app = Flask(__name__)
 
+store = UserMessageStore()
+
+engine = None
+
+recorder = None
+
+emulation = TelegramEmulation()
+
+MAX_LONG_POLL_SECONDS = 30.0
+
+log_calls = True
+
+"""
+    With --benchmark, the latency and status of every bot API call is recorded (see sim_benchmark.py)
+"""
+
+@app.before_request
+def start_timing_request():
+    g.request_start = time.perf_counter()
+
+"""
+    Rate limits, failures and latency, applied to every bot API call before it is handled
+"""
+
+@app.before_request
+def emulate_telegram_pushback():
+    if not request.path.startswith("/bot") or not emulation.is_enabled():
+        return None
+    method = request.path.rsplit("/", 1)[-1]
+    data = request.get_json(silent = True) or {}
+    failure = emulation.handle(method, get_user_id(data))
+    if failure is not None:
+        status, body = failure
+        return jsonify(body), status
+    return None
+
+@app.route('/sim/telegram/stats', methods=['GET'])
+def handleGetEmulationStats():
+    return jsonify({ "ok": True, "stats": emulation.get_stats() })
+
+@app.after_request
+def record_request_timing(response):
+    if recorder is not None and request.path.startswith("/bot"):
+        method = request.path.rsplit("/", 1)[-1]
+        recorder.record("telegram", method, time.perf_counter() - g.request_start, response.status_code)
+    return response
+
 """
     /deleteMessage
 """
@@ -26,7 +94,7 @@ app = Flask(__name__)
 
 @app.route('/bot<bot_token>/deleteMessage', methods=['POST'])
 def handleDeleteMessage(bot_token):
-    print("---deleteMessage")
+    log_call("deleteMessage")
     data = request.json
     found = delete_message_from_user_file(data)
     return jsonify(make_delete_message_response(found))
@@ -34,9 +102,7 @@ def handleDeleteMessage(bot_token):
 def delete_message_from_user_file(data):
     message_id_to_delete = data.get("message_id")
     user_id = get_user_id(data)
-    messages = get_user_messages(user_id)
-    messages = [ message for message in messages if message["message_id"] == message_id_to_delete ]
-    write_user_messages(user_id, messages)
+    return store.delete_message(user_id, message_id_to_delete)
 
 def make_delete_message_response(found):
     if found:
@@ -57,38 +123,21 @@ def get_message_id_from_message_in_user_file(message):
 
 """
     /editMessageText
-    Locate the message from the user file and overwrite,
-    then write the contents of the user file back to disk
+    Locate the message in the user's store and overwrite it
+    (the store writes it back to disk in the background)
 """
 
 @app.route('/bot<bot_token>/editMessageText', methods=['POST'])
 def handleEditMessageText(bot_token):
-    print("---editMessageText")
+    log_call("editMessageText")
     data = request.json
     add_from(data)
     found = edit_message_in_user_file(data)
     return jsonify(make_edit_message_response(data, found))
 
 def edit_message_in_user_file(data):
-
     user_id = get_user_id(data)
-    messages = get_user_messages(user_id)
-
-    # This is needed for weird and complicated reasons
-    data["chat"] = {
-        "id": user_id
-    }
-    
-    # find the message and overwrite it
-    found = False
-    for message in messages:
-        if message.get('message_id') == data.get('message_id'):
-            found = True
-            message.clear()
-            message.update(data)
-    write_user_messages(user_id, messages)
-
-    return found
+    return store.edit_message(user_id, data)
 
 def make_edit_message_response(data, found : bool):
     if found:
@@ -119,7 +168,7 @@ def make_edit_message_response(data, found : bool):
 
 @app.route('/bot<bot_token>/sendMessage', methods=['POST'])
 def handleSendMessage(bot_token):
-    print("---sendMessage")
+    log_call("sendMessage")
     data = request.json
     add_from(data)
     if is_reply_question(data):
@@ -134,16 +183,7 @@ def is_reply_question(data):
 
 def append_message_to_user_file(data) -> int:
     user_id = get_user_id(data)
-    messages = get_user_messages(user_id)
-    message_id = max([ message["message_id"] for message in messages ], default = 0) + 1
-    # These are needed for weird and complicated reasons
-    data["message_id"] = message_id
-    data["chat"] = {
-        "id": user_id
-    }
-    messages.append(data)
-    write_user_messages(user_id, messages)
-    return message_id
+    return store.append_message(user_id, data)
 
 def make_send_message_response(data, message_id):
     return {
@@ -166,7 +206,7 @@ def make_send_message_response(data, message_id):
     }
 
 def add_from(data):
-    telegram_bot_id = get_environment_variable("TELEGRAM_BOT_ID", 'sim')
+    telegram_bot_id = get_telegram_bot_id()
     data["from"] = {
         "id": telegram_bot_id
     }
@@ -177,32 +217,114 @@ def append_reply_question_to_user_file(data):
 def make_reply_question_response(data, message_id):
     return make_send_message_response(data, message_id)
 
+def get_telegram_bot_id():
+    # wrangler.toml is only parsed again if it changes (see get_config in local_dev_common.py)
+    return get_environment_variable("TELEGRAM_BOT_ID", 'sim')
+
+def log_call(method : str):
+    if log_calls:
+        print(f"---{method}")
+
+"""
+    /sim/users/<user_id>/wake
+    Lets spin_up_users wake (or create) a user hosted by the in-process simulated user engine
+"""
+
+@app.route('/sim/users/<int:user_id>/wake', methods=['POST'])
+def handleWakeUser(user_id):
+    if engine is None:
+        return jsonify({ "ok": False, "description": "Simulated users are not hosted by this server" }), 404
+    engine.notify(user_id)
+    return jsonify({ "ok": True })
+
+"""
+    /sim/users/<user_id>/changes
+    Long-poll for just what changed in a user's chat after `since_version` (see UserMessageStore.get_changes).
+    Used by the load generator, and by the simulated user viewer to push updates to the browser.
+"""
+
+@app.route('/sim/users/<int:user_id>/changes', methods=['GET'])
+def handleGetUserChanges(user_id):
+    since_version = request.args.get("since_version", default = -1, type = int)
+    wait = min(request.args.get("wait", default = 0.0, type = float), MAX_LONG_POLL_SECONDS)
+    version, changed, deleted, reset = store.wait_for_changes(user_id, since_version, wait)
+    return jsonify({ "ok": True, "version": version, "changed": changed, "deleted": deleted, "reset": reset })
+
 def get_user_id(body):
     # This is a simplification where i assume user_ud and chat_id have the same value.
     # Thus in requests to the TG Bot API that lack a user_id in the request body, I can use the chat_id instead
     return body.get("user_id") or body.get("chat_id")
 
-def get_user_messages(user_id):
-    # Build the file path
-    filename = pathed(f"{user_id}.messages")
-    if os.path.exists(filename):
-        with open(filename, 'r') as file:
-            data = json.load(file)
-    else:
-        data = []
-    return data
-
-def write_user_messages(user_id, messages):
-    # Write the updated data back to the file
-    filename = pathed(f"{user_id}.messages")
-    with open(filename, 'w') as file:
-        json.dump(messages, file, indent=4)
+def exit_on_sigterm(signum, frame):
+    # kill_procs terminates us - exit normally so the store gets its final flush
+    sys.exit(0)
 
 def parse_args():
     parser = ArgumentParser()
+    parser.add_argument("--flush_interval", type = float, required = False, default = DEFAULT_FLUSH_INTERVAL_SECONDS)
+    parser.add_argument("--simulated_users", action = "store_true")
+    parser.add_argument("--simulated_user_workers", type = int, required = False, default = DEFAULT_MAX_WORKERS)
+    parser.add_argument("--benchmark", action = "store_true")
+    # Record the simulated users' webhooks to this file, for webhook_replay.py
+    parser.add_argument("--record_webhooks", type = str, required = False, default = None)
+    # Whether the simulated users fund their wallets on fake_solana_rpc.py or mainnet, to match the worker
+    parser.add_argument("--fake_solana_rpc", type = parse_bool, required = False, default = True)
+    # Telegram pushback (see telegram_emulation.py).  Defaults come from .sim.settings.toml, and are off.
+    parser.add_argument("--global_rate_limit", type = float, required = False, default = get_sim_setting("telegram_global_rate_limit", 0.0))
+    parser.add_argument("--chat_rate_limit", type = float, required = False, default = get_sim_setting("telegram_chat_rate_limit", 0.0))
+    parser.add_argument("--chat_burst", type = float, required = False, default = get_sim_setting("telegram_chat_burst", 1.0))
+    parser.add_argument("--too_many_requests_rate", type = float, required = False, default = get_sim_setting("telegram_too_many_requests_rate", 0.0))
+    parser.add_argument("--server_error_rate", type = float, required = False, default = get_sim_setting("telegram_server_error_rate", 0.0))
+    parser.add_argument("--latency_ms", type = float, required = False, default = get_sim_setting("telegram_latency_ms", 0.0))
+    parser.add_argument("--latency_sigma", type = float, required = False, default = get_sim_setting("telegram_latency_sigma", 0.0))
+    parser.add_argument("--seed", type = int, required = False, default = None)
+    parser.add_argument("--server", type = str, required = False, default = "threaded", choices = ["threaded", "waitress", "flask"])
+    # waitress only
+    parser.add_argument("--threads", type = int, required = False, default = 64)
+    # Print every bot API call, even when not on the flask server
+    parser.add_argument("--verbose", action = "store_true")
     return parser.parse_args()
 
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    # HTTP/1.1 keeps the worker's connections open between calls
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, code = "-", size = "-"):
+        pass
+
+def serve(args):
+    if args.server == "flask":
+        app.run(debug=False, host = "localhost", port = FAKE_TELEGRAM_SERVER_PORT)
+    elif args.server == "waitress":
+        try:
+            import waitress
+        except ImportError:
+            raise Exception("--server waitress needs waitress installed (pip install waitress)")
+        waitress.serve(app, host = "localhost", port = FAKE_TELEGRAM_SERVER_PORT, threads = args.threads, connection_limit = 4096, backlog = 2048, _quiet = True)
+    else:
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        server = make_server("localhost", FAKE_TELEGRAM_SERVER_PORT, app, threaded = True, request_handler = KeepAliveRequestHandler)
+        # A deeper accept backlog than the default, for bursts of new connections
+        server.socket.listen(2048)
+        server.serve_forever()
+
+def start_simulated_user_engine(max_workers : int, benchmark : bool, record_webhooks : Union[str,None] = None, fake_solana_rpc : bool = True):
+    global engine
+    engine_recorder = BenchmarkRecorder("simulated_users") if benchmark else None
+    engine = SimulatedUserEngine(store.get_messages, max_workers = max_workers, recorder = engine_recorder, record_webhooks = record_webhooks, load_changes = store.get_changes, fake_solana_rpc = fake_solana_rpc).start()
+    store.add_listener(engine.notify)
+
 if __name__ == '__main__':
     args = parse_args()
     maybe_attach_debugger("fake_telegram", FAKE_TELEGRAM_DEBUG_PORT)
-    app.run(debug=False, host = "localhost", port = FAKE_TELEGRAM_SERVER_PORT)
\ No newline at end of file
+    log_calls = args.server == "flask" or args.verbose
+    store.flush_interval = args.flush_interval
+    emulation = TelegramEmulation(args.global_rate_limit, args.chat_rate_limit, args.chat_burst, args.too_many_requests_rate,
+                                  args.server_error_rate, args.latency_ms, args.latency_sigma, args.seed)
+    store.start()
+    if args.benchmark:
+        recorder = BenchmarkRecorder("fake_telegram")
+    if args.simulated_users:
+        start_simulated_user_engine(args.simulated_user_workers, args.benchmark, args.record_webhooks, args.fake_solana_rpc)
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+    serve(args)
\ No newline at end of file
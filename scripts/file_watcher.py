@@ -3,30 +3,49 @@ from argparse import ArgumentParser
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from dev.local_dev_common import *
+from simulated_user import load_user_messages
+from message_log import MessageLogChanges
+from user_registry import user_id_of_path
+from simulated_user_engine import SimulatedUserEngine, DEFAULT_MAX_WORKERS
+from sim_benchmark import BenchmarkRecorder
 
 class ChangeHandler(FileSystemEventHandler):
-    def __init__(self):
-        pass
+    def __init__(self, engine : SimulatedUserEngine):
+        self.engine = engine
     def on_modified(self, event):
         if event.is_directory:
             return
-        print(f'File changed: {event.src_path}')
-        file_parts = os.path.splitext(os.path.basename(event.src_path))
-        if len(file_parts) != 2 or file_parts[1] != '.messages':
+        self.on_user_file_changed(event.src_path)
+    def on_moved(self, event):
+        # fake_telegram swaps in a compacted messages log with os.replace
+        if event.is_directory:
+            return
+        self.on_user_file_changed(event.dest_path)
+    def on_user_file_changed(self, path):
+        print(f'File changed: {path}')
+        # users/<shard>/<user_id>/messages
+        if os.path.basename(path) != 'messages':
             return
-        user_id = file_parts[0]
-        cmd = f'python3 scripts/simulated_user.py --user_id={user_id}'
-        execute_shell_command(cmd)
+        user_id = user_id_of_path(path)
+        # Dispatched in-process, rather than paying for a new python process per action
+        self.engine.notify(user_id)
 
 def parse_args():
     parser = ArgumentParser()
+    parser.add_argument("--simulated_user_workers", type = int, required = False, default = DEFAULT_MAX_WORKERS)
+    parser.add_argument("--benchmark", action = "store_true")
+    parser.add_argument("--record_webhooks", type = str, required = False, default = None)
+    parser.add_argument("--fake_solana_rpc", type = parse_bool, required = False, default = True)
     args = parser.parse_args()
     return args
 
 
 def do_it(args):
     path = sim_dir()
-    event_handler = ChangeHandler()
+    recorder = BenchmarkRecorder("simulated_users") if args.benchmark else None
+    # Each action reads just the records appended to the user's log since their last one
+    engine = SimulatedUserEngine(load_user_messages, max_workers = args.simulated_user_workers, recorder = recorder, record_webhooks = args.record_webhooks, load_changes = MessageLogChanges().get_changes, fake_solana_rpc = args.fake_solana_rpc).start()
+    event_handler = ChangeHandler(engine)
     observer = Observer()
     observer.schedule(event_handler, path, recursive=True)
     observer.start()
@@ -36,6 +55,7 @@ def do_it(args):
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    engine.stop()
 
 if __name__ == "__main__":
     args = parse_args()
@@ -0,0 +1,163 @@
+import asyncio, random, time
+import aiohttp # pip install aiohttp
+from argparse import ArgumentParser, Namespace
+from typing import Any, Iterator
+from dev.local_dev_common import *
+from simulated_user import add_simulation_settings, get_simulated_user_webhook_response, get_think_time_seconds, new_user_metadata, make_traffic_recorder, MessageIndex
+from sim_benchmark import BenchmarkRecorder
+
+"""
+    Drives N concurrent virtual users against the local worker's webhook from one process.
+
+    Each virtual user is an asyncio task running the same decision logic as simulated_user.py.
+    It learns about the bot's replies by long-polling fake_telegram's /sim/users/<user_id>/changes,
+    so thousands of users cost thousands of coroutines, not thousands of processes or threads.
+    Each virtual user keeps a MessageIndex that the polls feed only what was sent, edited or deleted since the last one,
+    as SimulatedUserEngine does, so polling and deciding don't slow down as chats grow.
+
+    Users arrive according to --arrival:
+        poisson: exponential inter-arrival times at --arrival_rate users per second
+        ramp:    evenly spaced arrivals, all --num_users started after --ramp_seconds
+        step:    --step_users users start at once, every --step_seconds
+
+    HTTP connections are pooled (and kept alive) per target, bounded by --max_connections.
+
+    Run fake_telegram.py WITHOUT --simulated_users, otherwise the in-process engine
+    will act on behalf of the virtual users too.
+"""
+
+ARRIVAL_PATTERNS = ["poisson", "ramp", "step"]
+
+LONG_POLL_SECONDS = 10
+
+class LoadStats:
+    def __init__(self):
+        self.users_started = 0
+        self.webhooks_sent = 0
+        self.webhooks_failed = 0
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument("--num_users", type = int, required = True)
+    # Keeps virtual users clear of the IDs spin_up_users hands out
+    parser.add_argument("--first_user_id", type = int, required = False, default = 1_000_000)
+    parser.add_argument("--arrival", choices = ARRIVAL_PATTERNS, required = False, default = "poisson")
+    parser.add_argument("--arrival_rate", type = float, required = False, default = 10.0)
+    parser.add_argument("--ramp_seconds", type = float, required = False, default = 60.0)
+    parser.add_argument("--step_users", type = int, required = False, default = 100)
+    parser.add_argument("--step_seconds", type = float, required = False, default = 10.0)
+    parser.add_argument("--duration", type = float, required = False, default = 300.0)
+    parser.add_argument("--max_connections", type = int, required = False, default = 256)
+    parser.add_argument("--seed", type = int, required = False, default = 0)
+    parser.add_argument("--benchmark", action = "store_true")
+    parser.add_argument("--record_webhooks", type = str, required = False, default = None)
+    args = parser.parse_args()
+    return add_simulation_settings(args,
+        recorder = BenchmarkRecorder("load_generator") if args.benchmark else None,
+        traffic_recorder = make_traffic_recorder(args.record_webhooks))
+
+def iter_arrival_offsets(args : Namespace) -> Iterator[float]:
+    # Seconds after the start of the run at which each user arrives
+    rng = random.Random(args.seed)
+    if args.arrival == "poisson":
+        offset = 0.0
+        for _ in range(args.num_users):
+            yield offset
+            offset += rng.expovariate(args.arrival_rate)
+    elif args.arrival == "ramp":
+        for i in range(args.num_users):
+            yield args.ramp_seconds * i / args.num_users
+    elif args.arrival == "step":
+        for i in range(args.num_users):
+            yield args.step_seconds * (i // args.step_users)
+    else:
+        raise Exception(f"Unknown arrival pattern: {args.arrival}")
+
+async def post_webhook(session : aiohttp.ClientSession, args : Namespace, user_response : Any) -> bool:
+    headers = {
+        'X-Telegram-Bot-Api-Secret-Token': args.telegram_secret_token,
+        'Content-Type': 'application/json'
+    }
+    if args.traffic_recorder is not None:
+        args.traffic_recorder.record(user_response)
+    start = time.perf_counter()
+    status = None
+    try:
+        async with session.post(args.wrangler_url, json = user_response, headers = headers) as response:
+            await response.read()
+            status = response.status
+            return response.ok
+    except aiohttp.ClientError as e:
+        print(f"Webhook failed: {str(e)}")
+        return False
+    finally:
+        if args.recorder is not None:
+            args.recorder.record_webhook(user_response, time.perf_counter() - start, status)
+
+async def poll_changes(session : aiohttp.ClientSession, user_id : int, index : MessageIndex, wait : float):
+    # Brings the index up to date with the user's chat
+    url = f"{LOCAL_FAKE_TELEGRAM_SERVER_ADDRESS}/sim/users/{user_id}/changes"
+    params = { "since_version": index.version, "wait": wait }
+    try:
+        async with session.get(url, params = params) as response:
+            body = await response.json()
+    except aiohttp.ClientError as e:
+        print(f"Polling changes for {user_id} failed: {str(e)}")
+        return
+    index.apply(body["changed"], body["deleted"], reset = body["reset"])
+    index.version = body["version"]
+
+async def run_virtual_user(user_id : int, args : Namespace, webhook_session, poll_session, stats : LoadStats, deadline : float):
+    user_metadata = new_user_metadata(user_id)
+    index = MessageIndex()
+    await poll_changes(poll_session, user_id, index, wait = 0)
+    while time.monotonic() < deadline:
+        user_response = await asyncio.to_thread(get_simulated_user_webhook_response, args, index, user_metadata)
+        ok = await post_webhook(webhook_session, args, user_response)
+        stats.webhooks_sent += 1
+        stats.webhooks_failed += 0 if ok else 1
+        # Wait for the bot to answer, think it over, then catch up on anything else it sent
+        await poll_changes(poll_session, user_id, index, wait = LONG_POLL_SECONDS)
+        await asyncio.sleep(get_think_time_seconds())
+        await poll_changes(poll_session, user_id, index, wait = 0)
+
+def make_session(args : Namespace) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(limit = args.max_connections)
+    timeout = aiohttp.ClientTimeout(total = LONG_POLL_SECONDS + 30)
+    return aiohttp.ClientSession(connector = connector, timeout = timeout)
+
+async def generate_load(args : Namespace) -> LoadStats:
+    stats = LoadStats()
+    start = time.monotonic()
+    deadline = start + args.duration
+    # Separate pools, so long-polls parked on fake_telegram never starve webhook calls of connections
+    async with make_session(args) as webhook_session, make_session(args) as poll_session:
+        tasks = []
+        for i, offset in enumerate(iter_arrival_offsets(args)):
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if time.monotonic() >= deadline:
+                break
+            user_id = args.first_user_id + i
+            tasks.append(asyncio.create_task(run_virtual_user(user_id, args, webhook_session, poll_session, stats, deadline)))
+            stats.users_started += 1
+        results = await asyncio.gather(*tasks, return_exceptions = True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Virtual user failed: {str(result)}")
+    return stats
+
+def print_load_stats(stats : LoadStats, elapsed : float):
+    print(f"Users started: {stats.users_started}")
+    print(f"Webhooks sent: {stats.webhooks_sent} ({stats.webhooks_failed} failed)")
+    print(f"Throughput: {stats.webhooks_sent / elapsed:.2f} webhooks/sec over {elapsed:.1f} seconds")
+
+def do_it(args : Namespace):
+    start = time.monotonic()
+    stats = asyncio.run(generate_load(args))
+    print_load_stats(stats, time.monotonic() - start)
+
+if __name__ == "__main__":
+    args = parse_args()
+    do_it(args)
@@ -0,0 +1,219 @@
+from argparse import ArgumentParser, Namespace
+import csv, json, math, random, hashlib, datetime, bisect
+from typing import Any, Callable, Dict, List, Union
+from solders.pubkey import Pubkey
+
+"""
+    Synthetic market scenarios: deterministic per-token price series for stress testing trailing stops.
+
+    A scenario is a shape (how the price moves) multiplied by geometric Brownian motion noise, sampled every --step_seconds:
+        gbm              just the noise, with --drift_pct_per_hour and --volatility_pct_per_hour
+        pump_and_dump    flat, then up --pump_pct over --pump_seconds, then down --dump_pct over --dump_seconds
+        flash_crash      flat, then down --crash_pct over --crash_seconds, then back up --recovery_pct of the drop over --recovery_seconds
+        stair_step       a step of --step_pct every --stair_seconds (negative steps go down)
+        replay           the recorded prices in --replay_file, rescaled to each token's starting price
+    The event in pump_and_dump and flash_crash starts at --event_at (a fraction of --duration_seconds), --stagger_seconds later for
+    each successive token.  Zero stagger makes every token's trailing stops trigger at once.
+
+    Each of --num_tokens gets a synthetic mint address and starting price derived from --seed, so the same arguments
+    always produce the same file.  With --include_wen, WEN is scenario token 0.
+
+    The output JSON is read by fake_jupiter.py (--scenario, or market_scenario in .sim.settings.toml) to serve prices and quotes,
+    and by simulated_user.py to pick which tokens to trade.  --csv also writes (seconds, address, symbol, price) rows for other tools.
+
+    Example:
+        python3 scripts/market_scenarios.py --scenario flash_crash --num_tokens 20 --crash_pct 40 --out .simulator/scenario.json
+"""
+
+WEN_ADDRESS = "WENWENvqqNya429ubCdR81ZmD69brwQaaBYY6p3LCpk"
+WEN_DECIMALS = 5
+SECONDS_PER_HOUR = 3600
+
+def token_address(scenario : str, seed : int, index : int) -> str:
+    return str(Pubkey.from_bytes(hashlib.sha256(f"{scenario}:{seed}:{index}".encode()).digest()))
+
+"""
+    Shapes: price multiplier at t seconds, given the event start for this token
+"""
+
+def flat_shape(args : Namespace) -> Callable[[float,float],float]:
+    return lambda t, event_start: 1.0
+
+def ramp(t : float, start : float, seconds : float) -> float:
+    # 0 before start, 1 after start + seconds, linear in between
+    if t <= start:
+        return 0.0
+    if seconds <= 0 or t >= start + seconds:
+        return 1.0
+    return (t - start) / seconds
+
+def pump_and_dump_shape(args : Namespace) -> Callable[[float,float],float]:
+    pump = math.log(1 + args.pump_pct / 100)
+    dump = math.log(max(1e-9, 1 - args.dump_pct / 100))
+    def shape(t : float, event_start : float) -> float:
+        return math.exp(pump * ramp(t, event_start, args.pump_seconds) + dump * ramp(t, event_start + args.pump_seconds, args.dump_seconds))
+    return shape
+
+def flash_crash_shape(args : Namespace) -> Callable[[float,float],float]:
+    crash = 1 - args.crash_pct / 100
+    def shape(t : float, event_start : float) -> float:
+        crashed = 1 - (1 - crash) * ramp(t, event_start, args.crash_seconds)
+        recovered = (1 - crash) * (args.recovery_pct / 100) * ramp(t, event_start + args.crash_seconds, args.recovery_seconds)
+        return crashed + recovered
+    return shape
+
+def stair_step_shape(args : Namespace) -> Callable[[float,float],float]:
+    def shape(t : float, event_start : float) -> float:
+        return (1 + args.step_pct / 100) ** int(t // args.stair_seconds)
+    return shape
+
+def replay_shape(args : Namespace) -> Callable[[float,float],float]:
+    recorded = read_recorded_prices(args.replay_file)
+    recorded_seconds = [ seconds for (seconds, _) in recorded ]
+    first_price = recorded[0][1]
+    def shape(t : float, event_start : float) -> float:
+        # the latest recorded price at or before t
+        index = max(0, bisect.bisect_right(recorded_seconds, t) - 1)
+        return recorded[index][1] / first_price
+    return shape
+
+SHAPES = {
+    "gbm": flat_shape,
+    "pump_and_dump": pump_and_dump_shape,
+    "flash_crash": flash_crash_shape,
+    "stair_step": stair_step_shape,
+    "replay": replay_shape
+}
+
+def read_recorded_prices(filepath : str) -> List[List[float]]:
+    # CSV rows of (time, price), with or without a header.  Time is epoch seconds or an ISO timestamp, and is made relative to the first row.
+    rows = []
+    with open(filepath, "r", newline = "") as f:
+        for row in csv.reader(f):
+            try:
+                rows.append([parse_time(row[0]), float(row[1])])
+            except (ValueError, IndexError):
+                continue
+    if not rows:
+        raise Exception(f"No (time, price) rows in {filepath}")
+    rows.sort()
+    start = rows[0][0]
+    return [ [seconds - start, price] for (seconds, price) in rows ]
+
+def parse_time(value : str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value.strip()).timestamp()
+
+def price_series(args : Namespace, shape : Callable[[float,float],float], rng : random.Random, start_price : float, event_start : float) -> List[float]:
+    steps = int(args.duration_seconds // args.step_seconds) + 1
+    dt_hours = args.step_seconds / SECONDS_PER_HOUR
+    drift, volatility = args.drift_pct_per_hour / 100, args.volatility_pct_per_hour / 100
+    log_noise = 0.0
+    prices = []
+    for step in range(steps):
+        t = step * args.step_seconds
+        if step > 0:
+            log_noise += (drift - volatility ** 2 / 2) * dt_hours + volatility * math.sqrt(dt_hours) * rng.gauss(0, 1)
+        prices.append(start_price * shape(t, event_start) * math.exp(log_noise))
+    return prices
+
+def make_scenario(args : Namespace) -> Dict[str,Any]:
+    shape = SHAPES[args.scenario](args)
+    tokens = []
+    for index in range(args.num_tokens):
+        # Separate streams per token, so adding tokens doesn't change the others
+        rng = random.Random(f"{args.seed}:{index}")
+        is_wen = args.include_wen and index == 0
+        start_price = args.start_price * math.exp(rng.gauss(0, args.start_price_spread))
+        tokens.append({
+            "address": WEN_ADDRESS if is_wen else token_address(args.scenario, args.seed, index),
+            "symbol": "WEN" if is_wen else f"SIM{index}",
+            "name": "Wen" if is_wen else f"Simulated Token {index}",
+            "decimals": WEN_DECIMALS if is_wen else args.decimals,
+            "liquidity_sol": args.liquidity_sol,
+            "prices": price_series(args, shape, rng, start_price, args.event_at * args.duration_seconds + index * args.stagger_seconds)
+        })
+    params = { key: value for (key, value) in vars(args).items() if key not in ("out", "csv") }
+    return { "scenario": args.scenario, "seed": args.seed, "step_seconds": args.step_seconds, "params": params, "tokens": tokens }
+
+def read_scenario(filepath : str) -> Dict[str,Any]:
+    with open(filepath, "r") as f:
+        return json.load(f)
+
+class ScenarioPriceModel:
+    # Serves a scenario's prices in real time from `start` (a time.time()), holding the last price after it ends,
+    # or starting over with loop.  Tokens not in the scenario get their price from `fallback`.
+
+    def __init__(self, scenario : Dict[str,Any], start : float, fallback = None, loop : bool = False):
+        self.step_seconds = scenario["step_seconds"]
+        self.prices = { token["address"]: token["prices"] for token in scenario["tokens"] }
+        self.start = start
+        self.fallback = fallback
+        self.loop = loop
+
+    def price(self, address : str, now : float) -> Union[float,None]:
+        prices = self.prices.get(address)
+        if prices is None:
+            return self.fallback.price(address, now) if self.fallback is not None else None
+        step = max(0, int((now - self.start) // self.step_seconds))
+        return prices[step % len(prices)] if self.loop else prices[min(step, len(prices) - 1)]
+
+def write_csv(scenario : Dict[str,Any], filepath : str):
+    with open(filepath, "w", newline = "") as f:
+        writer = csv.writer(f)
+        writer.writerow(["seconds", "address", "symbol", "price"])
+        for token in scenario["tokens"]:
+            for step, price in enumerate(token["prices"]):
+                writer.writerow([step * scenario["step_seconds"], token["address"], token["symbol"], price])
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument("--scenario", type = str, required = True, choices = list(SHAPES))
+    parser.add_argument("--out", type = str, required = True)
+    parser.add_argument("--csv", type = str, required = False, default = None)
+    parser.add_argument("--seed", type = int, required = False, default = 0)
+    parser.add_argument("--num_tokens", type = int, required = False, default = 10)
+    parser.add_argument("--include_wen", action = "store_true")
+    parser.add_argument("--duration_seconds", type = float, required = False, default = 3600.0)
+    parser.add_argument("--step_seconds", type = float, required = False, default = 1.0)
+    # in SOL.  Each token's starting price is this times a lognormal factor with sigma --start_price_spread
+    parser.add_argument("--start_price", type = float, required = False, default = 0.0001)
+    parser.add_argument("--start_price_spread", type = float, required = False, default = 0.5)
+    parser.add_argument("--decimals", type = int, required = False, default = 6)
+    parser.add_argument("--liquidity_sol", type = float, required = False, default = 500.0)
+    # noise, in every scenario
+    parser.add_argument("--drift_pct_per_hour", type = float, required = False, default = 0.0)
+    parser.add_argument("--volatility_pct_per_hour", type = float, required = False, default = 5.0)
+    # events
+    parser.add_argument("--event_at", type = float, required = False, default = 0.25)
+    parser.add_argument("--stagger_seconds", type = float, required = False, default = 0.0)
+    parser.add_argument("--pump_pct", type = float, required = False, default = 200.0)
+    parser.add_argument("--pump_seconds", type = float, required = False, default = 300.0)
+    parser.add_argument("--dump_pct", type = float, required = False, default = 80.0)
+    parser.add_argument("--dump_seconds", type = float, required = False, default = 60.0)
+    parser.add_argument("--crash_pct", type = float, required = False, default = 50.0)
+    parser.add_argument("--crash_seconds", type = float, required = False, default = 10.0)
+    parser.add_argument("--recovery_pct", type = float, required = False, default = 80.0)
+    parser.add_argument("--recovery_seconds", type = float, required = False, default = 300.0)
+    parser.add_argument("--step_pct", type = float, required = False, default = -5.0)
+    parser.add_argument("--stair_seconds", type = float, required = False, default = 60.0)
+    parser.add_argument("--replay_file", type = str, required = False, default = None)
+    args = parser.parse_args()
+    if args.scenario == "replay" and args.replay_file is None:
+        parser.error("--replay_file is required for the replay scenario")
+    return args
+
+def do_it(args : Namespace):
+    scenario = make_scenario(args)
+    with open(args.out, "w") as f:
+        json.dump(scenario, f)
+    print(f"Wrote {args.scenario} scenario for {len(scenario['tokens'])} tokens ({len(scenario['tokens'][0]['prices'])} prices each) to {args.out}")
+    if args.csv is not None:
+        write_csv(scenario, args.csv)
+        print(f"Wrote {args.csv}")
+
+if __name__ == "__main__":
+    args = parse_args()
+    do_it(args)
@@ -0,0 +1,164 @@
+import os, json, threading
+from typing import Any, Dict, List, Tuple, Union
+from user_registry import user_pathed
+from user_locks import user_lock
+
+"""
+    The on-disk format of a simulated user's chat, `messages` in their directory: an append-only log, one compact JSON record per line.
+        {"op":"send","message":{...}}
+        {"op":"edit","message":{...}}
+        {"op":"delete","message_id":123}
+    Replaying the records in order gives the chat.  An empty file is an empty chat.
+
+    Writers append records (O(1) no matter how long the chat is), and now and then compact the log
+    by swapping in a snapshot of just the current messages (see should_compact).
+    Files in the old format, one JSON array of messages, are still read; the store rewrites them as a log on its first flush.
+
+    MessageLogChanges reads only the records appended since it last looked, so following a chat costs
+    as much as what changed rather than the whole file.
+
+    All reads and writes hold the user's "messages" lock (see user_locks.py).
+"""
+
+# Compact once the log has this many records, and at least this many times as many records as live messages
+COMPACTION_MIN_RECORDS = 256
+COMPACTION_RATIO = 2
+
+def message_log_filepath(user_id : int) -> str:
+    return user_pathed(user_id, "messages")
+
+def make_send_record(message : Any) -> Dict[str,Any]:
+    return { "op": "send", "message": message }
+
+def make_edit_record(message : Any) -> Dict[str,Any]:
+    return { "op": "edit", "message": message }
+
+def make_delete_record(message_id : int) -> Dict[str,Any]:
+    return { "op": "delete", "message_id": message_id }
+
+def encode_records(records : List[Dict[str,Any]]) -> str:
+    return "".join(json.dumps(record, separators = (",", ":")) + "\n" for record in records)
+
+def apply_records(messages : Dict[int,Any], lines : List[str]) -> Tuple[List[int],int]:
+    # Replays lines of records onto message_id -> message.  Returns (IDs of the messages touched, number of records)
+    touched = []
+    records = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        records += 1
+        if record["op"] == "delete":
+            message_id = record["message_id"]
+            messages.pop(message_id, None)
+        else:
+            message_id = record["message"]["message_id"]
+            messages[message_id] = record["message"]
+        touched.append(message_id)
+    return touched, records
+
+def parse_message_log(text : str) -> Tuple[List[Any],Union[int,None]]:
+    # (messages, number of records), where the number of records is None for a file in the old JSON array format
+    if text.lstrip().startswith("["):
+        return json.loads(text), None
+    messages = dict()
+    _, records = apply_records(messages, text.splitlines())
+    return list(messages.values()), records
+
+def read_message_log(user_id : int) -> Tuple[List[Any],Union[int,None]]:
+    with user_lock(user_id, "messages"):
+        if not os.path.exists(message_log_filepath(user_id)):
+            return [], 0
+        with open(message_log_filepath(user_id), "r") as f:
+            return parse_message_log(f.read())
+
+def read_user_messages(user_id : int) -> List[Any]:
+    messages, _ = read_message_log(user_id)
+    return messages
+
+def create_message_log(user_id : int):
+    # An empty chat, if the user doesn't have one yet
+    with user_lock(user_id, "messages"):
+        open(message_log_filepath(user_id), "a").close()
+
+def append_message_log(user_id : int, records : List[Dict[str,Any]]):
+    with user_lock(user_id, "messages"):
+        with open(message_log_filepath(user_id), "a") as f:
+            f.write(encode_records(records))
+
+def write_message_log_snapshot(user_id : int, messages : List[Any]):
+    # Compaction: the log is replaced by one send record per current message.
+    # Swapped in with os.replace, so readers never see a half-written file.
+    filename = message_log_filepath(user_id)
+    tmp_filename = filename + ".tmp"
+    with user_lock(user_id, "messages"):
+        with open(tmp_filename, "w") as f:
+            f.write(encode_records([ make_send_record(message) for message in messages ]))
+        os.replace(tmp_filename, filename)
+
+def should_compact(records : int, live_messages : int) -> bool:
+    return records >= COMPACTION_MIN_RECORDS and records >= COMPACTION_RATIO * live_messages
+
+class MessageLogChanges:
+    # Incremental reads of users' message logs, as UserMessageStore.get_changes does from memory.
+    # A version is the offset in the log read up to.  Compaction replaces the file, which resets readers:
+    # a file is only read on from where it was left if it is the same inode, and still has the last record read just before that offset
+    # (inodes get reused).
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # user_id -> (inode, offset, bytes of the last record before offset) of the last read
+        self._positions : Dict[int,Tuple[int,int,bytes]] = dict()
+
+    def get_changes(self, user_id : int, since_version : int) -> Tuple[int,List[Any],List[int],bool]:
+        # (version, messages sent or edited since since_version, IDs deleted since since_version, reset)
+        with self._lock:
+            position = self._positions.get(user_id)
+        with user_lock(user_id, "messages"):
+            if not os.path.exists(message_log_filepath(user_id)):
+                return 0, [], [], since_version != 0
+            # Binary, so offsets are byte offsets
+            with open(message_log_filepath(user_id), "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                if self._can_read_on(f, inode, since_version, position):
+                    f.seek(since_version)
+                    data = f.read()
+                    # Only whole lines
+                    offset = since_version + data.rfind(b"\n") + 1
+                    data = data[:offset - since_version]
+                    changed, deleted = self._replay_tail(data.decode())
+                    reset = False
+                else:
+                    # _can_read_on may have moved the file position
+                    f.seek(0)
+                    data = f.read()
+                    offset = len(data)
+                    messages, _ = parse_message_log(data.decode())
+                    changed, deleted, reset = messages, [], True
+        if data:
+            last_record = data[data.rfind(b"\n", 0, len(data) - 1) + 1:]
+        else:
+            # Nothing new (or an empty log): the last record read is still the one before offset
+            last_record = b"" if reset else position[2]
+        with self._lock:
+            self._positions[user_id] = (inode, offset, last_record)
+        return offset, changed, deleted, reset
+
+    def _can_read_on(self, f, inode : int, since_version : int, position : Union[Tuple[int,int,bytes],None]) -> bool:
+        if since_version < 0 or position is None or position[:2] != (inode, since_version):
+            return False
+        last_record = position[2]
+        f.seek(since_version - len(last_record))
+        return f.read(len(last_record)) == last_record
+
+    def _replay_tail(self, tail : str) -> Tuple[List[Any],List[int]]:
+        messages = dict()
+        deleted = set()
+        for line in tail.splitlines():
+            touched, _ = apply_records(messages, [line])
+            for message_id in touched:
+                if message_id in messages:
+                    deleted.discard(message_id)
+                else:
+                    deleted.add(message_id)
+        return list(messages.values()), sorted(deleted)
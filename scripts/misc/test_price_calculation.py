@@ -6,20 +6,26 @@ vsTokenAddress = "So11111111111111111111111111111111111111112"
 def parse_args():
     parser = ArgumentParser()
     parser.add_argument("--address", type = str, required = False, default = "WENWENvqqNya429ubCdR81ZmD69brwQaaBYY6p3LCpk")
+    # Point these at fake_jupiter.py (http://127.0.0.1:8084/v6/...) to run offline
+    parser.add_argument("--price_api_url", type = str, required = False, default = "https://price.jup.ag/v6/price")
+    parser.add_argument("--quote_api_url", type = str, required = False, default = "https://quote-api.jup.ag/v6/quote")
+    # Skips the token list lookup
+    parser.add_argument("--decimals", type = int, required = False, default = None)
     return parser.parse_args()
 
-def get_v6_price_api_price(address : str):
-    url = f"https://price.jup.ag/v6/price?ids={address}&vsToken={vsTokenAddress}"
+def get_v6_price_api_price(address : str, price_api_url : str):
+    url = f"{price_api_url}?ids={address}&vsToken={vsTokenAddress}"
     return ((requests.get(url).json())['data'][address]['price'])
 
-def get_v6_quote_api_price(address : str):
+def get_v6_quote_api_price(address : str, quote_api_url : str, token_decimals = None):
     
     slippageBps = 500 #invoke_v6_quote_api(address, "auto")["computedAutoSlippage"]
-    response = invoke_v6_quote_api(address, slippageBps)
+    response = invoke_v6_quote_api(address, slippageBps, quote_api_url)
     outAmount = response["outAmount"] # address
     inAmount = response["inAmount"] # SOL
 
-    token_decimals = get_token_decimals(address)
+    if token_decimals is None:
+        token_decimals = get_token_decimals(address)
 
     inAmountDecimalized = int(inAmount) / (1 * 10**9)
     outAmountDecimalized = int(outAmount) / (1 * 10**token_decimals)
@@ -35,10 +41,9 @@ def get_token_decimals(address):
     with open(".tokens.json", "r+") as f:
         return json.load(f)[address]["decimals"]
 
-def invoke_v6_quote_api(address : str, slippageBps):
+def invoke_v6_quote_api(address : str, slippageBps, quote_api_url : str):
     input_address = vsTokenAddress
     output_address = address
-    quote_api_url = "https://quote-api.jup.ag/v6/quote"
     swap_mode = 'ExactIn'
     hasPlatformFee = False
     restrictIntermediateTokens = False
@@ -57,9 +62,9 @@ def invoke_v6_quote_api(address : str, slippageBps):
 
 
 def do_it(args):
-    price_api_price = get_v6_price_api_price(args.address)
+    price_api_price = get_v6_price_api_price(args.address, args.price_api_url)
     print(f"{price_api_price:.20f}")
-    get_v6_quote_api_price(args.address)
+    get_v6_quote_api_price(args.address, args.quote_api_url, args.decimals)
 
 if __name__ == "__main__":
     args = parse_args()
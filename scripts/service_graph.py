@@ -0,0 +1,87 @@
+import time, threading, subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Tuple, Union
+from dev.local_dev_common import wait_until_ready
+
+"""
+    Starts the dev box's services from a dependency graph, rather than one after another.
+
+    Each Service is launched as soon as everything it depends_on is ready, so independent services start at the same time.
+    A service is ready when:
+        port and ready_path      a GET on ready_path answers without a server error (see wait_until_ready)
+        port only                its port accepts connections
+        neither                  its start function has returned (a one-off setup step, or a process nothing waits on)
+    Probes back off exponentially, so a fast service is noticed within milliseconds and a slow one isn't hammered.
+
+    Startup fails, and raises, if any service's process exits before it is ready or it isn't ready within its timeout.
+    Once everything is up, each service's launch time and time to ready are printed.
+    Each service's process is kept on it as .proc, which is what supervisor.py watches and restarts (unless restart is False).
+"""
+
+class Service:
+
+    def __init__(self,
+                 name : str,
+                 start : Callable[[], Union[subprocess.Popen,None]],
+                 depends_on : List[str] = [],
+                 port : Union[int,None] = None,
+                 ready_path : Union[str,None] = None,
+                 timeout : float = 120.0,
+                 restart : bool = True):
+        self.name = name
+        self.start = start
+        self.depends_on = depends_on
+        self.port = port
+        self.ready_path = ready_path
+        self.timeout = timeout
+        self.restart = restart
+        self.proc : Union[subprocess.Popen,None] = None
+
+def start_services(services : List[Service], child_procs : List[subprocess.Popen]):
+    # Launched processes are appended to child_procs as they start, so the caller can clean up even if startup fails
+    names = { service.name for service in services }
+    for service in services:
+        unknown = [ dependency for dependency in service.depends_on if dependency not in names ]
+        if unknown:
+            raise Exception(f"{service.name} depends on {', '.join(unknown)}, which isn't being started")
+    lock = threading.Lock()
+    t0 = time.monotonic()
+    pending = list(services)
+    running = dict()
+    # name -> (seconds after t0 it was launched, seconds from launch to ready)
+    timings : Dict[str,Tuple[float,float]] = dict()
+    pool = ThreadPoolExecutor(max_workers = len(services) or 1)
+    try:
+        while pending or running:
+            for service in [ service for service in pending if all(dependency in timings for dependency in service.depends_on) ]:
+                pending.remove(service)
+                running[pool.submit(start_service, service, child_procs, lock, t0)] = service
+            if not running:
+                raise Exception(f"Dependency cycle between {', '.join(service.name for service in pending)}")
+            done, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in done:
+                service = running.pop(future)
+                try:
+                    timings[service.name] = future.result()
+                except Exception as e:
+                    raise Exception(f"{service.name} failed to start: {e}")
+                print(f"{service.name} is ready ({timings[service.name][1]:.2f}s)")
+    finally:
+        pool.shutdown(wait = False, cancel_futures = True)
+    print_startup_times(timings, time.monotonic() - t0)
+
+def start_service(service : Service, child_procs : List[subprocess.Popen], lock : threading.Lock, t0 : float) -> Tuple[float,float]:
+    launched = time.monotonic()
+    proc = service.start()
+    service.proc = proc
+    if proc is not None:
+        with lock:
+            child_procs.append(proc)
+    if service.port is not None:
+        wait_until_ready(service.port, service.ready_path, timeout = service.timeout, proc = proc)
+    return launched - t0, time.monotonic() - launched
+
+def print_startup_times(timings : Dict[str,Tuple[float,float]], total : float):
+    print(f"=== Started {len(timings)} services in {total:.2f}s ===")
+    for name, (launched, ready) in sorted(timings.items(), key = lambda item: item[1][0] + item[1][1]):
+        print(f"  {name:<24} launched at {launched:>6.2f}s  ready after {ready:>6.2f}s")
@@ -0,0 +1,146 @@
+import os, csv, json, time, threading, atexit
+from argparse import ArgumentParser
+from glob import glob
+from typing import Any, Dict, Iterable, List, Tuple, Union
+from dev.local_dev_common import pathed, percentile
+from simulated_user import get_reply_question_type
+
+"""
+    Latency / throughput benchmarking for the simulation harness.
+
+    Every process taking part in a run (fake_telegram, the simulated user engine, the load generator)
+    appends one JSON sample per request to its own file under `.simulator/benchmark/`:
+        { "source", "kind", "label", "latency_ms", "status", "timestamp" }
+
+    where `kind` is the request kind (command, callback, reply_question, telegram)
+    and `label` is the command, the callback menu code, the reply question type or the bot API method.
+
+    Running this script aggregates all samples into p50/p95/p99 latency,
+    error counts and throughput per (kind, label), written as JSON or CSV (by --out extension).
+"""
+
+BENCHMARK_DIR = "benchmark"
+
+REPORT_COLUMNS = ["kind", "label", "count", "errors", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms", "throughput_per_sec"]
+
+class BenchmarkRecorder:
+
+    def __init__(self, source : str):
+        self.source = source
+        os.makedirs(benchmark_dir(), exist_ok = True)
+        self._lock = threading.Lock()
+        self._file = open(os.path.join(benchmark_dir(), f"{source}-{os.getpid()}.jsonl"), "a")
+        atexit.register(self.close)
+
+    def record(self, kind : str, label : str, latency_seconds : float, status : Union[int,None]):
+        sample = {
+            "source": self.source,
+            "kind": kind,
+            "label": label,
+            "latency_ms": round(latency_seconds * 1000, 3),
+            "status": status,
+            "timestamp": time.time()
+        }
+        line = json.dumps(sample) + "\n"
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line)
+
+    def record_webhook(self, user_response : Any, latency_seconds : float, status : Union[int,None]):
+        kind, label = describe_webhook_request(user_response)
+        self.record(kind, label, latency_seconds, status)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+def benchmark_dir():
+    return pathed(BENCHMARK_DIR)
+
+def describe_webhook_request(user_response : Any) -> Tuple[str,str]:
+    # (kind, label) of a webhook body sent by a simulated user
+    callback_query = user_response.get("callback_query")
+    if callback_query is not None:
+        return "callback", (callback_query.get("data") or "").split(":")[0]
+    message = user_response.get("message") or dict()
+    text = message.get("text") or ""
+    if "reply_to_message" in message:
+        return "reply_question", get_reply_question_type(message["reply_to_message"])
+    if text.startswith("/"):
+        return "command", text[1:]
+    return "message", "text"
+
+def is_error_status(status : Union[int,None]) -> bool:
+    return status is None or status >= 400
+
+def iter_samples(sample_fps : Iterable[str]) -> Iterable[Any]:
+    for sample_fp in sample_fps:
+        with open(sample_fp, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+def make_report(samples : Iterable[Any]) -> Dict[str,Any]:
+    latencies : Dict[Tuple[str,str],List[float]] = dict()
+    errors : Dict[Tuple[str,str],int] = dict()
+    first_timestamp, last_timestamp = None, None
+    for sample in samples:
+        key = (sample["kind"], sample["label"])
+        latencies.setdefault(key, []).append(sample["latency_ms"])
+        errors[key] = errors.get(key, 0) + (1 if is_error_status(sample["status"]) else 0)
+        first_timestamp = sample["timestamp"] if first_timestamp is None else min(first_timestamp, sample["timestamp"])
+        last_timestamp = sample["timestamp"] if last_timestamp is None else max(last_timestamp, sample["timestamp"])
+    window_seconds = max((last_timestamp or 0) - (first_timestamp or 0), 1e-9)
+    rows = []
+    for (kind, label) in sorted(latencies):
+        values = sorted(latencies[(kind, label)])
+        rows.append({
+            "kind": kind,
+            "label": label,
+            "count": len(values),
+            "errors": errors[(kind, label)],
+            "mean_ms": round(sum(values) / len(values), 3),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99),
+            "max_ms": values[-1],
+            "throughput_per_sec": round(len(values) / window_seconds, 3)
+        })
+    return {
+        "window_seconds": round(window_seconds, 3),
+        "total_requests": sum(row["count"] for row in rows),
+        "rows": rows
+    }
+
+def write_report(report : Dict[str,Any], out_fp : str):
+    if out_fp.endswith(".csv"):
+        with open(out_fp, "w", newline = "") as f:
+            writer = csv.DictWriter(f, fieldnames = REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(report["rows"])
+    else:
+        with open(out_fp, "w") as f:
+            json.dump(report, f, indent = 1)
+
+def print_report(report : Dict[str,Any]):
+    print(f"{report['total_requests']} requests over {report['window_seconds']} seconds")
+    for row in report["rows"]:
+        print(f"{row['kind']:<15} {row['label']:<40} n={row['count']:<7} err={row['errors']:<5} p50={row['p50_ms']:>9.1f}ms p95={row['p95_ms']:>9.1f}ms p99={row['p99_ms']:>9.1f}ms {row['throughput_per_sec']:>8.2f}/s")
+
+def write_benchmark_report(out_fp : str):
+    sample_fps = glob(os.path.join(benchmark_dir(), "*.jsonl"))
+    report = make_report(iter_samples(sample_fps))
+    write_report(report, out_fp)
+    print_report(report)
+    print(f"Wrote benchmark report to {out_fp}")
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument("--out", type = str, required = False, default = "benchmark_report.json")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    write_benchmark_report(args.out)
@@ -1,9 +1,14 @@
-import os, json, random, time, requests, re, shutil
+import os, json, random, time, requests, re, shutil, bisect
 from argparse import ArgumentParser, Namespace
-from typing import List, Union, Any
-from dev.transfer_funds import transfer_sol
+from itertools import islice
+from typing import Callable, Dict, List, Tuple, Union, Any
+from dev.transfer_funds import transfer_sol, MAINNET_RPC_URL
 from dev.local_dev_common import *
 from wrangler_common import get_secret
+from user_locks import user_lock
+from message_log import create_message_log, read_user_messages, MessageLogChanges
+from user_registry import user_pathed
+from market_scenarios import read_scenario, WEN_ADDRESS
 
 """
     The purpose of this script is to handle file change events on
@@ -21,71 +26,106 @@ from wrangler_common import get_secret
 def parse_args():
     parser = ArgumentParser()
     parser.add_argument("--user_id", type = int, required = True)
+    parser.add_argument("--benchmark", action = "store_true")
+    parser.add_argument("--record_webhooks", type = str, required = False, default = None)
+    parser.add_argument("--fake_solana_rpc", type = parse_bool, required = False, default = True)
     args = parser.parse_args()
-
+    return add_simulation_settings(args,
+        recorder = make_recorder("simulated_user") if args.benchmark else None,
+        traffic_recorder = make_traffic_recorder(args.record_webhooks),
+        fake_solana_rpc = args.fake_solana_rpc)
+
+def make_recorder(source : str):
+    from sim_benchmark import BenchmarkRecorder
+    return BenchmarkRecorder(source)
+
+def make_traffic_recorder(filepath : Union[str,None]):
+    if filepath is None:
+        return None
+    from webhook_replay import WebhookTrafficRecorder
+    return WebhookTrafficRecorder(filepath)
+
+def add_simulation_settings(args : Namespace, recorder = None, traffic_recorder = None, fake_solana_rpc : bool = True) -> Namespace:
     # Rather than restructure a lot of code...
     args.wrangler_url = LOCAL_CLOUDFLARE_WORKER_URL
     args.telegram_secret_token = get_secret("SECRET__TELEGRAM_BOT_WEBHOOK_SECRET_TOKEN", "sim")
     args.funding_wallet_private_key = get_secret("SECRET__SIMTEST_FUNDING_WALLET_PRIVATE_KEY", "sim")
     args.user_funding_amt = get_sim_setting("user_funding_amount")
-
+    # Funding transfers go where the worker's RPC calls go (see start_dev_box.py --fake_solana_rpc), unless the settings point somewhere else
+    args.solana_rpc_url = get_sim_setting("solana_rpc_url", LOCAL_FAKE_SOLANA_RPC_ADDRESS if fake_solana_rpc else MAINNET_RPC_URL)
+    # Keep-alive connections to the worker when many actions run in one process
+    args.session = requests.Session()
+    # When set, the latency and status of every webhook call is recorded (see sim_benchmark.py)
+    args.recorder = recorder
+    # When set, every webhook body is recorded for replay (see webhook_replay.py)
+    args.traffic_recorder = traffic_recorder
     return args
 
+def new_user_metadata(user_id : int):
+    return dict(user_id = user_id, unfunded = True, agreed_TOS = False, look_back = 3, nav_hint_paths = [])
+
 def load_user_metadata(user_id : int):
-    user_metadata_filepath = pathed(f"{user_id}.metadata")
+    user_metadata_filepath = user_pathed(user_id, "metadata")
     if  not os.path.exists(user_metadata_filepath):
-        user_metadata = dict(user_id = user_id, unfunded = True, agreed_TOS = False, look_back = 3, nav_hint_paths = [])     
+        user_metadata = new_user_metadata(user_id)
         with open(user_metadata_filepath, "w+") as f:
             json.dump(user_metadata, f)
     with open(user_metadata_filepath, "r+") as f:
         return json.load(f)
 
 def load_user_messages(user_id : int):
-    user_messages_filepath = pathed(f"{user_id}.messages")
-    if not os.path.exists(user_messages_filepath):
-        with open(user_messages_filepath, "w+") as f:
-            json.dump([], f, indent = 1)
-    with open(user_messages_filepath, "r+") as f:
-        messages = json.load(f)
-    return messages
-
-def try_click_on_legal_agreement_agree(messages, user_metadata):
-    recent_messages = messages[::-1]
+    create_message_log(user_id)
+    return read_user_messages(user_id)
+
+# user_id -> the user's MessageIndex, fed only the log records appended since it was last loaded (as SimulatedUserEngine does)
+user_message_indexes = dict()
+user_message_log_changes = MessageLogChanges()
+
+def load_user_message_index(user_id : int):
+    create_message_log(user_id)
+    index = user_message_indexes.setdefault(user_id, MessageIndex())
+    version, changed, deleted, reset = user_message_log_changes.get_changes(user_id, index.version)
+    index.apply(changed, deleted, reset = reset)
+    index.version = version
+    return index
+
+def try_click_on_legal_agreement_agree(index, user_metadata):
     # If the legal agreement is pulled up, click on it
-    for recent_message in recent_messages:
-        if has_menu_code(recent_message, "LegalAgreementAgree"):
-            return make_click_menu_code_button_webhook_request("LegalAgreementAgree", recent_message, user_metadata)
+    legal_agreement = index.latest_with_menu_code("LegalAgreementAgree")
+    if legal_agreement is not None:
+        return make_click_menu_code_button_webhook_request("LegalAgreementAgree", legal_agreement, user_metadata)
     # Otherwise, issue a command to open the legal agreement
     return None
 
-def get_simulated_user_webhook_response(args, messages, user_metadata) -> Union[Any,None]:
+def get_think_time_seconds() -> float:
+    # a random amount of time 0-10 seconds
+    return random.random() * get_sim_setting("user_response_delay_multiplier")
 
-    # sleep a random amount of time 0-10 seconds
-    time.sleep(random.random() * get_sim_setting("user_response_delay_multiplier"))
+def get_simulated_user_webhook_response(args, index, user_metadata) -> Union[Any,None]:
 
     # If there are no messages in history, initiate interactions with bot by opening up the legal_agreement
-    if len(messages) == 0:
-        return make_command_webhook_request('legal_agreement', messages, user_metadata)
+    if index.is_empty():
+        return make_command_webhook_request('legal_agreement', index, user_metadata)
     
     if not user_metadata["agreed_TOS"]:
-        accept_TOS_click_request = try_click_on_legal_agreement_agree(messages, user_metadata)
+        accept_TOS_click_request = try_click_on_legal_agreement_agree(index, user_metadata)
         if accept_TOS_click_request is not None:
             user_metadata["agreed_TOS"] = True
             return accept_TOS_click_request
         else:
-            return make_command_webhook_request('legal_agreement', messages, user_metadata)
+            return make_command_webhook_request('legal_agreement', index, user_metadata)
 
     # Scrape essential data out of messages history.  
     # If essential data is missing, add nav_hint_path that leads to page where it is scrapeable
-    try_scrape_metadata_from_messages(messages, user_metadata)
+    try_scrape_metadata_from_messages(index, user_metadata)
 
     # Always respond to a reply question if one is being asked
-    reply_question = get_reply_question(messages)
+    reply_question = index.pending_reply_question()
     if reply_question:
-        return make_response_to_reply_question_webhook_request(reply_question,user_metadata,next_message_id(messages))
+        return make_response_to_reply_question_webhook_request(reply_question,user_metadata,index.next_message_id())
 
     # Otherwise, If there are nav_hints to follow, try to follow them instead of doing anything else.
-    nav_hint_followed, response = try_follow_next_nav_hint(messages, user_metadata)
+    nav_hint_followed, response = try_follow_next_nav_hint(index, user_metadata)
     if nav_hint_followed is not None:
         update_nav_hint_paths(user_metadata, nav_hint_followed)       
         return response
@@ -95,25 +135,25 @@ def get_simulated_user_webhook_response(args, messages, user_metadata) -> Union[
         try_fund_user_wallet(args, user_metadata)
 
     # click a random button on a menu if any visible
-    recent_menus = get_menus(messages)[-user_metadata.get("look_back"):]
+    recent_menus = index.latest_menus(user_metadata.get("look_back"))
     if len(recent_menus) > 1:
         menu = random.choice(recent_menus)
         return make_click_random_menu_code_button_webhook_request(menu, user_metadata)
     
     # or issues the start command
-    return make_command_webhook_request("start", messages, user_metadata)
+    return make_command_webhook_request("start", index, user_metadata)
 
 def try_fund_user_wallet(args, user_metadata):
     allowance = args.user_funding_amt
     funding_wallet_private_key = args.funding_wallet_private_key
     user_wallet = user_metadata.get("wallet_address")
     if user_wallet is not None:
-        success = try_transfer_funds_to_user(funding_wallet_private_key, user_wallet, allowance)
+        success = try_transfer_funds_to_user(funding_wallet_private_key, user_wallet, allowance, args.solana_rpc_url)
         user_metadata["unfunded"] = not success
 
-def try_transfer_funds_to_user(funding_wallet_private_key, user_wallet, allowance):
+def try_transfer_funds_to_user(funding_wallet_private_key, user_wallet, allowance, rpc_url):
     try:
-        transfer_sol(funding_wallet_private_key, user_wallet, allowance)
+        transfer_sol(funding_wallet_private_key, user_wallet, allowance, rpc_url = rpc_url)
         return True
     except Exception as e:
         print(str(e))
@@ -134,9 +174,9 @@ def update_nav_hint_paths(user_metadata, nav_hint_followed):
     else:
         user_metadata["nav_hint_paths"][0] = active_nav_path
 
-def make_command_webhook_request(command, messages, user_metadata):
+def make_command_webhook_request(command, index, user_metadata):
     user_id = user_metadata.get("user_id")
-    new_message_id = next_message_id(messages)
+    new_message_id = index.next_message_id()
     return {
         "update_id": 123456789,
         "message": {
@@ -168,8 +208,8 @@ def make_command_webhook_request(command, messages, user_metadata):
         }
     }
 
-def try_follow_next_nav_hint(messages, user_metadata):
-    recent_messages = messages[::-1][:3]
+def try_follow_next_nav_hint(index, user_metadata):
+    recent_messages = index.latest_messages(3)
     active_nav_path = next(iter(user_metadata.get("nav_hint_paths")),None)
     if active_nav_path is None:
         return None,None
@@ -232,9 +272,6 @@ def make_click_random_menu_code_button_webhook_request(message, user_metadata):
 def get_message_id(message) -> Union[int,None]:
     return json_get(message, "message", "message_id") or json_get(message, "message_id")
 
-def get_menus(messages : List[Any]) -> List[Any]:
-    return [ message for message in messages if is_menu(message) ]
-
 def is_menu(message) -> bool:
     return len(parse_callback_buttons(message)) > 0
 
@@ -242,7 +279,7 @@ def add_nav_hint_path(user_metadata, path):
     if path not in user_metadata["nav_hint_paths"]:
         user_metadata["nav_hint_paths"].append(path)
 
-def scrape_metadata(user_metadata, messages, key, nav_path, scraper):
+def scrape_metadata(user_metadata, index, key, nav_path):
 
     # If the key hasn't been initialized, initialize with None and set a nav_path that results in getting the key
     if key not in user_metadata:
@@ -251,54 +288,148 @@ def scrape_metadata(user_metadata, messages, key, nav_path, scraper):
 
     # As long as the data is None, scrape for the data on the current page.
     if user_metadata[key] is None:
-        data = scraper(messages)
+        data = index.scraped(key)
         if data is not None:
             user_metadata[key] = data
 
-def try_scrape_metadata_from_messages(messages, user_metadata):
-    scrape_metadata(user_metadata, messages, "wallet_address", ["Main"], try_get_wallet_address)
-    scrape_metadata(user_metadata, messages, "private_key", ["Main","Wallet","View.PK","Wallet","Main"], try_get_private_key)
-    scrape_metadata(user_metadata, messages, "balance", ["Main"], try_get_balance)
-
-def try_get_wallet_address(messages):
-    for message in messages:
-        lines = (message.get("text") or "").splitlines()
-        for line in lines:
-            # This will match the main menu.
-            if ("Wallet" in line) and "<code>" in line and "</code>" in line:
-                match : re.Match[str]|None = re.search(r"<code>(?P<wallet>[^<]+)</code>",line)
-                if match:
-                    return match.group("wallet")
+def try_scrape_metadata_from_messages(index, user_metadata):
+    scrape_metadata(user_metadata, index, "wallet_address", ["Main"])
+    scrape_metadata(user_metadata, index, "private_key", ["Main","Wallet","View.PK","Wallet","Main"])
+    scrape_metadata(user_metadata, index, "balance", ["Main"])
+
+def try_get_wallet_address(message):
+    lines = (message.get("text") or "").splitlines()
+    for line in lines:
+        # This will match the main menu.
+        if ("Wallet" in line) and "<code>" in line and "</code>" in line:
+            match : re.Match[str]|None = re.search(r"<code>(?P<wallet>[^<]+)</code>",line)
+            if match:
+                return match.group("wallet")
                 
-def try_get_private_key(messages):
-    for message in messages:
-        lines = (message.get("text") or "").splitlines()
-        for line in lines:
-            if '<span class="tg-spoiler">' in line:
-                match : re.Match[str]|None = re.search(r'>(?P<private_key>[^<]+)</span>', line)
-                if match:
-                    return match.group("private_key")
-
-def try_get_balance(messages):
-    for message in messages:
-        lines = (message.get("text") or "").splitlines()
-        for line in lines:
-            if 'Wallet SOL Balance' in line:
-                match : re.Match[str]|None =  re.search(r"(?P<amt>[0-9₀₁₂₃₄₅₆₇₈₉]+)", line)
-                if match:
-                    amt : str = match.group("amt")
-                    amt = re.sub(r"(?P<subs>0[₀₁₂₃₄₅₆₇₈₉]+)", lambda m: "0"*int(m.group("subs")[1:]), amt)
-                    return float(amt)
+def try_get_private_key(message):
+    lines = (message.get("text") or "").splitlines()
+    for line in lines:
+        if '<span class="tg-spoiler">' in line:
+            match : re.Match[str]|None = re.search(r'>(?P<private_key>[^<]+)</span>', line)
+            if match:
+                return match.group("private_key")
+
+# int() doesn't read subscript digits
+SUBSCRIPT_DIGITS = str.maketrans("₀₁₂₃₄₅₆₇₈₉", "0123456789")
+
+def try_get_balance(message):
+    lines = (message.get("text") or "").splitlines()
+    for line in lines:
+        if 'Wallet SOL Balance' in line:
+            match : re.Match[str]|None =  re.search(r"(?P<amt>[0-9₀₁₂₃₄₅₆₇₈₉]+)", line)
+            if match:
+                amt : str = match.group("amt")
+                amt = re.sub(r"(?P<subs>0[₀₁₂₃₄₅₆₇₈₉]+)", lambda m: "0"*int(m.group("subs")[1:].translate(SUBSCRIPT_DIGITS)), amt)
+                return float(amt)
+
+# What try_scrape_metadata_from_messages looks for, and how to find it in a message
+MESSAGE_SCRAPERS = {
+    "wallet_address": try_get_wallet_address,
+    "private_key": try_get_private_key,
+    "balance": try_get_balance
+}
+
+class MessageIndex:
+    """
+        What a simulated user's decisions need to know about their chat, kept up to date incrementally.
+
+        `apply` processes only the messages sent, edited or deleted since the last call,
+        so a decision takes the same time whether the chat has ten messages or ten thousand.
+    """
+
+    def __init__(self, messages : Union[List[Any],None] = None):
+        # Version of the chat this index is up to date with (see UserMessageStore.get_changes)
+        self.version = -1
+        self.apply(messages or [], [], reset = True)
+
+    def apply(self, changed : List[Any], deleted : List[int], reset : bool = False):
+        if reset:
+            # message_id -> message, in message order (message IDs only go up)
+            self.messages : Dict[int,Any] = dict()
+            self.menu_ids : List[int] = []
+            # message_id -> what was scraped from it, for messages something was scraped from
+            self.scraped_by_message : Dict[int,Dict[str,Any]] = dict()
+            # key -> (message_id, value) from the earliest message it was scraped from
+            self.first_scraped : Dict[str,Tuple[int,Any]] = dict()
+        stale_keys = set()
+        for message_id in deleted:
+            stale_keys.update(self._forget(message_id))
+            self.messages.pop(message_id, None)
+        for message in sorted(changed, key = get_message_id):
+            message_id = get_message_id(message)
+            stale_keys.update(self._forget(message_id))
+            self.messages[message_id] = message
+            self._process(message_id, message)
+        for key in stale_keys:
+            self._rescrape(key)
+
+    def is_empty(self) -> bool:
+        return len(self.messages) == 0
+
+    def next_message_id(self) -> int:
+        return next(reversed(self.messages), 0) + 1
+
+    def latest_messages(self, count : int) -> List[Any]:
+        # newest first
+        return list(islice(reversed(self.messages.values()), count))
+
+    def latest_menus(self, count : int) -> List[Any]:
+        # oldest first
+        return [ self.messages[message_id] for message_id in self.menu_ids[-count:] ]
+
+    def latest_with_menu_code(self, menu_code : str) -> Union[Any,None]:
+        for message_id in reversed(self.menu_ids):
+            if has_menu_code(self.messages[message_id], menu_code):
+                return self.messages[message_id]
+        return None
+
+    def pending_reply_question(self) -> Union[Any,None]:
+        # A reply question is pending until the bot sends something after it
+        latest = self.latest_messages(1)
+        if latest and is_reply_question_message(latest[0]):
+            return latest[0]
+        return None
+
+    def scraped(self, key : str) -> Union[Any,None]:
+        return self.first_scraped[key][1] if key in self.first_scraped else None
+
+    def _process(self, message_id : int, message : Any):
+        if is_menu(message):
+            bisect.insort(self.menu_ids, message_id)
+        for key, scraper in MESSAGE_SCRAPERS.items():
+            value = scraper(message)
+            if value is None:
+                continue
+            self.scraped_by_message.setdefault(message_id, dict())[key] = value
+            if key not in self.first_scraped or message_id < self.first_scraped[key][0]:
+                self.first_scraped[key] = (message_id, value)
+
+    def _forget(self, message_id : int) -> List[str]:
+        # Drops what was learned from a message. Returns the keys whose earliest value came from it.
+        position = bisect.bisect_left(self.menu_ids, message_id)
+        if position < len(self.menu_ids) and self.menu_ids[position] == message_id:
+            del self.menu_ids[position]
+        self.scraped_by_message.pop(message_id, None)
+        return [ key for key, (first_message_id, _) in self.first_scraped.items() if first_message_id == message_id ]
+
+    def _rescrape(self, key : str):
+        # Rare: the message the value came from was edited or deleted. No message is re-parsed.
+        self.first_scraped.pop(key, None)
+        for message_id, scraped in self.scraped_by_message.items():
+            if key in scraped and (key not in self.first_scraped or message_id < self.first_scraped[key][0]):
+                self.first_scraped[key] = (message_id, scraped[key])
 
 
 def write_user_metadata(user_id, user_metadata):
-    with open(pathed(f"{user_id}.metadata"), "w+") as f:
+    with open(user_pathed(user_id, "metadata"), "w+") as f:
         json.dump(user_metadata, f, indent = 1)
 
 
-def get_reply_question(messages):
-    return next(filter(is_reply_question_message, messages[::-1]),None)
-    
 def is_reply_question_message(message):
     return message.get("reply_markup") and message.get("reply_markup").get("force_reply")
 
@@ -315,9 +446,20 @@ def make_response_to_reply_question_webhook_request(reply_question, user_metadat
     else:
         return make_reply_question_response("", reply_question, user_metadata, new_message_id)
 
+# Tokens to trade: the market scenario's, when one is configured (see market_scenarios.py)
+_tradeable_tokens = []
+
+def tradeable_tokens() -> List[str]:
+    if not _tradeable_tokens:
+        scenario_filepath = get_sim_setting("market_scenario", None)
+        if scenario_filepath is not None:
+            _tradeable_tokens.extend([ token["address"] for token in read_scenario(scenario_filepath)["tokens"] ])
+        else:
+            _tradeable_tokens.append(WEN_ADDRESS)
+    return _tradeable_tokens
+
 def random_token():
-    # TODO: pull from large list of tokens
-    return random.choice(["WENWENvqqNya429ubCdR81ZmD69brwQaaBYY6p3LCpk"])
+    return random.choice(tradeable_tokens())
 
 def get_reply_question_type(reply_question):
     text = reply_question.get("text").lower()
@@ -406,52 +548,37 @@ def parse_callback_buttons(request_data):
     return buttons
 
 def send_to_wrangler(user_response, args):
-    requests.post(args.wrangler_url, json = user_response, headers = {
-        'X-Telegram-Bot-Api-Secret-Token': args.telegram_secret_token,
-        'Content-Type': 'application/json'
-    })
-
-
-def wait_for_no_file_locks(user_id):
-    start = time.time()
-    messages_lock_filepath = pathed(f"{user_id}.messages.lock")
-    metadata_lock_filepath = pathed(f"{user_id}.metadata.lock")
-    while True:
-        if not os.path.exists(messages_lock_filepath) and not os.path.exists(metadata_lock_filepath):
-            break
-        time.sleep(0.1)
-        if time.time() - start > 10:
-            break
-
-def acquire_file_locks(user_id):
-    wait_for_no_file_locks(user_id)
-    messages_lock_filepath = pathed(f"{user_id}.messages.lock")
-    with open(messages_lock_filepath, "w+") as f:
-        f.write(f"{int(time.time())}")
-    metadata_lock_filepath = pathed(f"{user_id}.metadata.lock")
-    with open(metadata_lock_filepath, "w+") as f:
-        f.write(f"{int(time.time())}")
-
-def release_file_locks(user_id):
-    messages_lock_filepath = pathed(f"{user_id}.messages.lock")
-    metadata_lock_filepath = pathed(f"{user_id}.metadata.lock") 
-    if os.path.exists(messages_lock_filepath):
-        os.remove(messages_lock_filepath)
-    if os.path.exists(metadata_lock_filepath):
-        os.remove(metadata_lock_filepath)
+    if args.traffic_recorder is not None:
+        args.traffic_recorder.record(user_response)
+    start = time.perf_counter()
+    status = None
+    try:
+        response = args.session.post(args.wrangler_url, json = user_response, headers = {
+            'X-Telegram-Bot-Api-Secret-Token': args.telegram_secret_token,
+            'Content-Type': 'application/json'
+        })
+        status = response.status_code
+        return response
+    finally:
+        if args.recorder is not None:
+            args.recorder.record_webhook(user_response, time.perf_counter() - start, status)
+
 
 def do_it(args : Namespace):
-    user_id = args.user_id
-    try:
-        messages = load_user_messages(user_id)
+    # sleep a random amount of time before responding, like a person would
+    time.sleep(get_think_time_seconds())
+    take_action(args, args.user_id, load_user_message_index)
+
+def take_action(args : Namespace, user_id : int, load_index : Callable[[int],MessageIndex]):
+    # One action at a time per user, across processes: the metadata read-modify-write can't interleave
+    with user_lock(user_id, "metadata"):
+        index = load_index(user_id)
         user_metadata = load_user_metadata(user_id)
         orig_user_metadata = deep_clone(user_metadata)
-        user_response = get_simulated_user_webhook_response(args, messages, user_metadata)
+        user_response = get_simulated_user_webhook_response(args, index, user_metadata)
         if not deep_equals(orig_user_metadata, user_metadata):
             write_user_metadata(user_id, user_metadata)
         send_to_wrangler(user_response, args)
-    finally:
-        release_file_locks(user_id)
 
 def deep_clone(x):
     return json.loads(json.dumps(x))
@@ -466,11 +593,7 @@ def json_get(obj, *props):
         obj = obj[prop]
     return obj
 
-def next_message_id(messages : List[Any]) -> int:
-    return max([x for x in [get_message_id(message) for message in messages] if x is not None ], default = 0) + 1
-
 if __name__ == "__main__":
     args = parse_args()
-    acquire_file_locks(args.user_id)
     maybe_attach_debugger("simulated_user", SIMULATED_USER_DEBUG_PORT)
     do_it(args)
\ No newline at end of file
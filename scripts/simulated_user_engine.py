@@ -0,0 +1,100 @@
+import time, heapq, threading
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Set, Tuple, Union
+from simulated_user import add_simulation_settings, get_think_time_seconds, take_action, make_traffic_recorder, MessageIndex
+
+"""
+    Hosts every simulated user in one long-lived process.
+
+    Instead of starting a `simulated_user.py` process per `.messages` change,
+    callers `notify` the engine that a user's chat changed.  The engine waits out the
+    user's think time on a timer (no thread is parked while a user 'thinks'),
+    then runs the user's next action on a thread pool.
+
+    Each user has at most one action scheduled or running at a time.
+    Notifications that arrive while a user is busy are coalesced into one follow-up action,
+    so a burst of edits to a chat produces one response, made against the latest messages.
+
+    Given `load_changes` (UserMessageStore.get_changes, or MessageLogChanges.get_changes), the engine keeps each user's MessageIndex
+    between actions and feeds it only what changed since. Otherwise each action indexes the user's whole chat.
+"""
+
+DEFAULT_MAX_WORKERS = 64
+
+class SimulatedUserEngine:
+
+    def __init__(self, load_messages : Callable[[int],List[Any]], max_workers : int = DEFAULT_MAX_WORKERS, recorder = None, record_webhooks : Union[str,None] = None, load_changes = None, fake_solana_rpc : bool = True):
+        self.load_messages = load_messages
+        self.load_changes = load_changes
+        self._indexes : Dict[int,MessageIndex] = dict()
+        self.args = add_simulation_settings(Namespace(), recorder = recorder, traffic_recorder = make_traffic_recorder(record_webhooks), fake_solana_rpc = fake_solana_rpc)
+        self._pool = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = "simulated-user")
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._due : List[Tuple[float,int]] = [] # heap of (due time, user_id)
+        self._busy : Set[int] = set()           # scheduled or running
+        self._renotified : Set[int] = set()     # notified while busy
+        self._stopped = False
+        self._dispatcher = threading.Thread(target = self._dispatch_loop, name = "simulated-user-dispatcher", daemon = True)
+
+    def start(self):
+        self._dispatcher.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._wake.notify()
+        self._dispatcher.join()
+        self._pool.shutdown(wait = True)
+
+    def notify(self, user_id : int):
+        with self._lock:
+            if user_id in self._busy:
+                self._renotified.add(user_id)
+                return
+            self._schedule(user_id)
+
+    def _schedule(self, user_id : int):
+        # caller holds self._lock
+        self._busy.add(user_id)
+        heapq.heappush(self._due, (time.monotonic() + get_think_time_seconds(), user_id))
+        self._wake.notify()
+
+    def _dispatch_loop(self):
+        with self._lock:
+            while not self._stopped:
+                if not self._due:
+                    self._wake.wait()
+                    continue
+                due_at, user_id = self._due[0]
+                wait_for = due_at - time.monotonic()
+                if wait_for > 0:
+                    self._wake.wait(wait_for)
+                    continue
+                heapq.heappop(self._due)
+                self._pool.submit(self._run_action, user_id)
+
+    def _load_index(self, user_id : int) -> MessageIndex:
+        # Only called from the user's own action, and a user has one action running at a time
+        if self.load_changes is None:
+            return MessageIndex(self.load_messages(user_id))
+        with self._lock:
+            index = self._indexes.setdefault(user_id, MessageIndex())
+        version, changed, deleted, reset = self.load_changes(user_id, index.version)
+        index.apply(changed, deleted, reset = reset)
+        index.version = version
+        return index
+
+    def _run_action(self, user_id : int):
+        try:
+            take_action(self.args, user_id, self._load_index)
+        except Exception as e:
+            print(f"Simulated user {user_id} failed to act: {str(e)}")
+        finally:
+            with self._lock:
+                self._busy.discard(user_id)
+                if user_id in self._renotified:
+                    self._renotified.discard(user_id)
+                    self._schedule(user_id)
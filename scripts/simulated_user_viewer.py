@@ -1,13 +1,29 @@
 from argparse import ArgumentParser
-import os, json
-from typing import List, Iterable, Any
-from glob import glob
-from flask import Flask, request, jsonify
-from dev.local_dev_common import LOCAL_CLOUDFLARE_WORKER_URL, pathed, sim_dir
+import os, json, time
+from typing import List, Iterable, Any, Dict, Iterator, Tuple, Union
+import requests
+from flask import Flask, Response, request
+from dev.local_dev_common import LOCAL_CLOUDFLARE_WORKER_URL, LOCAL_FAKE_TELEGRAM_SERVER_ADDRESS
 from wrangler_common import get_secret
+from message_log import MessageLogChanges, message_log_filepath, read_user_messages
+from user_registry import list_user_ids
+
+"""
+    Shows a user's chat in the browser, with clickable buttons.
+
+    The page shows the latest --page_size messages, with a button to load older ones a page at a time.
+    New, edited and deleted messages are then pushed to the page as server-sent events, one message's HTML at a time.
+    They come from fake_telegram.py's message store when it is running (long-polling /sim/users/<user_id>/changes),
+    and otherwise from reading what is appended to the user's .messages log.
+"""
 
 SIMULATED_USER_VIEWER_PORT = 8082
 
+DEFAULT_PAGE_SIZE = 50
+# How long each long-poll of fake_telegram waits for a change, and how often the .messages file is checked without it
+CHANGES_WAIT_SECONDS = 20.0
+FILE_POLL_SECONDS = 1.0
+
 css = """
     <style type="text/css">
 
@@ -37,6 +53,11 @@ css = """
     .keyboard {
     }
 
+    .load-older {
+        display: block;
+        margin: 10px auto;
+    }
+
     .keyboard-line {
         display: flex;
         width: 100%;
@@ -132,21 +153,105 @@ def make_scripts_tag(user_id, wrangler_url, telegram_bot_api_secret_token):
     """
     return script_tag
 
+def make_live_updates_script(user_id, version, follow : bool):
+    # version is null when the page was rendered from the .messages file
+    return f"""
+    <script type='text/javascript'>
+
+        function scrollToBottom() {{
+            window.scrollTo(0, document.body.scrollHeight);
+        }}
+
+        function findMessage(messageID) {{
+            return document.querySelector(`.message-entry[data-message-id='${{messageID}}']`);
+        }}
+
+        function upsertMessage(messageID, html) {{
+            const existing = findMessage(messageID);
+            if (existing) {{
+                existing.outerHTML = html;
+            }}
+            else {{
+                document.getElementById('messages').insertAdjacentHTML('beforeend', html);
+                if ({str(follow).lower()}) {{
+                    scrollToBottom();
+                }}
+            }}
+        }}
+
+        function loadOlder(button) {{
+            const xhr = new XMLHttpRequest();
+            xhr.open('GET', `/{user_id}/older?before=${{button.dataset.before}}`, true);
+            xhr.onload = function() {{
+                button.outerHTML = xhr.responseText;
+            }};
+            xhr.send();
+        }}
+
+        document.addEventListener('DOMContentLoaded', function() {{
+            document.body.addEventListener('click', function(event) {{
+                if (event.target.classList.contains('load-older')) {{
+                    loadOlder(event.target);
+                }}
+            }});
+            const version = {json.dumps(version)};
+            const source = new EventSource(version === null ? '/{user_id}/events' : `/{user_id}/events?since_version=${{version}}`);
+            source.addEventListener('upsert', function(event) {{
+                const update = JSON.parse(event.data);
+                upsertMessage(update.message_id, update.html);
+            }});
+            source.addEventListener('delete', function(event) {{
+                const deleted = findMessage(JSON.parse(event.data).message_id);
+                if (deleted) {{
+                    deleted.remove();
+                }}
+            }});
+            source.addEventListener('reset', function(event) {{
+                location.reload();
+            }});
+            if ({str(follow).lower()}) {{
+                scrollToBottom();
+            }}
+        }});
+    </script>
+    """
+
 app = Flask(__name__)
 
 args = dict()
 
 @app.route("/<int:user_id>", methods = ['GET'])
 def view_user(user_id : int):
-    messages = get_user_messages(user_id)
-    html = render_user_messages(user_id, messages, args.get("auto_refresh") or False)
+    version, messages = get_user_chat(user_id)
+    html = render_user_messages(user_id, version, messages, args.get("auto_refresh") or False)
     return html
 
-def render_user_messages(user_id : int, messages : List[Any], auto_refresh : bool):
+@app.route("/<int:user_id>/older", methods = ['GET'])
+def view_older_messages(user_id : int):
+    # The page of messages before `before`, replacing the 'load older' button that asked for them
+    before = request.args.get("before", type = int)
+    _, messages = get_user_chat(user_id)
+    return render_page(user_id, [ message for message in messages if message["message_id"] < before ])
+
+@app.route("/<int:user_id>/events", methods = ['GET'])
+def stream_user_events(user_id : int):
+    since_version = request.args.get("since_version", default = None, type = int)
+    return Response(iter_user_events(user_id, since_version), mimetype = "text/event-stream", headers = { "Cache-Control": "no-cache" })
+
+def render_user_messages(user_id : int, version : Union[int,None], messages : List[Any], auto_refresh : bool):
+    body = f"<div id='messages'>{render_page(user_id, messages)}</div>"
+    return make_html_doc(body, auto_refresh, user_id, version)
+
+def render_page(user_id : int, messages : List[Any]) -> str:
+    # The last page of `messages`, preceded by a button to load the ones before it
+    page_size = args.get("page_size") or DEFAULT_PAGE_SIZE
+    page = messages[-page_size:]
     body = []
-    for message in messages:
+    if len(messages) > len(page):
+        body.append(f"<button class='load-older' data-before='{page[0]['message_id']}'>Load older messages</button>")
+    for message in page:
         body.append(render_user_message(user_id, message))
-    return make_html_doc(os.sep.join(body),auto_refresh,user_id)
+    return os.sep.join(body)
 
 def render_user_message(user_id, message):
     text = message.get("text") or (message.get("message") or dict()).get("text") or ""
@@ -155,12 +260,12 @@ def render_user_message(user_id, message):
     maybe_reply_question_input_box = make_reply_question_input_box(message)
     message_payload = json.dumps(message)
     keyboard_markup = render_keyboard(keyboard)
-    return f"""<div class='message' id='{user_id}'>
+    return f"""<div class='message-entry' data-message-id='{message.get("message_id")}'><div class='message' id='{user_id}'>
         <div class='message-payload'>{message_payload}</div>
         <div class='message-text'>{text}</div>
         <div class='keyboard'>{keyboard_markup}</div>
         {maybe_reply_question_input_box}
-    </div><br/><hr/><br/>"""
+    </div><br/><hr/><br/></div>"""
 
 def make_reply_question_input_box(message):
     is_reply_question = (message.get("reply_markup") or dict()).get("force_reply") or False
@@ -175,7 +280,7 @@ def render_keyboard(keyboard):
         keyboard_markup += f"<div class='keyboard-line'>"
         width = 100/len(line)
         for button in line:
-            keyboard_markup += f"<div class='button' style='width:{width}%'>{button.get("text")}<span class='callback-data'>{button.get("callback_data")}</span></div>"
+            keyboard_markup += f"<div class='button' style='width:{width}%'>{button.get('text')}<span class='callback-data'>{button.get('callback_data')}</span></div>"
         keyboard_markup += "</div>"
     return keyboard_markup
 
@@ -186,57 +291,83 @@ def list_users():
     html = render_user_ids(user_ids_iter)
     return html
 
+def get_user_chat(user_id : int) -> Tuple[Union[int,None],List[Any]]:
+    # (version, messages) from fake_telegram's store, or (None, messages) from the .messages file if it isn't running
+    try:
+        response = requests.get(f"{LOCAL_FAKE_TELEGRAM_SERVER_ADDRESS}/sim/users/{user_id}/changes", params = { "since_version": -1 })
+        response.raise_for_status()
+        chat = response.json()
+        return chat["version"], chat["changed"]
+    except requests.RequestException:
+        return None, get_user_messages(user_id)
+
+"""
+    Server-sent events: 'upsert' with a message's HTML when it is sent or edited, 'delete' when it is deleted,
+    and 'reset' when the page is too far behind to catch up and should reload.
+"""
+
+def iter_user_events(user_id : int, since_version : Union[int,None]) -> Iterator[str]:
+    changes = iter_file_changes(user_id) if since_version is None else iter_store_changes(user_id, since_version)
+    for (changed, deleted, reset) in changes:
+        if reset:
+            yield make_event("reset", {})
+            return
+        for message in changed:
+            yield make_event("upsert", { "message_id": message["message_id"], "html": render_user_message(user_id, message) })
+        for message_id in deleted:
+            yield make_event("delete", { "message_id": message_id })
+        if not changed and not deleted:
+            # Keeps the connection open, and notices when the browser has gone
+            yield ": keep-alive\n\n"
+
+def make_event(event : str, data : Dict[str,Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def iter_store_changes(user_id : int, since_version : int) -> Iterator[Tuple[List[Any],List[int],bool]]:
+    session = requests.Session()
+    while True:
+        response = session.get(f"{LOCAL_FAKE_TELEGRAM_SERVER_ADDRESS}/sim/users/{user_id}/changes", params = { "since_version": since_version, "wait": CHANGES_WAIT_SECONDS })
+        response.raise_for_status()
+        chat = response.json()
+        since_version = chat["version"]
+        yield chat["changed"], chat["deleted"], chat["reset"]
+
+def iter_file_changes(user_id : int) -> Iterator[Tuple[List[Any],List[int],bool]]:
+    # Reads the records appended to the .messages log whenever it changes.  A compaction resets the page.
+    log_changes = MessageLogChanges()
+    version, _, _, _ = log_changes.get_changes(user_id, -1)
+    last_stat = None
+    while True:
+        stat = os.stat(message_log_filepath(user_id)) if os.path.exists(message_log_filepath(user_id)) else None
+        changed, deleted, reset = [], [], False
+        if stat is not None and (stat.st_ino, stat.st_size, stat.st_mtime_ns) != last_stat:
+            last_stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            version, changed, deleted, reset = log_changes.get_changes(user_id, version)
+        yield changed, deleted, reset
+        if not changed and not deleted:
+            time.sleep(FILE_POLL_SECONDS)
+
 def get_user_messages(user_id):
-    user_messages_fp = pathed(f"{user_id}.messages")
-    if os.path.exists(user_messages_fp):
-        with open(user_messages_fp, "r+") as f:
-            return json.load(f)
-    else:
-        return []
+    return read_user_messages(user_id)
     
 def iter_user_ids():
-    user_message_fps = glob(os.path.join(sim_dir(), "*.messages"))
-    for user_message_fp in user_message_fps:
-        user_id = int(os.path.splitext(os.path.basename(user_message_fp))[0])
-        yield user_id
+    yield from list_user_ids()
 
 def render_user_ids(user_ids : Iterable[int]) -> str:
     html = []
     for user_id in user_ids:
         html.append(f"<a href='/{user_id}'>View {user_id}</a>")
-    return make_html_doc(os.sep.join(html),False,0)
-
-def make_auto_refresh_script(auto_refresh : bool):
-    if auto_refresh:
-        return f"""
-                <script type='text/javascript'>
-
-                    function scrollToBottom() {{
-                        window.scrollTo(0, document.body.scrollHeight);
-                    }}
-
-                    window.onload = function() {{
-                        scrollToBottom();
-                    }};
-
-                    function refresh() {{
-                        location.reload()
-                    }}
-
-                    setTimeout(refresh, 5000);
-                </script>
-        """
-    else:
-        return ""
+    return make_html_doc(os.sep.join(html),False,0,None,live_updates = False)
 
-def make_html_doc(body, auto_refresh, user_id):
-    maybe_auto_refresh = make_auto_refresh_script(auto_refresh)
+def make_html_doc(body, auto_refresh, user_id, version, live_updates : bool = True):
+    # With auto_refresh, the page stays scrolled to the newest message as they arrive
+    maybe_live_updates = make_live_updates_script(user_id, version, auto_refresh) if live_updates else ""
     wrangler_url = LOCAL_CLOUDFLARE_WORKER_URL
     telegram_bot_api_secret_token = get_secret("SECRET__TELEGRAM_BOT_WEBHOOK_SECRET_TOKEN", "sim")
     
     return f"""<html>
         <head>
-        {maybe_auto_refresh}
+        {maybe_live_updates}
         {css}
         {make_scripts_tag(user_id, wrangler_url, telegram_bot_api_secret_token)}
         </head>
@@ -246,9 +377,10 @@ def make_html_doc(body, auto_refresh, user_id):
 def parse_args():
     parser = ArgumentParser()
     parser.add_argument("--auto_refresh", action="store_true")
+    parser.add_argument("--page_size", type = int, required = False, default = DEFAULT_PAGE_SIZE)
     parsed_args = parser.parse_args()
     args.update(vars(parsed_args))
 
 if __name__ == "__main__":
     parse_args()
-    app.run(debug = True, port = SIMULATED_USER_VIEWER_PORT)
\ No newline at end of file
+    app.run(debug = True, port = SIMULATED_USER_VIEWER_PORT, threaded = True)
\ No newline at end of file
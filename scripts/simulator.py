@@ -1,14 +1,10 @@
-from glob import glob
+import shutil, shlex
 from dev.local_dev_common import * 
 from dev.local_dev_common import *
 from simulated_user_viewer import SIMULATED_USER_VIEWER_PORT
 from wrangler_common import get_secret
-
-def remove_lingering_file_locks():
-    lock_filepaths = glob(os.path.join(pathed(""), "*.lock"))
-    for lock_filepath in lock_filepaths:
-        if os.path.exists(lock_filepath):
-            os.remove(lock_filepath)
+from sim_benchmark import benchmark_dir
+from user_registry import migrate_flat_layout
 
 def spin_up_simulation_users():
     cmd = f"python3 scripts/spin_up_users.py"
@@ -20,17 +16,42 @@ def start_user_messages_file_watcher():
     process = execute_shell_command(cmd)
     return process
 
-def start_fake_telegram_server():
-    cmd = "python3 scripts/fake_telegram.py"
+# These only launch their processes: start_dev_box.py waits for them to be ready (see service_graph.py)
+
+def start_fake_telegram_server(benchmark : bool = False, record_webhooks : Union[str,None] = None, fake_solana_rpc : bool = True):
+    # Hosts the simulated users in-process, so there is no separate file watcher to start
+    cmd = "python3 scripts/fake_telegram.py --simulated_users"
+    if benchmark:
+        cmd += " --benchmark"
+    if record_webhooks is not None:
+        cmd += f" --record_webhooks {shlex.quote(record_webhooks)}"
+    if not fake_solana_rpc:
+        cmd += " --fake_solana_rpc=false"
+    process = execute_shell_command(cmd)
+    return process
+
+def start_fake_solana_rpc_server():
+    # In-memory ledger standing in for mainnet RPC (see fake_solana_rpc.py)
+    cmd = "python3 scripts/fake_solana_rpc.py"
+    process = execute_shell_command(cmd)
+    return process
+
+def start_fake_jupiter_server(virtual_clock : bool = False):
+    # Price, quote and swap APIs for offline trading (see fake_jupiter.py)
+    cmd = "python3 scripts/fake_jupiter.py"
+    if virtual_clock:
+        cmd += " --virtual_clock"
     process = execute_shell_command(cmd)
-    poll_until_port_is_occupied(FAKE_TELEGRAM_SERVER_PORT)
     return process
 
 def start_simulated_user_viewer():
     cmd = "python3 scripts/simulated_user_viewer.py"
     process = execute_shell_command(cmd)
-    poll_until_port_is_occupied(SIMULATED_USER_VIEWER_PORT)
     return process
 
 def ensure_simdir_exists():
     os.makedirs(sim_dir(), exist_ok = True)
+    migrate_flat_layout()
+
+def remove_benchmark_samples():
+    shutil.rmtree(benchmark_dir(), ignore_errors = True)
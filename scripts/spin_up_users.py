@@ -1,46 +1,51 @@
-import os, time, random, json
-from glob import glob
+import os, time, random, requests
 from argparse import ArgumentParser
 from dev.local_dev_common import *
+from message_log import message_log_filepath, create_message_log
+from user_registry import list_user_ids, next_user_id, mark_user_woken
 
 def parse_args():
     parser = ArgumentParser()
+    # 'fake_telegram' when fake_telegram.py hosts the simulated users, 'touch' when file_watcher.py does
+    parser.add_argument("--wake", choices = ["fake_telegram", "touch"], required = False, default = "fake_telegram")
     return parser.parse_args()
 
-def user_id_of(fp):
-    return int(os.path.splitext(os.path.basename(fp))[0])+1
-
 def touch(fp):
     with open(fp, 'a'):
         os.utime(fp, times=None)  # Set to current time
 
+def wake_user(args, user_id : int):
+    if args.wake == "touch":
+        touch(message_log_filepath(user_id))
+    else:
+        requests.post(f"{LOCAL_FAKE_TELEGRAM_SERVER_ADDRESS}/sim/users/{user_id}/wake")
+    mark_user_woken(user_id)
+
 def do_it(args):
 
     num_users = get_sim_setting("num_users")
     user_spinup_delay_seconds = get_sim_setting("user_spinup_delay_seconds")
-    messages_fps = glob(os.path.join(sim_dir(), "*.messages"))
+    user_ids = list_user_ids()
     user_count = 0
 
-    # For existing users, wake up an existing user by touching the file
-    for messages_fp in messages_fps:
-        print(f"Waking up user with ID {user_id_of(messages_fp)}")
-        touch(messages_fp)
+    # Wake up the existing users first
+    for user_id in user_ids:
+        print(f"Waking up user with ID {user_id}")
+        wake_user(args, user_id)
         user_count += 1
         randn_noise = random.gauss(0,0.5)
-        time.sleep(user_spinup_delay_seconds + randn_noise)
+        time.sleep(max(0.0, user_spinup_delay_seconds + randn_noise))
 
-    # If we still don't have enough users, make some by writing out empty user messages files, then touching the files
-    next_user_id = max([ user_id_of(messages_fp) for messages_fp in messages_fps ], default = 0) + 1
+    # If we still don't have enough users, make some by writing out empty user messages files (which registers them), then waking them
+    new_user_id = next_user_id()
     while user_count < num_users:
-        print(f"Creating new user with ID {next_user_id}")
-        new_user_messages_filepath = pathed(f'{next_user_id}.messages')
-        with open(new_user_messages_filepath, 'w+')  as f:
-            json.dump([],f)
-        touch(new_user_messages_filepath)
-        next_user_id += 1
+        print(f"Creating new user with ID {new_user_id}")
+        create_message_log(new_user_id)
+        wake_user(args, new_user_id)
+        new_user_id += 1
         user_count += 1
         randn_noise = random.gauss(0,0.5)
-        time.sleep(user_spinup_delay_seconds + randn_noise)
+        time.sleep(max(0.0, user_spinup_delay_seconds + randn_noise))
 
 if __name__ == "__main__":
     args = parse_args()
@@ -2,6 +2,9 @@ from argparse import ArgumentParser
 import json, os, shutil
 import requests
 from simulator import *
+from service_graph import Service, start_services
+from supervisor import Supervisor
+from sim_benchmark import write_benchmark_report
 from wrangler_common import *
 from commands import COMMANDS
 from dev.local_dev_common import *
@@ -11,12 +14,20 @@ def run_cloudflare_worker(args):
     env_vars : Dict[str,str] = convert_env_vars_to_dict(args.env_vars)   
     if args.sim:
         env_vars["TELEGRAM_BOT_SERVER_URL"] = f"http://localhost:{FAKE_TELEGRAM_SERVER_PORT}"
+        if args.fake_solana_rpc:
+            # The fake RPC serves any path, so the API key the worker appends is harmless
+            env_vars["QUICKNODE_RPC_URL"] = LOCAL_FAKE_SOLANA_RPC_ADDRESS
+            env_vars["RPC_ENDPOINT_URL"] = LOCAL_FAKE_SOLANA_RPC_ADDRESS
+        if args.fake_jupiter:
+            env_vars["JUPITER_PRICE_API_URL"] = f"{LOCAL_FAKE_JUPITER_ADDRESS}/v6/price"
+            env_vars["JUPITER_QUOTE_API_URL"] = f"{LOCAL_FAKE_JUPITER_ADDRESS}/v6/quote"
+            env_vars["JUPITER_SWAP_API_URL"] = f"{LOCAL_FAKE_JUPITER_ADDRESS}/v6/swap"
+            env_vars["JUPITER_TOKEN_LIST_API_URL"] = f"{LOCAL_FAKE_JUPITER_ADDRESS}/all"
     elif 'TELEGRAM_BOT_SERVER_URL' not in env_vars:
         env_vars['TELEGRAM_BOT_SERVER_URL'] = LOCAL_TELEGRAM_BOT_API_SERVER_ADDRESS 
     ENV_VARS = " ".join([ f'{var}:"{value}"' for (var,value) in env_vars.items() ])
     command = f'npx wrangler dev --env {ENV} --port {LOCAL_CLOUDFLARE_WORKER_PORT} --test-scheduled --ip 127.0.0.1 --var {ENV_VARS}'
     child_proc = execute_shell_command(command)
-    poll_until_port_is_occupied(LOCAL_CLOUDFLARE_WORKER_PORT)
     return child_proc
 
 def convert_env_vars_to_dict(env_vars):
@@ -28,60 +39,98 @@ def convert_env_vars_to_dict(env_vars):
         env_vars_dict[tokens[0]] = tokens[1]
     return env_vars_dict
 
-def start_CRON_poller():
-    command = START_CRON_POLLER_COMMAND
+def start_CRON_scheduler(env : str):
+    command = START_CRON_SCHEDULER_COMMAND.format(env = env)
     child_proc = execute_shell_command(command)
     return child_proc
 
-def start_token_list_rebuild_CRON_poller(token_list_rebuild_frequency : int):
-    command = START_TOKEN_LIST_REBUILD_CRON_POLLER_COMMAND.format(token_list_rebuild_frequency = token_list_rebuild_frequency)
+def start_accelerated_CRON(env : str, speed : str, duration : str):
+    command = START_ACCELERATED_CRON_COMMAND.format(env = env, speed = speed, duration = duration)
     child_proc = execute_shell_command(command)
     return child_proc
 
 def parse_args():
     parser = ArgumentParser()
-    parser.add_argument("--token_list_rebuild_frequency", required = False, default = 60*30)
     parser.add_argument("--start_local_telegram_bot", type = parse_bool, required = False, default = True)
     parser.add_argument("--env_vars", nargs="*", type = str, default=[])
     parser.add_argument("--sim", action="store_true")
+    # Record webhook / bot API latencies during a --sim run, and write a report on shutdown
+    parser.add_argument("--benchmark_report", type = str, required = False, default = None)
+    # Record the simulated users' webhooks during a --sim run, for webhook_replay.py
+    parser.add_argument("--record_webhooks", type = str, required = False, default = None)
+    # Point the worker (and sim wallet funding) at fake_solana_rpc.py during a --sim run, rather than mainnet
+    parser.add_argument("--fake_solana_rpc", type = parse_bool, required = False, default = True)
+    # Point the worker at fake_jupiter.py during a --sim run.  Its swaps only land on the fake RPC.
+    parser.add_argument("--fake_jupiter", type = parse_bool, required = False, default = True)
+    # Run the crons on a virtual clock instead of on their real schedules: 'max' (back to back) or a speedup like 60.  See dev/accelerated_cron.py
+    parser.add_argument("--cron_speed", type = str, required = False, default = None)
+    parser.add_argument("--cron_duration", type = str, required = False, default = "1d")
+    # Restart services that crash or stop answering health checks, and sample their CPU / memory / open files.  See supervisor.py
+    parser.add_argument("--supervise", type = parse_bool, required = False, default = True)
+    parser.add_argument("--supervise_interval", type = float, required = False, default = 2.0)
+    parser.add_argument("--unhealthy_after", type = int, required = False, default = 3)
+    parser.add_argument("--max_restarts", type = int, required = False, default = 5)
+    parser.add_argument("--telemetry_out", type = str, required = False, default = None)
     args = parser.parse_args()
     return args
 
-def do_it(args):
-
-    child_procs = []
+def make_services(args) -> List[Service]:
 
-    try:
+    services = []
+    # What the worker calls out to: the crons and simulated users need these up as well as the worker
+    backends = []
 
-        if args.sim:
-            ensure_simdir_exists()
-            child_procs.append(start_fake_telegram_server())
-            child_procs.append(start_user_messages_file_watcher())
-            child_procs.append(start_simulated_user_viewer())
+    if args.sim:
+        if args.fake_solana_rpc:
+            services.append(Service("fake solana rpc", start_fake_solana_rpc_server, port = FAKE_SOLANA_RPC_PORT, ready_path = "/sim/stats"))
+            backends.append("fake solana rpc")
+        if args.fake_jupiter:
+            services.append(Service("fake jupiter", lambda: start_fake_jupiter_server(virtual_clock = args.cron_speed is not None), port = FAKE_JUPITER_PORT, ready_path = "/all"))
+            backends.append("fake jupiter")
+        services.append(Service("fake telegram", lambda: start_fake_telegram_server(benchmark = args.benchmark_report is not None, record_webhooks = args.record_webhooks, fake_solana_rpc = args.fake_solana_rpc), port = FAKE_TELEGRAM_SERVER_PORT, ready_path = "/sim/telegram/stats"))
+        backends.append("fake telegram")
+    else:
+        api_id   = get_secret("SECRET__TELEGRAM_API_ID", "dev")
+        api_hash = get_secret("SECRET__TELEGRAM_API_HASH", "dev")
+        bot_token = get_secret("SECRET__TELEGRAM_BOT_TOKEN", "dev")
+        bot_secret_token = get_secret("SECRET__TELEGRAM_BOT_WEBHOOK_SECRET_TOKEN", "dev")
+        services.append(Service("telegram-bot-api", lambda: fork_shell_telegram_bot_api_local_server(api_id = api_id, api_hash = api_hash), port = LOCAL_TELEGRAM_BOT_API_SERVER_PORT, ready_path = "/"))
+        # Points the bot's webhook at the worker
+        services.append(Service("bot setup", lambda: migrate_and_configure_bot_for_local_server(bot_token, bot_secret_token), depends_on = ["telegram-bot-api", "cloudflare worker"]))
+
+    services.append(Service("simulated user viewer", start_simulated_user_viewer, port = SIMULATED_USER_VIEWER_PORT, ready_path = "/"))
+
+    # Any HTTP answer means wrangler has built and is serving the worker (without the webhook secret, it's a 403)
+    services.append(Service("cloudflare worker", lambda: run_cloudflare_worker(args), port = LOCAL_CLOUDFLARE_WORKER_PORT, ready_path = "/"))
+
+    if args.cron_speed is not None:
+        services.append(Service("accelerated cron", lambda: start_accelerated_CRON("sim" if args.sim else "dev", args.cron_speed, args.cron_duration), depends_on = ["cloudflare worker", *backends], restart = False))
+    else:
+        services.append(Service("cron scheduler", lambda: start_CRON_scheduler("sim" if args.sim else "dev"), depends_on = ["cloudflare worker", *backends]))
 
-        print("Starting local cloudflare worker")
-        child_procs.append(run_cloudflare_worker(args))
+    if args.sim:
+        services.append(Service("simulated users", spin_up_simulation_users, depends_on = ["cloudflare worker", *backends], restart = False))
 
-        if not args.sim:
+    return services
 
-            print("Starting local telegram-bot-api server")
-            api_id   = get_secret("SECRET__TELEGRAM_API_ID", "dev")
-            api_hash = get_secret("SECRET__TELEGRAM_API_HASH", "dev")
-            child_procs.append(fork_shell_telegram_bot_api_local_server(api_id = api_id, api_hash = api_hash))
-            child_procs.append(start_simulated_user_viewer())
+def do_it(args):
 
-            print("Setting up bot locally")
-            bot_token = get_secret("SECRET__TELEGRAM_BOT_TOKEN", "dev")
-            bot_secret_token = get_secret("SECRET__TELEGRAM_BOT_WEBHOOK_SECRET_TOKEN", "dev")
+    child_procs = []
+    supervisor = None
 
-            migrate_and_configure_bot_for_local_server(bot_token, bot_secret_token)
+    try:
 
-        child_procs.append(start_CRON_poller())
+        if args.sim:
+            ensure_simdir_exists()
+            remove_benchmark_samples()
 
-        child_procs.append(start_token_list_rebuild_CRON_poller(args.token_list_rebuild_frequency))
+        # Everything is launched as soon as what it depends on is ready (see service_graph.py)
+        services = make_services(args)
+        start_services(services, child_procs)
 
-        if args.sim:
-            child_procs.append(spin_up_simulation_users())
+        if args.supervise:
+            supervisor = Supervisor(services, child_procs, interval = args.supervise_interval, unhealthy_after = args.unhealthy_after, max_restarts = args.max_restarts, telemetry_out = args.telemetry_out)
+            supervisor.start()
 
         print("You may wish to start the wrangler debugger now.")
         print("Cloudflare worker and local bot api server ARE RUNNING!")
@@ -92,8 +141,11 @@ def do_it(args):
     except Exception as e:
         print(e)
     finally:
+        if supervisor is not None:
+            supervisor.stop()
         kill_procs(child_procs)
-        remove_lingering_file_locks()
+        if args.sim and args.benchmark_report is not None:
+            write_benchmark_report(args.benchmark_report)
 
 def fork_shell_telegram_bot_api_local_server(api_id, api_hash):
     shutil.rmtree(TELEGRAM_LOCAL_SERVER_WORKING_DIR, ignore_errors=True)
@@ -101,7 +153,6 @@ def fork_shell_telegram_bot_api_local_server(api_id, api_hash):
     command = START_TELEGRAM_LOCAL_SERVER_COMMAND.format(api_id = api_id, api_hash = api_hash, working_dir=TELEGRAM_LOCAL_SERVER_WORKING_DIR)
     print(command)
     child_proc = execute_shell_command(command) # no shlex split here on purpose.  makes it parse the --local param weirdly.
-    poll_until_port_is_occupied(LOCAL_TELEGRAM_BOT_API_SERVER_PORT)
     print("Local telegram-bot-api server process forked.")
     return child_proc
                    
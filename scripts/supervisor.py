@@ -0,0 +1,196 @@
+import csv, time, threading
+import psutil # pip install psutil
+from typing import Any, Dict, List, Union
+from service_graph import Service
+from dev.local_dev_common import is_ready
+
+"""
+    Watches the dev box's services once they're up (see service_graph.py), every --supervise_interval seconds:
+        crashed     a service whose process exited is restarted (unless it was started with restart = False, like the one-off scripts)
+        unhealthy   a service with a port that fails --unhealthy_after health checks in a row is killed and restarted.
+                    A restarted service has its startup timeout to become ready before it's checked again.
+    A service that has been restarted --max_restarts times is left alone.
+
+    Every check also samples each service's process tree (the shell, wrangler's node and workerd, telegram-bot-api, the Flask servers):
+    CPU %, RSS and open file descriptors, summed by process name.  So during a long simulation you can tell whether
+    it's the worker or our own tooling that is slow or growing.
+    --telemetry_out writes the samples to a CSV as they're taken, and a summary per process is printed on shutdown.
+"""
+
+TELEMETRY_FIELDNAMES = ["time", "service", "process", "pids", "cpu_percent", "rss_mb", "open_files", "restarts"]
+
+class Supervisor:
+
+    def __init__(self,
+                 services : List[Service],
+                 child_procs : List[Any],
+                 interval : float = 2.0,
+                 unhealthy_after : int = 3,
+                 max_restarts : int = 5,
+                 telemetry_out : Union[str,None] = None):
+        # Services without a process (one-off setup steps) have nothing to watch
+        self.services = [ service for service in services if service.proc is not None ]
+        self.child_procs = child_procs
+        self.interval = interval
+        self.unhealthy_after = unhealthy_after
+        self.max_restarts = max_restarts
+        self.telemetry_out = telemetry_out
+        self.restarts = { service.name: 0 for service in self.services }
+        self.failed_checks = { service.name: 0 for service in self.services }
+        # Whether the service has been ready since it was (re)launched, and when that was
+        self.up = { service.name: True for service in self.services }
+        self.launched_at = { service.name: time.monotonic() for service in self.services }
+        self.given_up = set()
+        # pid -> psutil.Process.  cpu_percent is measured since the previous call on the same object, so they're kept between samples.
+        self.processes : Dict[int,psutil.Process] = dict()
+        # service name -> its process tree as of the last sample, so a restart can clean up processes the shell left behind
+        self.trees : Dict[str,List[psutil.Process]] = dict()
+        self.samples : List[Dict[str,Any]] = []
+        self.stopping = threading.Event()
+        self.thread = None
+        if telemetry_out is not None:
+            with open(telemetry_out, "w", newline = "") as f:
+                csv.DictWriter(f, fieldnames = TELEMETRY_FIELDNAMES).writeheader()
+
+    def start(self):
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        # Before the processes are killed, so nothing gets restarted on the way down
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        print_telemetry_summary(self.samples, self.restarts)
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            for service in self.services:
+                if service.name in self.given_up:
+                    continue
+                try:
+                    self.check(service)
+                except Exception as e:
+                    print(f"Supervisor: error checking {service.name}: {e}")
+            self.sample()
+
+    def check(self, service : Service):
+        name = service.name
+        if service.proc.poll() is not None:
+            if service.restart:
+                self.restart_service(service, f"exited with code {service.proc.returncode}")
+            else:
+                print(f"Supervisor: {name} exited with code {service.proc.returncode}")
+                self.given_up.add(name)
+            return
+        if service.port is None:
+            return
+        if is_ready(service.port, service.ready_path):
+            self.failed_checks[name] = 0
+            self.up[name] = True
+        elif not self.up[name]:
+            # Still starting up after a restart
+            if time.monotonic() - self.launched_at[name] > service.timeout:
+                self.restart_service(service, f"wasn't ready {service.timeout:.0f}s after restarting")
+        else:
+            self.failed_checks[name] += 1
+            if self.failed_checks[name] >= self.unhealthy_after:
+                self.restart_service(service, f"failed {self.failed_checks[name]} health checks in a row")
+
+    def restart_service(self, service : Service, reason : str):
+        name = service.name
+        if self.restarts[name] >= self.max_restarts:
+            print(f"Supervisor: {name} {reason}, and has already been restarted {self.restarts[name]} times.  Leaving it be.")
+            self.given_up.add(name)
+            return
+        print(f"Supervisor: restarting {name}: {reason}")
+        self.kill_tree(service)
+        old_proc = service.proc
+        service.proc = service.start()
+        self.child_procs[self.child_procs.index(old_proc)] = service.proc
+        self.restarts[name] += 1
+        self.failed_checks[name] = 0
+        self.up[name] = False
+        self.launched_at[name] = time.monotonic()
+
+    def kill_tree(self, service : Service):
+        processes = self.trees.get(service.name, []) + self.process_tree(service)
+        for process in processes:
+            try:
+                process.terminate()
+            except psutil.NoSuchProcess:
+                pass
+        _, alive = psutil.wait_procs(processes, timeout = 5.0)
+        for process in alive:
+            try:
+                process.kill()
+            except psutil.NoSuchProcess:
+                pass
+        service.proc.wait()
+
+    def process_tree(self, service : Service) -> List[psutil.Process]:
+        try:
+            root = self.cached_process(psutil.Process(service.proc.pid))
+            return [ root ] + [ self.cached_process(child) for child in root.children(recursive = True) ]
+        except psutil.NoSuchProcess:
+            return []
+
+    def cached_process(self, process : psutil.Process) -> psutil.Process:
+        # psutil.Process equality includes the creation time, so a reused pid gets a fresh object
+        cached = self.processes.get(process.pid)
+        if cached is None or cached != process:
+            self.processes[process.pid] = cached = process
+        return cached
+
+    def sample(self):
+        now = time.time()
+        rows = []
+        for service in self.services:
+            tree = self.process_tree(service)
+            self.trees[service.name] = tree
+            # process name -> totals over the processes with that name
+            totals : Dict[str,Dict[str,float]] = dict()
+            for process in tree:
+                try:
+                    with process.oneshot():
+                        process_name = process.name()
+                        cpu_percent = process.cpu_percent(interval = None)
+                        rss = process.memory_info().rss
+                        open_files = process.num_fds() if hasattr(process, "num_fds") else process.num_handles()
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+                total = totals.setdefault(process_name, { "pids": 0, "cpu_percent": 0.0, "rss": 0, "open_files": 0 })
+                total["pids"] += 1
+                total["cpu_percent"] += cpu_percent
+                total["rss"] += rss
+                total["open_files"] += open_files
+            for process_name, total in sorted(totals.items()):
+                rows.append({
+                    "time": round(now, 3),
+                    "service": service.name,
+                    "process": process_name,
+                    "pids": total["pids"],
+                    "cpu_percent": round(total["cpu_percent"], 1),
+                    "rss_mb": round(total["rss"] / 2**20, 1),
+                    "open_files": total["open_files"],
+                    "restarts": self.restarts[service.name]
+                })
+        live_pids = { process.pid for tree in self.trees.values() for process in tree }
+        self.processes = { pid: process for (pid, process) in self.processes.items() if pid in live_pids }
+        self.samples.extend(rows)
+        if self.telemetry_out is not None:
+            with open(self.telemetry_out, "a", newline = "") as f:
+                csv.DictWriter(f, fieldnames = TELEMETRY_FIELDNAMES).writerows(rows)
+
+def print_telemetry_summary(samples : List[Dict[str,Any]], restarts : Dict[str,int]):
+    print(f"=== Service telemetry ({len({ sample['time'] for sample in samples })} samples) ===")
+    for service in sorted({ sample["service"] for sample in samples }):
+        print(f"  {service} (restarts={restarts.get(service, 0)})")
+        for process_name in sorted({ sample["process"] for sample in samples if sample["service"] == service }):
+            process_samples = [ sample for sample in samples if sample["service"] == service and sample["process"] == process_name ]
+            mean_cpu = sum(sample["cpu_percent"] for sample in process_samples) / len(process_samples)
+            max_cpu = max(sample["cpu_percent"] for sample in process_samples)
+            first_rss, last_rss = process_samples[0]["rss_mb"], process_samples[-1]["rss_mb"]
+            max_rss = max(sample["rss_mb"] for sample in process_samples)
+            max_open_files = max(sample["open_files"] for sample in process_samples)
+            print(f"    {process_name:<20} cpu mean={mean_cpu:.1f}% max={max_cpu:.1f}%  rss {first_rss:.1f}->{last_rss:.1f}MB (max {max_rss:.1f}MB)  open files max={max_open_files}")
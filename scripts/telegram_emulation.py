@@ -0,0 +1,129 @@
+import math, time, random, threading
+from typing import Any, Dict, Tuple, Union
+
+"""
+    Makes fake_telegram.py push back the way the real bot API does under load.
+
+    Rate limits are token buckets, refilled continuously:
+        global     --global_rate_limit messages per second across all chats (Telegram's is about 30)
+        per chat   --chat_rate_limit messages per second per chat (about 1), with bursts of up to --chat_burst
+    A call over either limit is rejected with a 429 and the parameters.retry_after (whole seconds) Telegram would send,
+    and doesn't use up any tokens.
+
+    Independently of the limits, --too_many_requests_rate of calls get a 429 anyway, and --server_error_rate get a 500/502.
+    Every call is first delayed by a lognormal latency with median --latency_ms and shape --latency_sigma (0 is a fixed delay).
+
+    All of these are off (0) by default.
+"""
+
+SERVER_ERRORS = [(500, "Internal Server Error"), (502, "Bad Gateway")]
+
+class TokenBucket:
+
+    def __init__(self, rate : float, burst : float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now : float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until_available(self, now : float) -> float:
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class TelegramEmulation:
+
+    def __init__(self,
+                 global_rate_limit : float = 0.0,
+                 chat_rate_limit : float = 0.0,
+                 chat_burst : float = 1.0,
+                 too_many_requests_rate : float = 0.0,
+                 server_error_rate : float = 0.0,
+                 latency_ms : float = 0.0,
+                 latency_sigma : float = 0.0,
+                 seed : Union[int,None] = None):
+        self.global_bucket = TokenBucket(global_rate_limit, max(1.0, global_rate_limit)) if global_rate_limit > 0 else None
+        self.chat_rate_limit = chat_rate_limit
+        self.chat_burst = chat_burst
+        self.chat_buckets : Dict[Any,TokenBucket] = {}
+        self.too_many_requests_rate = too_many_requests_rate
+        self.server_error_rate = server_error_rate
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        # method -> { "calls", "rate_limited", "injected_429", "server_error", "latency_ms" }
+        self.stats : Dict[str,Dict[str,float]] = {}
+
+    def is_enabled(self) -> bool:
+        return any([self.global_bucket is not None, self.chat_rate_limit > 0, self.too_many_requests_rate > 0, self.server_error_rate > 0, self.latency_ms > 0])
+
+    def sample_latency_seconds(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        with self.lock:
+            return self.latency_ms * math.exp(self.rng.gauss(0, self.latency_sigma)) / 1000
+
+    def handle(self, method : str, chat_id : Any) -> Union[Tuple[int,Dict[str,Any]],None]:
+        # Waits out the call's latency, then returns (HTTP status, body) if it should fail, or None to let it through
+        latency = self.sample_latency_seconds()
+        if latency > 0:
+            time.sleep(latency)
+        with self.lock:
+            stats = self.stats.setdefault(method, { "calls": 0, "rate_limited": 0, "injected_429": 0, "server_error": 0, "latency_ms": 0.0 })
+            stats["calls"] += 1
+            stats["latency_ms"] += latency * 1000
+            roll = self.rng.random()
+            if roll < self.server_error_rate:
+                stats["server_error"] += 1
+                return make_server_error_response(*self.rng.choice(SERVER_ERRORS))
+            if roll < self.server_error_rate + self.too_many_requests_rate:
+                stats["injected_429"] += 1
+                return make_too_many_requests_response(self.rng.randint(1, 5))
+            retry_after = self.take_tokens(chat_id)
+            if retry_after is not None:
+                stats["rate_limited"] += 1
+                return make_too_many_requests_response(retry_after)
+        return None
+
+    def take_tokens(self, chat_id : Any) -> Union[int,None]:
+        # Takes a token from each bucket that applies if all of them have one, otherwise returns the retry_after
+        now = time.monotonic()
+        buckets = []
+        if self.global_bucket is not None:
+            buckets.append(self.global_bucket)
+        if self.chat_rate_limit > 0 and chat_id is not None:
+            if chat_id not in self.chat_buckets:
+                self.chat_buckets[chat_id] = TokenBucket(self.chat_rate_limit, self.chat_burst)
+            buckets.append(self.chat_buckets[chat_id])
+        wait = max([ bucket.seconds_until_available(now) for bucket in buckets ], default = 0.0)
+        if wait > 0:
+            return max(1, math.ceil(wait))
+        for bucket in buckets:
+            bucket.take()
+        return None
+
+    def get_stats(self) -> Dict[str,Dict[str,float]]:
+        with self.lock:
+            return { method: dict(stats) for (method, stats) in self.stats.items() }
+
+def make_too_many_requests_response(retry_after : int) -> Tuple[int,Dict[str,Any]]:
+    return 429, {
+        "ok": False,
+        "error_code": 429,
+        "description": f"Too Many Requests: retry after {retry_after}",
+        "parameters": { "retry_after": retry_after }
+    }
+
+def make_server_error_response(status : int, description : str) -> Tuple[int,Dict[str,Any]]:
+    return status, {
+        "ok": False,
+        "error_code": status,
+        "description": description
+    }
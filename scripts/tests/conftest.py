@@ -0,0 +1,12 @@
+import os, sys
+
+"""
+    The scripts import each other as top-level modules (scripts/dev ones flat), as they do when run from the repo root.
+    Run the tests with: python -m pytest scripts/tests
+"""
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in [ os.path.join(SCRIPTS_DIR, "dev"), SCRIPTS_DIR ]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
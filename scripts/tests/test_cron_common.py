@@ -0,0 +1,59 @@
+import datetime
+import pytest
+from cron_common import CronExpression, parse_cron_field
+
+def utc(year, month, day, hour = 0, minute = 0, second = 0):
+    return datetime.datetime(year, month, day, hour, minute, second, tzinfo = datetime.timezone.utc)
+
+def test_parse_cron_field():
+    assert parse_cron_field("*", 0, 5) == { 0, 1, 2, 3, 4, 5 }
+    assert parse_cron_field("7", 0, 59) == { 7 }
+    assert parse_cron_field("1-3", 0, 59) == { 1, 2, 3 }
+    assert parse_cron_field("*/15", 0, 59) == { 0, 15, 30, 45 }
+    assert parse_cron_field("10-20/5", 0, 59) == { 10, 15, 20 }
+    # n/step runs to the end of the range
+    assert parse_cron_field("50/4", 0, 59) == { 50, 54, 58 }
+    assert parse_cron_field("1,5,10-11", 0, 59) == { 1, 5, 10, 11 }
+
+@pytest.mark.parametrize("field", ["60", "0-60", "*/0x", "", "5-1"])
+def test_parse_cron_field_rejects_bad_fields(field):
+    with pytest.raises(ValueError):
+        parse_cron_field(field, 0, 59)
+
+def test_cron_expression_needs_5_fields():
+    with pytest.raises(ValueError):
+        CronExpression("* * * *")
+
+def test_next_after_every_minute_is_strictly_after():
+    cron = CronExpression("* * * * *")
+    assert cron.next_after(utc(2024, 1, 1, 12, 0)) == utc(2024, 1, 1, 12, 1)
+    assert cron.next_after(utc(2024, 1, 1, 12, 0, 59)) == utc(2024, 1, 1, 12, 1)
+
+def test_next_after_steps_roll_over_the_hour_and_day():
+    cron = CronExpression("*/15 * * * *")
+    assert cron.next_after(utc(2024, 1, 1, 12, 0)) == utc(2024, 1, 1, 12, 15)
+    assert cron.next_after(utc(2024, 1, 1, 23, 50)) == utc(2024, 1, 2, 0, 0)
+
+def test_next_after_daily():
+    cron = CronExpression("30 2 * * *")
+    assert cron.next_after(utc(2024, 1, 1, 2, 29)) == utc(2024, 1, 1, 2, 30)
+    assert cron.next_after(utc(2024, 1, 1, 2, 30)) == utc(2024, 1, 2, 2, 30)
+
+def test_next_after_weekday():
+    # 2024-01-01 is a Monday.  0 and 7 are both Sunday.
+    assert CronExpression("0 9 * * 1").next_after(utc(2024, 1, 1, 9, 0)) == utc(2024, 1, 8, 9, 0)
+    assert CronExpression("0 0 * * 0").next_after(utc(2024, 1, 1)) == utc(2024, 1, 7)
+    assert CronExpression("0 0 * * 7").next_after(utc(2024, 1, 1)) == utc(2024, 1, 7)
+
+def test_next_after_day_of_month_or_weekday():
+    # With both day fields restricted, either matching is enough
+    cron = CronExpression("0 0 15 * 5")
+    assert cron.next_after(utc(2024, 1, 1)) == utc(2024, 1, 5)
+    assert cron.next_after(utc(2024, 1, 13)) == utc(2024, 1, 15)
+
+def test_next_after_leap_day():
+    assert CronExpression("0 0 29 2 *").next_after(utc(2024, 3, 1)) == utc(2028, 2, 29)
+
+def test_next_after_never_fires():
+    with pytest.raises(ValueError):
+        CronExpression("0 0 31 2 *").next_after(utc(2024, 1, 1))
@@ -0,0 +1,115 @@
+import os
+import pytest
+import user_registry
+from message_log import (apply_records, encode_records, make_send_record, make_edit_record, make_delete_record, parse_message_log,
+                         append_message_log, write_message_log_snapshot, message_log_filepath, create_message_log, should_compact,
+                         MessageLogChanges, COMPACTION_MIN_RECORDS)
+
+USER_ID = 42
+
+@pytest.fixture(autouse = True)
+def in_tmp_dir(tmp_path, monkeypatch):
+    # User files live under ./.simulator, and each test starts without any user directories
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(user_registry, "_ensured_user_ids", set())
+
+def m(message_id, text):
+    return { "message_id": message_id, "text": text }
+
+def texts(messages):
+    return { message["message_id"]: message["text"] for message in messages }
+
+def test_apply_records_replays_in_order():
+    messages = dict()
+    lines = encode_records([ make_send_record(m(1, "a")), make_send_record(m(2, "b")), make_edit_record(m(1, "A")), make_delete_record(2), make_send_record(m(3, "c")) ]).splitlines()
+    touched, records = apply_records(messages, lines + [""])
+    assert touched == [1, 2, 1, 2, 3]
+    assert records == 5
+    assert texts(messages.values()) == { 1: "A", 3: "c" }
+
+def test_parse_message_log_reads_old_json_array_format():
+    messages, records = parse_message_log('[{"message_id": 1, "text": "a"}]')
+    assert texts(messages) == { 1: "a" }
+    assert records is None
+
+def test_parse_empty_log_is_empty_chat():
+    assert parse_message_log("") == ([], 0)
+
+def test_should_compact():
+    assert not should_compact(COMPACTION_MIN_RECORDS - 1, 0)
+    assert should_compact(COMPACTION_MIN_RECORDS, 0)
+    assert should_compact(1000, 500)
+    assert not should_compact(1000, 501)
+
+def test_get_changes_reads_only_appended_records():
+    changes = MessageLogChanges()
+    create_message_log(USER_ID)
+    version, changed, deleted, reset = changes.get_changes(USER_ID, -1)
+    assert (version, changed, deleted, reset) == (0, [], [], True)
+
+    append_message_log(USER_ID, [ make_send_record(m(1, "a")), make_send_record(m(2, "b")) ])
+    version, changed, deleted, reset = changes.get_changes(USER_ID, version)
+    assert not reset
+    assert texts(changed) == { 1: "a", 2: "b" }
+    assert deleted == []
+
+    append_message_log(USER_ID, [ make_edit_record(m(1, "A")), make_delete_record(2), make_send_record(m(3, "c")) ])
+    version, changed, deleted, reset = changes.get_changes(USER_ID, version)
+    assert not reset
+    assert texts(changed) == { 1: "A", 3: "c" }
+    assert deleted == [2]
+
+    assert changes.get_changes(USER_ID, version) == (version, [], [], False)
+    assert version == os.path.getsize(message_log_filepath(USER_ID))
+
+def test_get_changes_ignores_partial_last_line():
+    changes = MessageLogChanges()
+    append_message_log(USER_ID, [ make_send_record(m(1, "a")) ])
+    version, _, _, _ = changes.get_changes(USER_ID, -1)
+    with open(message_log_filepath(USER_ID), "a") as f:
+        f.write('{"op":"send","message":{"message_id":2,')
+    assert changes.get_changes(USER_ID, version) == (version, [], [], False)
+    with open(message_log_filepath(USER_ID), "a") as f:
+        f.write('"text":"b"}}\n')
+    version, changed, _, reset = changes.get_changes(USER_ID, version)
+    assert not reset
+    assert texts(changed) == { 2: "b" }
+
+def test_get_changes_resets_after_compaction():
+    changes = MessageLogChanges()
+    append_message_log(USER_ID, [ make_send_record(m(1, "a")), make_send_record(m(2, "b")), make_delete_record(1) ])
+    version, _, _, _ = changes.get_changes(USER_ID, -1)
+    inode = os.stat(message_log_filepath(USER_ID)).st_ino
+    # A new file swapped in, shorter than the offset read up to
+    write_message_log_snapshot(USER_ID, [ m(2, "b"), m(3, "c") ])
+    assert os.stat(message_log_filepath(USER_ID)).st_ino != inode
+    version, changed, deleted, reset = changes.get_changes(USER_ID, version)
+    assert reset
+    assert texts(changed) == { 2: "b", 3: "c" }
+    assert deleted == []
+    assert version == os.path.getsize(message_log_filepath(USER_ID))
+
+def test_get_changes_resets_when_file_rewritten_in_place():
+    # Same inode and at least as long, but not the records that were read (as when an inode is reused)
+    changes = MessageLogChanges()
+    append_message_log(USER_ID, [ make_send_record(m(1, "a")) ])
+    version, _, _, _ = changes.get_changes(USER_ID, -1)
+    with open(message_log_filepath(USER_ID), "w") as f:
+        f.write(encode_records([ make_send_record(m(7, "x")), make_send_record(m(8, "y")) ]))
+    version, changed, _, reset = changes.get_changes(USER_ID, version)
+    assert reset
+    assert texts(changed) == { 7: "x", 8: "y" }
+
+def test_get_changes_resets_for_unknown_offset():
+    changes = MessageLogChanges()
+    append_message_log(USER_ID, [ make_send_record(m(1, "a")), make_send_record(m(2, "b")) ])
+    version, _, _, _ = changes.get_changes(USER_ID, -1)
+    # An offset this reader didn't hand out, e.g. from another process
+    version, changed, _, reset = changes.get_changes(USER_ID, version - 1)
+    assert reset
+    assert texts(changed) == { 1: "a", 2: "b" }
+
+def test_get_changes_on_missing_log():
+    changes = MessageLogChanges()
+    assert changes.get_changes(USER_ID, 0) == (0, [], [], False)
+    assert changes.get_changes(USER_ID, 10) == (0, [], [], True)
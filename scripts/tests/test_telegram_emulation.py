@@ -0,0 +1,55 @@
+import pytest
+import telegram_emulation
+from telegram_emulation import TelegramEmulation
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(telegram_emulation.time, "monotonic", clock)
+    return clock
+
+def test_no_limits_never_limits(clock):
+    emulation = TelegramEmulation()
+    assert all(emulation.take_tokens(1) is None for _ in range(100))
+
+def test_chat_limit_allows_burst_then_limits(clock):
+    emulation = TelegramEmulation(chat_rate_limit = 1.0, chat_burst = 3.0)
+    assert [ emulation.take_tokens(1) for _ in range(4) ] == [None, None, None, 1]
+    # Other chats have their own bucket
+    assert emulation.take_tokens(2) is None
+
+def test_chat_limit_refills_over_time(clock):
+    emulation = TelegramEmulation(chat_rate_limit = 0.25, chat_burst = 1.0)
+    assert emulation.take_tokens(1) is None
+    # retry_after is the wait for the next token, rounded up to whole seconds
+    assert emulation.take_tokens(1) == 4
+    clock.now += 3.5
+    assert emulation.take_tokens(1) == 1
+    clock.now += 0.5
+    assert emulation.take_tokens(1) is None
+
+def test_rejected_call_takes_no_tokens(clock):
+    emulation = TelegramEmulation(global_rate_limit = 2.0, chat_rate_limit = 1.0, chat_burst = 1.0)
+    assert emulation.take_tokens(1) is None
+    # Chat 1 is over its limit, so the global bucket keeps its token for chat 2
+    assert emulation.take_tokens(1) == 1
+    assert emulation.take_tokens(2) is None
+    assert emulation.take_tokens(3) == 1
+
+def test_global_limit_applies_across_chats(clock):
+    emulation = TelegramEmulation(global_rate_limit = 30.0)
+    assert all(emulation.take_tokens(chat_id) is None for chat_id in range(30))
+    assert emulation.take_tokens(30) == 1
+    clock.now += 0.05
+    assert emulation.take_tokens(31) is None
+
+def test_chat_limit_ignores_calls_without_chat(clock):
+    emulation = TelegramEmulation(chat_rate_limit = 1.0)
+    assert all(emulation.take_tokens(None) is None for _ in range(10))
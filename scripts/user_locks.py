@@ -0,0 +1,56 @@
+import os
+from contextlib import contextmanager
+from user_registry import user_pathed, ensure_user_dir
+
+"""
+    Per-user advisory file locks, shared by fake_telegram.py and the simulated users.
+
+    Each (user, resource) pair has a lock file, `<resource>.lock` in the user's directory (see user_registry.py).
+    Holding the lock means holding an OS advisory lock on that file (flock on Mac/Linux, msvcrt.locking on Windows),
+    so a waiter blocks in the kernel and wakes the moment the holder lets go - there's no polling.
+    The OS drops the lock if the holder dies, so a crashed process can't wedge a user.
+
+    Locks taken on separately opened files exclude each other across threads as well as processes.
+
+    Resources in use:
+        "messages": held briefly while the user's messages file is read or written
+        "metadata": held for the whole of a simulated user's action, serializing a user's actions
+"""
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _lock_file(f):
+        f.seek(0)
+        while True:
+            try:
+                # LK_LOCK retries for ~10 seconds before giving up; keep waiting
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1) # type: ignore
+                return
+            except OSError:
+                continue
+
+    def _unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1) # type: ignore
+else:
+    import fcntl
+
+    def _lock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def user_lock_filepath(user_id : int, resource : str):
+    return user_pathed(user_id, f"{resource}.lock")
+
+@contextmanager
+def user_lock(user_id : int, resource : str):
+    ensure_user_dir(user_id)
+    with open(user_lock_filepath(user_id, resource), "a+") as f:
+        _lock_file(f)
+        try:
+            yield
+        finally:
+            _unlock_file(f)
@@ -0,0 +1,209 @@
+import time, threading, atexit
+from collections import deque
+from typing import Any, Callable, Dict, List, Set, Tuple, Union
+from message_log import (read_message_log, append_message_log, write_message_log_snapshot, should_compact,
+    make_send_record, make_edit_record, make_delete_record)
+
+"""
+    Resident per-user message store for the fake telegram server.
+
+    Requests are answered from memory: sends, edits and deletes are O(1) dict operations.
+    Changed users are marked dirty and a background thread appends each dirty user's
+    send / edit / delete records to their `<user_id>.messages` log (write-behind, see message_log.py),
+    coalescing any number of changes that happened since the last flush into a single append.
+    When a log has grown well past the chat it describes, the flush compacts it instead.
+
+    Listeners are called (with the user_id) after every change to a user's messages.
+    Each change also bumps the user's version, which readers can long-poll on with wait_for_changes.
+    A short journal of which message each version changed lets get_changes return just the
+    messages sent, edited or deleted since a version, rather than the whole chat.
+"""
+
+DEFAULT_FLUSH_INTERVAL_SECONDS = 0.05
+
+# Versions remembered per user by get_changes. Readers further behind than this get the whole chat.
+CHANGE_JOURNAL_LENGTH = 1024
+
+class UserMessages:
+    def __init__(self, messages : List[Any], log_records : Union[int,None] = 0):
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.version = 0
+        # message_id -> message.  Message IDs are handed out in increasing order,
+        # so insertion order is message order.
+        self.messages : Dict[int,Any] = { message["message_id"]: message for message in messages }
+        self.max_message_id = max(self.messages, default = 0)
+        # (version, message_id changed by that version)
+        self.journal : deque = deque(maxlen = CHANGE_JOURNAL_LENGTH)
+        # Records not yet appended to the log, and how many the log has (None until an old format file is rewritten as a log)
+        self.pending_records : List[Dict[str,Any]] = []
+        self.log_records = log_records
+
+    def bump_version(self, message_id : int):
+        # caller holds self.lock
+        self.version += 1
+        self.journal.append((self.version, message_id))
+        self.changed.notify_all()
+
+class UserMessageStore:
+
+    def __init__(self, flush_interval : float = DEFAULT_FLUSH_INTERVAL_SECONDS):
+        self.flush_interval = flush_interval
+        self._users : Dict[int,UserMessages] = dict()
+        self._users_lock = threading.Lock()
+        self._dirty : Set[int] = set()
+        self._dirty_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._listeners : List[Callable[[int],None]] = []
+        self._flusher = threading.Thread(target = self._flush_loop, name = "message-store-flusher", daemon = True)
+
+    def start(self):
+        self._flusher.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wake.set()
+        if self._flusher.is_alive():
+            self._flusher.join()
+        self.flush()
+
+    def add_listener(self, listener : Callable[[int],None]):
+        self._listeners.append(listener)
+
+    def get_messages(self, user_id : int) -> List[Any]:
+        user = self._get_user(user_id)
+        with user.lock:
+            return list(user.messages.values())
+
+    def get_changes(self, user_id : int, since_version : int) -> Tuple[int,List[Any],List[int],bool]:
+        # (current version, messages sent or edited since since_version, IDs deleted since since_version, reset)
+        # When reset is True, the messages are the whole chat and anything known from before should be dropped
+        user = self._get_user(user_id)
+        with user.lock:
+            if since_version == user.version:
+                return user.version, [], [], False
+            oldest_journaled = user.journal[0][0] if user.journal else user.version + 1
+            if since_version < 0 or since_version > user.version or oldest_journaled > since_version + 1:
+                return user.version, list(user.messages.values()), [], True
+            changed_ids = set()
+            for (version, message_id) in reversed(user.journal):
+                if version <= since_version:
+                    break
+                changed_ids.add(message_id)
+            changed = [ user.messages[message_id] for message_id in sorted(changed_ids) if message_id in user.messages ]
+            deleted = [ message_id for message_id in changed_ids if message_id not in user.messages ]
+            return user.version, changed, deleted, False
+
+    def wait_for_changes(self, user_id : int, since_version : int, timeout : float) -> Tuple[int,List[Any],List[int],bool]:
+        # get_changes, once the user's messages have changed after since_version or timeout seconds have passed
+        user = self._get_user(user_id)
+        with user.lock:
+            user.changed.wait_for(lambda: user.version != since_version, timeout = timeout)
+        return self.get_changes(user_id, since_version)
+
+    def append_message(self, user_id : int, message : Any) -> int:
+        user = self._get_user(user_id)
+        with user.lock:
+            user.max_message_id += 1
+            message_id = user.max_message_id
+            # These are needed for weird and complicated reasons
+            message["message_id"] = message_id
+            message["chat"] = {
+                "id": user_id
+            }
+            user.messages[message_id] = message
+            user.pending_records.append(make_send_record(message))
+            user.bump_version(message_id)
+        self._mark_dirty(user_id)
+        return message_id
+
+    def edit_message(self, user_id : int, message : Any) -> bool:
+        user = self._get_user(user_id)
+        message_id = message.get("message_id")
+        with user.lock:
+            if message_id not in user.messages:
+                return False
+            # This is needed for weird and complicated reasons
+            message["chat"] = {
+                "id": user_id
+            }
+            # Replace rather than mutate, so a snapshot being serialized by the flusher is never torn
+            user.messages[message_id] = message
+            user.pending_records.append(make_edit_record(message))
+            user.bump_version(message_id)
+        self._mark_dirty(user_id)
+        return True
+
+    def delete_message(self, user_id : int, message_id : int) -> bool:
+        user = self._get_user(user_id)
+        with user.lock:
+            found = user.messages.pop(message_id, None) is not None
+            if found:
+                user.pending_records.append(make_delete_record(message_id))
+                user.bump_version(message_id)
+        if found:
+            self._mark_dirty(user_id)
+        return found
+
+    def flush(self):
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        for user_id in dirty:
+            self._flush_user(user_id)
+
+    def _get_user(self, user_id : int) -> UserMessages:
+        user = self._users.get(user_id)
+        if user is not None:
+            return user
+        # Lazily load whatever is on disk (pre-existing history, or an empty file from spin_up_users).
+        # Read outside the lock so one user's first call doesn't hold up everyone else's; if two calls race, the first one in wins.
+        loaded = UserMessages(*read_message_log(user_id))
+        with self._users_lock:
+            return self._users.setdefault(user_id, loaded)
+
+    def _mark_dirty(self, user_id : int):
+        with self._dirty_lock:
+            self._dirty.add(user_id)
+        self._wake.set()
+        for listener in self._listeners:
+            listener(user_id)
+
+    def _flush_loop(self):
+        while not self._stopped:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print("Failed to flush user messages: " + str(e))
+            # Coalesce bursts of changes into one write per interval
+            time.sleep(self.flush_interval)
+
+    def _flush_user(self, user_id : int):
+        user = self._users[user_id]
+        with user.lock:
+            records, user.pending_records = user.pending_records, []
+            compact = user.log_records is None or should_compact(user.log_records + len(records), len(user.messages))
+            if compact:
+                # Shallow copy is enough: messages are replaced, never mutated, once stored
+                snapshot = list(user.messages.values())
+                user.log_records = len(snapshot)
+            else:
+                user.log_records += len(records)
+        try:
+            if compact:
+                write_message_log_snapshot(user_id, snapshot)
+            elif records:
+                append_message_log(user_id, records)
+        except Exception:
+            # The log may now be missing records: rewrite it whole on the next flush
+            with user.lock:
+                user.log_records = None
+            with self._dirty_lock:
+                self._dirty.add(user_id)
+            raise
@@ -0,0 +1,94 @@
+import os, glob, shutil, sqlite3, threading, time
+from contextlib import closing
+from typing import List
+from dev.local_dev_common import pathed, sim_dir
+
+"""
+    Where simulated users' files live, and the registry of which users exist.
+
+    Each user has a directory, sharded by user ID so no one directory gets huge:
+        .simulator/users/<user_id % 256, as 2 hex digits>/<user_id>/
+            messages          the chat (see message_log.py)
+            metadata          the simulated user's state (see simulated_user.py)
+            <resource>.lock   per-user locks (see user_locks.py)
+
+    The registry, .simulator/users.sqlite, lists every user that has a directory, so listing and waking users
+    looks at just those users' files rather than scanning the simulator directory.
+    A user is registered the first time a process creates their directory (see ensure_user_dir).
+
+    Simulator directories from before the registry (all files flat in .simulator) are moved into place by migrate_flat_layout.
+"""
+
+USERS_DIRNAME = "users"
+REGISTRY_FILENAME = "users.sqlite"
+USER_SHARDS = 256
+
+# Users whose directories this process has already made sure of
+_ensured_user_ids = set()
+_ensured_lock = threading.Lock()
+
+def user_dir(user_id : int) -> str:
+    return pathed(os.path.join(USERS_DIRNAME, f"{user_id % USER_SHARDS:02x}", str(user_id)))
+
+def user_pathed(user_id : int, filename : str) -> str:
+    return os.path.join(user_dir(user_id), filename)
+
+def user_id_of_path(path : str) -> int:
+    # The user whose directory a file is in
+    return int(os.path.basename(os.path.dirname(path)))
+
+def ensure_user_dir(user_id : int):
+    # Creates and registers the user's directory, once per process
+    if user_id in _ensured_user_ids:
+        return
+    with _ensured_lock:
+        if user_id in _ensured_user_ids:
+            return
+        os.makedirs(user_dir(user_id), exist_ok = True)
+        register_user(user_id)
+        _ensured_user_ids.add(user_id)
+
+def registry_exists() -> bool:
+    return os.path.exists(pathed(REGISTRY_FILENAME))
+
+def connect_registry() -> sqlite3.Connection:
+    # Several processes register users at once, hence WAL and a generous busy timeout
+    connection = sqlite3.connect(pathed(REGISTRY_FILENAME), timeout = 30.0)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, created_at REAL NOT NULL, last_woken_at REAL)")
+    return connection
+
+def register_user(user_id : int):
+    with closing(connect_registry()) as connection, connection:
+        connection.execute("INSERT OR IGNORE INTO users (user_id, created_at) VALUES (?, ?)", (user_id, time.time()))
+
+def list_user_ids() -> List[int]:
+    # No registry (or no simulator directory at all) means no users, and nothing is created to say so
+    if not registry_exists():
+        return []
+    with closing(connect_registry()) as connection:
+        return [ user_id for (user_id,) in connection.execute("SELECT user_id FROM users ORDER BY user_id") ]
+
+def next_user_id() -> int:
+    if not registry_exists():
+        return 1
+    with closing(connect_registry()) as connection:
+        (max_user_id,) = connection.execute("SELECT MAX(user_id) FROM users").fetchone()
+    return (max_user_id or 0) + 1
+
+def mark_user_woken(user_id : int):
+    with closing(connect_registry()) as connection, connection:
+        connection.execute("UPDATE users SET last_woken_at = ? WHERE user_id = ?", (time.time(), user_id))
+
+def migrate_flat_layout():
+    # Moves <user_id>.messages / <user_id>.metadata from the top of the simulator directory into user directories.
+    # Scans the directory, but only does anything the first time a pre-registry simulator directory is used.
+    for flat_filepath in glob.glob(os.path.join(sim_dir(), "*.messages")) + glob.glob(os.path.join(sim_dir(), "*.metadata")):
+        user_id_text, extension = os.path.splitext(os.path.basename(flat_filepath))
+        if not user_id_text.isdigit():
+            continue
+        user_id = int(user_id_text)
+        ensure_user_dir(user_id)
+        shutil.move(flat_filepath, user_pathed(user_id, extension[1:]))
+    for lock_filepath in glob.glob(os.path.join(sim_dir(), "*.lock")):
+        os.remove(lock_filepath)
@@ -0,0 +1,119 @@
+import asyncio, json, time, threading, atexit
+from argparse import ArgumentParser, Namespace
+from typing import Any, Dict, List, Union
+from simulated_user import add_simulation_settings
+from load_generator import post_webhook, make_session
+from sim_benchmark import BenchmarkRecorder, percentile
+
+"""
+    Record-and-replay of the webhook traffic the simulated users send to the worker.
+
+    Recording: pass --record_webhooks <file> to fake_telegram.py (or start_dev_box.py --sim), simulated_user.py,
+    file_watcher.py or load_generator.py, and every webhook POST is appended to <file> as one JSON line:
+        { "timestamp", "user_id", "body" }
+
+    Replaying: this script POSTs a recorded file to LOCAL_CLOUDFLARE_WORKER_URL.
+        --speed 1      at the recorded pace
+        --speed 10     10x faster
+        --speed max    as fast as the worker answers
+
+    Each user's webhooks are sent in their recorded order, one at a time (the next waits for the worker's answer).
+    Different users' webhooks are sent concurrently. The report gives achieved throughput and how far behind
+    schedule requests went out, which is where a slower worker shows up at a fixed --speed.
+
+    The bodies refer to the users' chats and positions as they were when recorded, so replay against a worker
+    whose state starts out the same way (e.g. a freshly reset dev box) to compare runs.
+"""
+
+class WebhookTrafficRecorder:
+
+    def __init__(self, filepath : str):
+        self._lock = threading.Lock()
+        # Line-buffered appends, so processes recording into the same file don't interleave partial lines
+        self._file = open(filepath, "a", buffering = 1)
+        atexit.register(self.close)
+
+    def record(self, body : Any):
+        line = json.dumps({ "timestamp": time.time(), "user_id": webhook_user_id(body), "body": body }) + "\n"
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+def webhook_user_id(body : Any) -> Union[int,None]:
+    update = body.get("callback_query") or body.get("message") or dict()
+    return (update.get("from") or dict()).get("id")
+
+def read_traffic(filepath : str) -> List[Any]:
+    with open(filepath, "r") as f:
+        records = [ json.loads(line) for line in f if line.strip() ]
+    return sorted(records, key = lambda record: record["timestamp"])
+
+class ReplayStats:
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.lag_seconds : List[float] = []
+
+def parse_speed(speed : str) -> float:
+    # 0 means as fast as possible
+    return 0.0 if speed == "max" else float(speed)
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument("--file", type = str, required = True)
+    parser.add_argument("--speed", type = parse_speed, required = False, default = 1.0)
+    parser.add_argument("--max_connections", type = int, required = False, default = 256)
+    parser.add_argument("--benchmark", action = "store_true")
+    args = parser.parse_args()
+    return add_simulation_settings(args, recorder = BenchmarkRecorder("replay") if args.benchmark else None)
+
+async def replay_user(records : List[Any], args : Namespace, session, recorded_start : float, replay_start : float, stats : ReplayStats):
+    for record in records:
+        if args.speed > 0:
+            due = replay_start + (record["timestamp"] - recorded_start) / args.speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            stats.lag_seconds.append(max(0.0, -delay))
+        ok = await post_webhook(session, args, record["body"])
+        stats.sent += 1
+        stats.failed += 0 if ok else 1
+
+async def replay(records : List[Any], args : Namespace) -> ReplayStats:
+    stats = ReplayStats()
+    records_by_user : Dict[Any,List[Any]] = dict()
+    for record in records:
+        records_by_user.setdefault(record["user_id"], []).append(record)
+    recorded_start = records[0]["timestamp"]
+    async with make_session(args) as session:
+        replay_start = time.monotonic()
+        tasks = [ replay_user(user_records, args, session, recorded_start, replay_start, stats) for user_records in records_by_user.values() ]
+        await asyncio.gather(*tasks)
+    return stats
+
+def print_replay_stats(stats : ReplayStats, recorded_seconds : float, elapsed : float):
+    print(f"Replayed: {stats.sent} webhooks ({stats.failed} failed)")
+    print(f"Recorded over {recorded_seconds:.1f} seconds, replayed in {elapsed:.1f} seconds ({recorded_seconds / elapsed:.2f}x)")
+    print(f"Throughput: {stats.sent / elapsed:.2f} webhooks/sec")
+    if stats.lag_seconds:
+        lags = sorted(stats.lag_seconds)
+        print(f"Behind schedule: p50={percentile(lags, 50) * 1000:.1f}ms p95={percentile(lags, 95) * 1000:.1f}ms max={lags[-1] * 1000:.1f}ms")
+
+def do_it(args : Namespace):
+    records = read_traffic(args.file)
+    if not records:
+        print(f"No webhooks recorded in {args.file}")
+        return
+    recorded_seconds = records[-1]["timestamp"] - records[0]["timestamp"]
+    start = time.monotonic()
+    stats = asyncio.run(replay(records, args))
+    print_replay_stats(stats, recorded_seconds, max(time.monotonic() - start, 1e-9))
+
+if __name__ == "__main__":
+    args = parse_args()
+    do_it(args)
@@ -1,7 +1,7 @@
 import json, subprocess, requests
-import tomli
 from typing import Dict, Union
 from urllib.parse import urljoin
+from dev.local_dev_common import get_wrangler_toml, get_dev_vars
 
 
 LOGIN_COMMAND                         = "npx wrangler login"
@@ -26,7 +26,7 @@ def wrangler_whoami():
                    shell = True)
     
 def print_wrangler_environment_variables(env : str):
-    parsed_toml = _parse_toml_file("./wrangler.toml")
+    parsed_toml = get_wrangler_toml()
     environment_variables = parsed_toml["env"][env]["vars"]
     max_key_length = max(map(len,environment_variables))
     print("")
@@ -44,8 +44,8 @@ def is_empty_or_none(string : Union[str,None]):
     return string is None or string.strip() == ''
 
 def get_secrets(env : str) -> Dict[str,str]:
-    with open(f".dev.vars.{env}", "rb") as f:
-        return tomli.load(f)
+    # A copy: the parsed file is cached (see get_config in local_dev_common.py)
+    return dict(get_dev_vars(env))
     
 def get_secret(key : str, env : str):
     toml_vars = get_secrets(env)
@@ -81,7 +81,7 @@ def make_telegram_bot_url(env : str):
 
 def get_wrangler_toml_property(property_path : str, env : str):
     path_tokens = property_path.split(".")
-    parsed_toml = _parse_toml_file("./wrangler.toml")
+    parsed_toml = get_wrangler_toml()
     obj = parsed_toml
     pathSoFar = ""
     for token in path_tokens:
@@ -92,17 +92,13 @@ def get_wrangler_toml_property(property_path : str, env : str):
     return obj
 
 def get_environment_variables(env : str):
-    parsed_toml = _parse_toml_file("./wrangler.toml")
+    parsed_toml = get_wrangler_toml()
     return parsed_toml["env"][env]["vars"]
 
 def get_worker_name(env : str):
-    parsed_toml = _parse_toml_file("./wrangler.toml")
+    parsed_toml = get_wrangler_toml()
     return parsed_toml["name"]
 
-def _parse_toml_file(filepath : str):
-    with open(filepath, "rb") as f:
-        return tomli.load(f)
-
 def get_environment_variable(key : str, env : str):
     env_vars = get_environment_variables(env)
     value = env_vars.get(key)